@@ -0,0 +1,361 @@
+import os
+import struct
+import time
+import zlib
+from itertools import chain
+from typing import NamedTuple, Optional
+import numpy as np
+from history import RECORD_SIZE, HistoryStore
+
+# Запись файла истории (history.RECORD, '<d8siid16s') как тип NumPy:
+# файл читается как массив структур без разбора каждой записи
+RECORD_DTYPE = np.dtype([('timestamp', '<f8'), ('service', 'S8'),
+                         ('country', '<i4'), ('count', '<i4'),
+                         ('price', '<f8'), ('provider', 'S16')])
+QUANTILES = (0.1, 0.5, 0.9)
+_SPARK = '▁▂▃▄▅▆▇█'
+
+
+class CountryPrices(NamedTuple):
+    country: int
+    samples: int
+    low: float
+    p10: float
+    median: float
+    p90: float
+    high: float
+
+
+class Report(NamedTuple):
+    '''
+    Итоги истории за [start, end]: число замеров и пар (сервис, страна)
+    по поставщикам,
+    пополнения по часам суток (местное время), длительности завершившихся
+    окон наличия номеров в секундах, число окон, еще не закончившихся к
+    концу периода, и цены по странам (по замерам с номерами в наличии).
+    '''
+    start: float
+    end: float
+    samples: int
+    pairs: int
+    restocks_by_hour: np.ndarray
+    windows: np.ndarray
+    open_windows: int
+    prices: list[CountryPrices]
+
+
+def _file_range(path: str,
+                start: float,
+                end: float,
+                boundary: float) -> tuple[Optional[np.memmap], int, int]:
+    '''
+    Файл истории, отображенный в память, и границы записей за [start, end]
+    и раньше boundary в нем (бинарный поиск по столбцу времени).
+    Заголовок файла пропускается.
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) < 2 * RECORD_SIZE:
+        return None, 0, 0
+    total = os.path.getsize(path) // RECORD_SIZE - 1
+    data = np.memmap(path, RECORD_DTYPE, mode='r', offset=RECORD_SIZE,
+                     shape=(total,))
+    timestamps = data['timestamp']
+    last = min(np.searchsorted(timestamps, end, 'right'),
+               np.searchsorted(timestamps, boundary, 'left'))
+    return data, int(np.searchsorted(timestamps, start, 'left')), int(last)
+
+
+def _keep(batch: np.ndarray,
+          start: float,
+          end: float,
+          service: Optional[bytes],
+          country: Optional[int]) -> np.ndarray:
+    timestamps = batch['timestamp']
+    keep = (timestamps >= start) & (timestamps <= end)
+    if service is not None:
+        keep &= batch['service'] == service
+    if country is not None:
+        keep &= batch['country'] == country
+    return keep
+
+
+def load_records(store: HistoryStore,
+                 start: float,
+                 end: Optional[float] = None,
+                 service: Optional[str] = None,
+                 country: Optional[int] = None,
+                 batch_size: int = 1 << 16) -> np.ndarray:
+    '''
+    То же, что HistoryStore.query, но массивом RECORD_DTYPE: файл
+    читается пакетами по batch_size записей сразу в итоговый массив, хвост
+    в памяти дописывается в конец. Каждая операция NumPy обрабатывает не
+    больше пакета, поэтому поток чтения не держит GIL подолгу. Чтение
+    блокирующее: из асинхронного кода вызывается через asyncio.to_thread.
+    '''
+    if end is None:
+        end = time.time()
+    encoded = service.encode()[:8] if service is not None else None
+    tail = store.tail.copy()
+    recent = np.array([(record.timestamp, record.service.encode()[:8],
+                        record.country, record.count, record.price,
+                        record.provider.encode()[:16])
+                       for record in tail], RECORD_DTYPE)
+    data, first, last = None, 0, 0
+    if not tail or tail[0].timestamp > start:
+        # Файл может отставать от хвоста на еще не записанные пакеты
+        data, first, last = _file_range(
+            store.path, start, end,
+            tail[0].timestamp if tail else float('inf')
+        )
+    records = np.empty(max(last - first, 0) + len(recent), RECORD_DTYPE)
+    size = 0
+    batches = (data[offset:min(offset + batch_size, last)]
+               for offset in range(first, last, batch_size))
+    for batch in chain(batches, (recent,)):
+        keep = _keep(batch, start, end, encoded, country)
+        count = int(keep.sum())
+        np.compress(keep, batch, out=records[size:size + count])
+        size += count
+    return records[:size]
+
+
+def _codes(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Различные значения столбца (по возрастанию) и номер каждого значения
+    в них. Различных сервисов, стран и цен немного, поэтому список
+    собирается по выборке и дополняется пропущенными значениями без
+    сортировки всего столбца.
+    '''
+    known = np.unique(values[::1024])
+    if len(known) == 1 and (values == known[0]).all():
+        # Частый случай для поставщика: одно значение на весь столбец
+        return known, np.zeros(len(values), np.intp)
+    while True:
+        codes = np.searchsorted(known, values)
+        missing = known[np.minimum(codes, len(known) - 1)] != values
+        if not missing.any():
+            return known, codes
+        known = np.union1d(known, values[missing])
+
+
+def _text_codes(values: np.ndarray) -> tuple[int, np.ndarray]:
+    '''
+    Число различных значений столбца байтовых строк и номер каждого
+    значения. Строка сравнивается по 8 байт как целые числа, это
+    быстрее сравнения строк.
+    '''
+    words = np.ascontiguousarray(values).view('<u8').reshape(len(values), -1)
+    size = 1
+    codes = np.zeros(len(values), np.intp)
+    for column in words.T:
+        known, column_codes = _codes(column)
+        size *= len(known)
+        codes = codes * len(known) + column_codes
+    return size, codes
+
+
+def _stable_order(keys: np.ndarray) -> np.ndarray:
+    # Устойчивая сортировка 16-битных ключей - поразрядная, за O(n)
+    if keys.max() < 1 << 16:
+        keys = keys.astype(np.uint16)
+    return np.argsort(keys, kind='stable')
+
+
+def _price_stats(country: np.ndarray,
+                 price: np.ndarray,
+                 max_cells: int = 1 << 22) -> list[CountryPrices]:
+    '''
+    Минимум, квантили QUANTILES и максимум цены по странам. Если таблица
+    страна x цена не больше max_cells, квантили находятся по гистограммам
+    цен (bincount), иначе - сортировкой.
+    '''
+    countries, country_codes = _codes(country)
+    values, price_codes = _codes(price)
+    if len(countries) * len(values) <= max_cells:
+        histogram = np.bincount(country_codes * len(values) + price_codes,
+                                minlength=len(countries) * len(values))
+        cumulative = histogram.reshape(len(countries), -1).cumsum(axis=1)
+        sizes = cumulative[:, -1]
+        columns = [values[(cumulative <= np.floor(q * (sizes - 1))[:, None])
+                          .sum(axis=1)]
+                   for q in (0, *QUANTILES, 1)]
+    else:
+        order = np.lexsort((price, country_codes))
+        price = price[order]
+        sizes = np.bincount(country_codes, minlength=len(countries))
+        starts = np.concatenate(([0], sizes.cumsum()[:-1]))
+        columns = [price[starts + np.floor(q * (sizes - 1)).astype(np.intp)]
+                   for q in (0, *QUANTILES, 1)]
+    prices = [CountryPrices(*values) for values in zip(
+        countries.tolist(), sizes.tolist(),
+        *(column.tolist() for column in columns)
+    )]
+    prices.sort(key=lambda item: (-item.samples, item.country))
+    return prices
+
+
+def analyze(records: np.ndarray,
+            start: float,
+            end: float,
+            utc_offset: Optional[int] = None) -> Report:
+    '''
+    Итоги по массиву записей RECORD_DTYPE, упорядоченных по времени (как
+    их возвращает load_records). Записи группируются по парам (сервис,
+    страна) каждого поставщика с сохранением порядка; переходы между
+    соседними замерами одной пары дают пополнения (нет номеров -> есть) и
+    окна наличия. Час
+    пополнения считается со смещением utc_offset (по умолчанию смещение
+    местного времени на конец периода).
+    '''
+    if utc_offset is None:
+        utc_offset = time.localtime(end).tm_gmtoff
+    if not len(records):
+        return Report(start, end, 0, 0, np.zeros(24, np.int64),
+                      np.empty(0), 0, [])
+    # Записи уже идут по времени, поэтому достаточно устойчивой
+    # сортировки по номеру пары
+    services, service_codes = _text_codes(records['service'])
+    _, provider_codes = _text_codes(records['provider'])
+    countries, country_codes = _codes(records['country'])
+    pair = (provider_codes * services + service_codes) * len(countries) \
+        + country_codes
+    order = _stable_order(pair)
+    # Переставляются только нужные столбцы: выборка записей целиком по
+    # 48 байт заметно дольше
+    pair = pair[order]
+    timestamps = records['timestamp'][order]
+    # first - первый замер пары, last - последний
+    first = np.ones(len(order), bool)
+    first[1:] = pair[1:] != pair[:-1]
+    last = np.ones(len(order), bool)
+    last[:-1] = first[1:]
+    available = records['count'][order] > 0
+    # Были ли номера в предыдущем замере той же пары
+    before = np.zeros(len(order), bool)
+    before[1:] = available[:-1]
+    before &= ~first
+
+    restocks = available & ~before & ~first
+    hours = (timestamps[restocks] + utc_offset) // 3600 % 24
+    by_hour = np.bincount(hours.astype(np.intp), minlength=24)
+
+    # Окно открывается замером с номерами после замера без них (или
+    # первым замером пары) и закрывается первым замером без номеров; у
+    # незакрытого окна концом считается последний замер пары. Внутри пары
+    # открытия и закрытия чередуются, поэтому их индексы идут парами
+    opens = np.flatnonzero(available & ~before)
+    closes = np.flatnonzero(~available & before | available & last)
+    still_open = available[closes]
+    durations = timestamps[closes] - timestamps[opens]
+
+    available = records['count'] > 0
+    prices = _price_stats(records['country'][available],
+                          records['price'][available])
+    return Report(start, end, len(records), int(first.sum()), by_hour,
+                  durations[~still_open], int(still_open.sum()), prices)
+
+
+def build_report(store: HistoryStore,
+                 start: float,
+                 end: Optional[float] = None,
+                 country: Optional[int] = None) -> Report:
+    '''
+    Отчет по истории за [start, end]; блокирующий, для asyncio.to_thread.
+    '''
+    if end is None:
+        end = time.time()
+    return analyze(load_records(store, start, end, country=country),
+                   start, end)
+
+
+def _duration(seconds: float) -> str:
+    if seconds < 60:
+        return "<1 мин"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} сут"
+
+
+def format_report(report: Report, limit: int = 10) -> str:
+    '''
+    Отчет для команды /report: пополнения по часам строкой из столбиков,
+    длительность наличия номеров и цены limit стран с наибольшим числом
+    замеров.
+    '''
+    if not report.samples:
+        return "Нет данных за этот период"
+    period = " - ".join(time.strftime('%d.%m.%Y', time.localtime(moment))
+                        for moment in (report.start, report.end))
+    lines = [f"Отчет {period}: замеров {report.samples}, "
+             f"пар сервис/страна {report.pairs}"]
+    by_hour = report.restocks_by_hour
+    total = int(by_hour.sum())
+    if total:
+        levels = by_hour * (len(_SPARK) - 1) // by_hour.max()
+        lines.append("Пополнения по часам 0-23: "
+                     + "".join(_SPARK[level] for level in levels))
+        lines.append(f"всего {total}, чаще всего в "
+                     f"{int(by_hour.argmax()):02d}:00")
+    else:
+        lines.append("Пополнений не было")
+    windows = report.windows
+    if len(windows):
+        median, p90 = np.quantile(windows, (0.5, 0.9))
+        line = (f"Номера в наличии: окон {len(windows)}, медиана "
+                f"{_duration(median)}, 90% - до {_duration(p90)}, "
+                f"дольше всего {_duration(windows.max())}")
+    else:
+        line = "Завершившихся окон наличия нет"
+    if report.open_windows:
+        line += f", сейчас в наличии {report.open_windows}"
+    lines.append(line)
+    if report.prices:
+        lines.append("Цены (замеров: мин / p10 / медиана / p90 / макс):")
+        for item in report.prices[:limit]:
+            lines.append(f"страна {item.country} ({item.samples}): "
+                         f"{item.low:g} / {item.p10:g} / {item.median:g} / "
+                         f"{item.p90:g} / {item.high:g}")
+        if len(report.prices) > limit:
+            lines.append(f"и еще стран: {len(report.prices) - limit}")
+    return "\n".join(lines)
+
+
+def _png(image: np.ndarray) -> bytes:
+    '''
+    PNG из массива RGB (высота, ширина, 3) uint8 без сторонних пакетов.
+    '''
+    height, width, _ = image.shape
+    # Перед каждой строкой - байт фильтра 0 (без фильтра)
+    raw = np.hstack([np.zeros((height, 1), np.uint8),
+                     image.reshape(height, -1)]).tobytes()
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data \
+            + struct.pack('>I', zlib.crc32(kind + data))
+
+    return b'\x89PNG\r\n\x1a\n' \
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0,
+                                     0)) \
+        + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+
+def render_chart(report: Report,
+                 width: int = 480,
+                 height: int = 200) -> bytes:
+    '''
+    Столбчатая диаграмма пополнений по часам суток (PNG): 24 столбца
+    слева направо с 00 часов, метки через каждые 6 часов под осью.
+    '''
+    image = np.full((height, width, 3), 255, np.uint8)
+    bar = width // 24
+    top = height - 12
+    by_hour = report.restocks_by_hour
+    heights = by_hour * (top - 4) // max(int(by_hour.max()), 1)
+    for hour, size in enumerate(heights.tolist()):
+        left = hour * bar
+        image[top - size:top, left + 2:left + bar - 2] = (66, 133, 244)
+        if hour % 6 == 0:
+            image[top:top + 8, left:left + 2] = 0
+    image[top:top + 2, :24 * bar] = 0
+    return _png(image)
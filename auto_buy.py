@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Iterable, Optional
+from http_client import HttpClient
+from metrics import metrics
+from targets import with_query
+from watch_rules import Match, WatchRule
+
+
+class Purchase:
+    '''
+    Купленный номер: активация activation_id с номером phone по
+    срабатыванию match. detected_at и purchased_at - моменты получения
+    ответа с предложением и ответа на покупку по монотонным часам.
+    '''
+    __slots__ = ('match', 'activation_id', 'phone', 'detected_at',
+                 'purchased_at')
+
+    def __init__(self,
+                 match: Match,
+                 activation_id: str,
+                 phone: str,
+                 detected_at: float,
+                 purchased_at: float):
+        self.match = match
+        self.activation_id = activation_id
+        self.phone = phone
+        self.detected_at = detected_at
+        self.purchased_at = purchased_at
+
+    def describe(self) -> str:
+        return (f"Куплен номер {self.phone} ({self.match.service}, страна "
+                f"{self.match.country}, цена {self.match.price}), "
+                f"активация {self.activation_id}")
+
+
+def rule_key(rule: WatchRule) -> tuple:
+    return (rule.chat_id, rule.service, rule.country, rule.max_price)
+
+
+class AutoBuyer:
+    '''
+    Автоматическая покупка номеров (getNumber) по правилам с auto_buy.
+    Покупка идет через тот же пул соединений, что и опрос, поэтому
+    соединение с API к моменту срабатывания уже открыто. Перед покупкой
+    проверяется баланс из кэша; за окно window секунд совершается не
+    больше max_purchases покупок, а траты по правилу не превышают его
+    max_spend. Время от получения ответа с предложением до ответа на
+    покупку записывается в метрику detection_to_purchase_seconds.
+    '''
+    def __init__(self,
+                 client: HttpClient,
+                 url_template: str,
+                 balance: Callable[[], Awaitable[float]],
+                 window: float = 3600,
+                 max_purchases: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        self.client = client
+        self.url_template = url_template
+        self.balance = balance
+        self.window = window
+        self.max_purchases = max_purchases
+        self.clock = clock
+        # (время, правило, цена) покупок за последнее окно
+        self._spent: deque[tuple[float, tuple, float]] = deque()
+
+    async def warm(self) -> None:
+        '''
+        Заполняет кэш баланса и открывает соединение с API заранее.
+        '''
+        try:
+            await self.balance()
+        except Exception:
+            logging.exception("Не удалось получить баланс для автопокупки")
+
+    def _allowed(self, match: Match, reserved: list[tuple]) -> bool:
+        now = self.clock()
+        while self._spent and self._spent[0][0] < now - self.window:
+            self._spent.popleft()
+        spent = list(self._spent) + reserved
+        if len(spent) >= self.max_purchases:
+            return False
+        max_spend = match.rule.max_spend
+        key = rule_key(match.rule)
+        return max_spend is None or sum(
+            price for _, rule, price in spent if rule == key
+        ) + match.price <= max_spend
+
+    async def buy(self,
+                  candidates: Iterable[tuple[Match, float]]
+                  ) -> list[Purchase]:
+        '''
+        Покупает по одному номеру для каждой пары (сервис, страна) среди
+        срабатываний candidates (пары (срабатывание, момент обнаружения)),
+        если позволяют лимиты и баланс. Покупки выполняются одновременно;
+        в лимиты засчитываются только удавшиеся.
+        '''
+        chosen: dict[tuple[str, int], tuple[Match, float]] = {}
+        for match, detected_at in candidates:
+            chosen.setdefault((match.service, match.country),
+                              (match, detected_at))
+        if not chosen:
+            return []
+        try:
+            available = await self.balance()
+        except Exception:
+            logging.exception("Не удалось получить баланс для автопокупки")
+            return []
+        reserved: list[tuple] = []
+        orders = []
+        for match, detected_at in chosen.values():
+            if match.price > available:
+                metrics.counter('auto_buy_no_balance').inc()
+                continue
+            if not self._allowed(match, reserved):
+                metrics.counter('auto_buy_limited').inc()
+                continue
+            available -= match.price
+            reservation = (self.clock(), rule_key(match.rule), match.price)
+            reserved.append(reservation)
+            orders.append((reservation, match, detected_at))
+        self._spent.extend(reserved)
+        purchases = await asyncio.gather(
+            *(self._reserved_order(reservation, match, detected_at)
+              for reservation, match, detected_at in orders)
+        )
+        return [purchase for purchase in purchases if purchase is not None]
+
+    async def _reserved_order(self,
+                              reservation: tuple,
+                              match: Match,
+                              detected_at: float) -> Optional[Purchase]:
+        '''
+        Покупка под резервом лимитов: если номер купить не удалось, резерв
+        снимается и не расходует лимит покупок и трат.
+        '''
+        purchase = None
+        try:
+            purchase = await self._order(match, detected_at)
+        finally:
+            if purchase is None and reservation in self._spent:
+                self._spent.remove(reservation)
+        return purchase
+
+    async def _order(self,
+                     match: Match,
+                     detected_at: float) -> Optional[Purchase]:
+        url = with_query(self.url_template,
+                         action='getNumber',
+                         service=match.service,
+                         country=str(match.country),
+                         maxPrice=str(match.rule.max_price))
+        try:
+            text = await self.client.get_text(url)
+        except Exception:
+            metrics.counter('auto_buy_errors').inc()
+            logging.exception("Ошибка покупки номера %s/%s",
+                              match.service, match.country)
+            return None
+        purchased_at = self.clock()
+        if not text.startswith('ACCESS_NUMBER:'):
+            # NO_NUMBERS, NO_BALANCE и т.п.: номера уже разобрали
+            metrics.counter('auto_buy_missed').inc()
+            logging.info("Покупка %s/%s не удалась: %s",
+                         match.service, match.country, text[:100])
+            return None
+        _, activation_id, phone = text.strip().split(':', 2)
+        metrics.histogram('detection_to_purchase_seconds').observe(
+            purchased_at - detected_at
+        )
+        metrics.counter('auto_buy_purchases').inc()
+        return Purchase(match, activation_id, phone, detected_at,
+                        purchased_at)
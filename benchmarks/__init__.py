@@ -0,0 +1,5 @@
+'''
+Бенчмарки бота. Запускаются из корня репозитория:
+
+    python -m benchmarks.<имя_модуля>
+'''
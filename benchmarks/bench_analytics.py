@@ -0,0 +1,133 @@
+'''
+Отчет /report (analytics.py) по истории за год: файл истории из
+--services x --countries пар с замером раз в --step секунд (наличие
+номеров включается и выключается случайно).
+- report: время чтения файла и расчета отчета за год и за 30 суток;
+  для сравнения - /history (HistoryStore.query + summarize) за 30 суток;
+- loop: наибольшее опоздание таймера цикла событий, пока отчет за год
+  считается в asyncio.to_thread и прямо в цикле событий.
+
+    python -m benchmarks.bench_analytics [--services 3] [--countries 30]
+        [--step 600]
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from analytics import RECORD_DTYPE, build_report, format_report, render_chart
+from history import HEADER, HistoryStore, summarize
+from offers import DEFAULT_PROVIDER
+
+YEAR = 365 * 86400
+
+
+def make_history(path: str,
+                 services: int,
+                 countries: int,
+                 step: float,
+                 end: float) -> int:
+    '''
+    Пишет историю за год до end по месяцам, чтобы не держать весь год в
+    памяти при создании.
+    '''
+    rng = np.random.default_rng(1)
+    pairs = services * countries
+    moments = np.arange(end - YEAR, end, step)
+    available = np.zeros(pairs, bool)
+    with open(path, 'wb') as file:
+        file.write(HEADER)
+        for chunk in np.array_split(moments, 12):
+            records = np.zeros((len(chunk), pairs), RECORD_DTYPE)
+            records['timestamp'] = chunk[:, None]
+            records['service'] = np.repeat(
+                [f"s{i}".encode() for i in range(services)], countries)
+            records['country'] = np.tile(np.arange(countries), services)
+            records['provider'] = DEFAULT_PROVIDER.encode()
+            # Наличие меняется с вероятностью 5% на замер
+            flips = rng.random((len(chunk), pairs)) < 0.05
+            state = np.logical_xor.accumulate(
+                np.vstack([available, flips]), axis=0)[1:]
+            available = state[-1]
+            records['count'] = state * rng.integers(1, 50, state.shape)
+            records['price'] = rng.integers(5, 30, state.shape)
+            records.tofile(file)
+    return len(moments) * pairs
+
+
+def timed(function, *args, **kwargs) -> tuple[float, object]:
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+async def loop_lag(report) -> float:
+    '''
+    Наибольшее опоздание таймера, срабатывающего каждые 10 мс, пока
+    выполняется report().
+    '''
+    lag = 0.0
+    stop = False
+
+    async def ticker() -> None:
+        nonlocal lag
+        while not stop:
+            expected = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - expected)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    await report()
+    stop = True
+    await tick
+    return round(lag * 1000, 1)
+
+
+async def loop(store: HistoryStore, end: float) -> dict:
+    async def in_thread() -> None:
+        await asyncio.to_thread(build_report, store, end - YEAR, end)
+
+    async def inline() -> None:
+        build_report(store, end - YEAR, end)
+
+    return {"scenario": "loop",
+            "to_thread_lag_max_ms": await loop_lag(in_thread),
+            "inline_lag_max_ms": await loop_lag(inline)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', type=int, default=3)
+    parser.add_argument('--countries', type=int, default=30)
+    parser.add_argument('--step', type=float, default=600)
+    args = parser.parse_args()
+    end = time.time()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.bin')
+        written = make_history(path, args.services, args.countries,
+                               args.step, end)
+        store = HistoryStore(path)
+        year_s, report = timed(build_report, store, end - YEAR, end)
+        month_s, _ = timed(build_report, store, end - 30 * 86400, end)
+        query_s, records = timed(store.query, end - 30 * 86400, end)
+        summary_s, _ = timed(summarize, records)
+        image = render_chart(report)
+        result = [{"scenario": "report",
+                   "records": written,
+                   "file_mib": round(os.path.getsize(path) / 2 ** 20),
+                   "year_report_s": round(year_s, 2),
+                   "month_report_s": round(month_s, 3),
+                   "month_history_summary_s": round(query_s + summary_s, 2),
+                   "chart_png_bytes": len(image),
+                   "message_chars": len(format_report(report)),
+                   "message": format_report(report).splitlines()[:4]},
+                  asyncio.run(loop(store, end))]
+        asyncio.run(store.close())
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''
+Время от обнаружения предложения до покупки номера (getNumber) против
+локальной заглушки SMS Activate: с покупкой через общий пул соединений
+опроса (соединение уже открыто) и через новый клиент (холодное
+соединение). Также проверяет, что лимит покупок за окно соблюдается.
+
+    python -m benchmarks.bench_auto_buy [--rounds 30] [--latency 0.02]
+'''
+import argparse
+import asyncio
+import json
+from auto_buy import AutoBuyer
+from http_client import HttpClient
+from number_checker import NumberChecker
+from sms_service import SmsService
+from watch_rules import WatchEngine, WatchRule
+from benchmarks.bench_e2e import percentiles
+from benchmarks.stubs import SmsActivateStub, make_top_countries_payload
+
+
+class NullBot:
+    async def send_message(self, chat_id: int, text: str) -> None:
+        pass
+
+
+async def run_mode(warm: bool,
+                   rounds: int,
+                   latency: float,
+                   limit: int) -> dict:
+    in_stock = make_top_countries_payload(price=8)
+    sold_out = make_top_countries_payload(price=50)
+    stub = SmsActivateStub(sold_out, balance=10000, latency=latency)
+    base = await stub.start()
+    url = f"{base}?api_key=bench&action=getTopCountriesByService&service=ig"
+    balance_url = f"{base}?api_key=bench&action=getBalance"
+    engine = WatchEngine([WatchRule(service='ig', country=137, max_price=9,
+                                    auto_buy=True)])
+    client = HttpClient()
+    checker = NumberChecker(SmsService(1), url, balance_url, engine, client,
+                            cache_ttl=60)
+
+    async def balance() -> float:
+        return (await checker.fetch_balance())[0]
+
+    samples = []
+
+    async def buy_and_record(buyer: AutoBuyer, candidates) -> list:
+        purchases = await AutoBuyer.buy(buyer, candidates)
+        samples.extend(purchase.purchased_at - purchase.detected_at
+                       for purchase in purchases)
+        return purchases
+
+    bot = NullBot()
+    try:
+        buyer = AutoBuyer(client, balance_url, balance,
+                          max_purchases=limit)
+        await buyer.warm()
+        buyer.buy = lambda candidates: buy_and_record(buyer, candidates)
+        checker.buyer = buyer
+        for _ in range(rounds + 2):
+            if not warm:
+                # Новый пул на каждую покупку: соединение устанавливается
+                # уже после обнаружения предложения
+                buyer.client = HttpClient()
+            stub.set_payload(sold_out)
+            await checker.check_targets(bot)
+            stub.set_payload(in_stock)
+            await checker.check_targets(bot)
+            if not warm:
+                await buyer.client.close()
+    finally:
+        await checker.close()
+        await checker.sms_service.close()
+        await stub.stop()
+    return {"pool": "warm" if warm else "cold",
+            "limit": limit,
+            "purchases": len(stub.purchases),
+            "detection_to_purchase": percentiles(samples)}
+
+
+async def run(rounds: int, latency: float) -> list[dict]:
+    return [await run_mode(True, rounds, latency, rounds + 2),
+            await run_mode(False, rounds, latency, rounds + 2),
+            # Лимит меньше числа появлений предложения
+            await run_mode(True, rounds, latency, 3)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.rounds, args.latency)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+Распределение целей между воркерами через общее хранилище SQLite:
+каждая цель принадлежит ровно одному воркеру, после остановки воркера
+(без освобождения аренд, как при падении) его цели переходят к
+остальным. Отчет: доли воркеров, время перераспределения и доля
+переехавших целей.
+
+    python -m benchmarks.bench_cluster [--workers 3] [--targets 60]
+        [--ttl 1.5]
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from cluster import ConsistentHashRing, ShardCoordinator, SqliteStore
+
+
+def check_partition(coordinators: list[ShardCoordinator],
+                    keys: set[str]) -> bool:
+    '''
+    Каждый воркер владеет ровно своей частью кольца живых воркеров.
+    '''
+    ring = ConsistentHashRing(coordinator.worker_id
+                              for coordinator in coordinators)
+    return all(coordinator.owned == {key for key in keys
+                                     if ring.owner(key)
+                                     == coordinator.worker_id}
+               for coordinator in coordinators)
+
+
+async def wait_partition(coordinators: list[ShardCoordinator],
+                         keys: set[str],
+                         timeout: float) -> float:
+    started = time.perf_counter()
+    while not check_partition(coordinators, keys):
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError("Цели не распределены")
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - started
+
+
+async def run(workers: int, targets: int, ttl: float) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), 'cluster.db')
+    keys = {f"default:s{i}" for i in range(targets)}
+    coordinators = [ShardCoordinator(SqliteStore(path), f"worker-{i}", keys,
+                                     ttl=ttl)
+                    for i in range(workers)]
+    for coordinator in coordinators:
+        await coordinator.start()
+    for coordinator in coordinators:
+        coordinator.set_keys(keys)
+    initial = await wait_partition(coordinators, keys, ttl * 5)
+    before = {coordinator.worker_id: set(coordinator.owned)
+              for coordinator in coordinators}
+    leaders = sum(coordinator.leader.is_set()
+                  for coordinator in coordinators)
+
+    # Падение воркера: аренды не освобождаются и истекают по TTL
+    dead = coordinators.pop()
+    dead._task.cancel()
+    rebalance = await wait_partition(coordinators, keys, ttl * 5)
+    moved = sum(len(coordinator.owned - before[coordinator.worker_id])
+                for coordinator in coordinators)
+
+    duplicates = [await coordinator.claim("1:new:ig:137:8:5")
+                  for coordinator in coordinators]
+    for coordinator in coordinators:
+        await coordinator.close()
+    await dead.store.close()
+    return {"workers": workers,
+            "targets": targets,
+            "lease_ttl_s": ttl,
+            "initial_shares": sorted(map(len, before.values())),
+            "initial_partition_s": round(initial, 3),
+            "leaders": leaders,
+            "rebalance_after_crash_s": round(rebalance, 3),
+            "moved_targets": moved,
+            "dead_worker_targets": len(before[dead.worker_id]),
+            "notification_claims": duplicates}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--targets', type=int, default=60)
+    parser.add_argument('--ttl', type=float, default=1.5)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.workers, args.targets, args.ttl)),
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
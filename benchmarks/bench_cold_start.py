@@ -0,0 +1,104 @@
+'''
+Холодный запуск main.py отдельным процессом против локальных заглушек
+SMS Activate и Telegram Bot API (TELEGRAM_API_URL). Для каждого запуска
+измеряется время от старта процесса до первого ответа API SMS Activate
+(первый опрос), до первого запроса к Bot API (aiogram загружен), до
+set_my_commands и до первого уведомления. Отчет в JSON с версией кода;
+для отслеживания регрессий его можно дописывать в файл.
+
+    python -m benchmarks.bench_cold_start [--runs 5] [--output FILE]
+'''
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+from benchmarks.bench_e2e import percentiles, version
+from benchmarks.stubs import (SmsActivateStub, TelegramStub,
+                              make_top_countries_payload)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def first(events: list[tuple[float, str]], name: str) -> float:
+    return next(moment for moment, event in events if event == name)
+
+
+async def cold_start(sms: SmsActivateStub,
+                     telegram: TelegramStub,
+                     sms_url: str,
+                     telegram_url: str,
+                     timeout: float) -> dict:
+    sms.served.clear()
+    telegram.calls.clear()
+    mark = len(telegram.sent)
+    env = dict(os.environ,
+               PYTHONPATH=ROOT,
+               TOKEN='123456:bench',
+               ADMIN_ID='1',
+               URL_SMS_ACTIVATE=f"{sms_url}?api_key=bench"
+                                "&action=getTopCountriesByService&service=ig",
+               URL_API_SMS=f"{sms_url}?api_key=bench&action=getBalance",
+               WATCH_RULES='[{"service": "ig", "country": 137, '
+                           '"max_price": 9}]',
+               TELEGRAM_API_URL=telegram_url)
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, 'main.py'),
+            cwd=directory, env=env
+        )
+        try:
+            alert = await telegram.wait_message(
+                lambda text: 'доступно' in text, since=mark,
+                timeout=timeout
+            )
+        finally:
+            process.send_signal(signal.SIGINT)
+            await process.wait()
+    return {"first_poll": first(sms.served, 'getTopCountriesByService')
+            - started,
+            "bot_api_ready": telegram.calls[0][0] - started,
+            "set_my_commands": first(telegram.calls, 'setMyCommands')
+            - started,
+            "first_alert": alert[0] - started}
+
+
+async def run(runs: int, timeout: float) -> dict:
+    sms = SmsActivateStub(make_top_countries_payload(price=8))
+    telegram = TelegramStub()
+    sms_url = await sms.start()
+    telegram_url = await telegram.start()
+    samples: dict[str, list[float]] = {}
+    try:
+        for _ in range(runs):
+            result = await cold_start(sms, telegram, sms_url, telegram_url,
+                                      timeout)
+            for name, value in result.items():
+                samples.setdefault(name, []).append(value)
+    finally:
+        await sms.stop()
+        await telegram.stop()
+    return {"version": version(),
+            "runs": runs,
+            **{name: percentiles(values) for name, values in samples.items()}}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', help="дописать отчет в файл (JSON Lines)")
+    args = parser.parse_args()
+    report = asyncio.run(run(args.runs, args.timeout))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(report) + "\n")
+
+
+if __name__ == '__main__':
+    main()
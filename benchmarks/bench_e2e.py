@@ -0,0 +1,169 @@
+'''
+Сквозной нагрузочный бенчмарк: стек main.py (Dispatcher, BotHandler,
+NumberChecker) против локальных заглушек SMS Activate и Telegram Bot API.
+Отчет в JSON: задержка опроса (перцентили), время от появления номеров
+до доставки уведомления, пропускная способность отправки сообщений и
+память. Для сравнения версий результат можно сохранить в файл.
+
+    python -m benchmarks.bench_e2e [--entries 200] [--services 5]
+        [--latency 0.05] [--changes 5] [--messages 120] [--output FILE]
+'''
+import argparse
+import asyncio
+import json
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import Settings
+from main import build_app
+from benchmarks.stubs import (SmsActivateStub, TelegramStub,
+                              make_top_countries_payload)
+
+ADMIN_ID = 1
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    values = sorted(samples)
+    cuts = statistics.quantiles(values, n=100, method='inclusive') \
+        if len(values) > 1 else values * 99
+    return {"count": len(values),
+            "p50_ms": round(cuts[49] * 1000, 2),
+            "p95_ms": round(cuts[94] * 1000, 2),
+            "p99_ms": round(cuts[98] * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2)}
+
+
+def version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def run(args: argparse.Namespace) -> dict:
+    in_stock = make_top_countries_payload(args.entries, price=8)
+    sold_out = make_top_countries_payload(args.entries, price=50)
+    sms = SmsActivateStub(sold_out, latency=args.latency)
+    telegram = TelegramStub()
+    sms_url = await sms.start()
+    telegram_url = await telegram.start()
+
+    tracemalloc.start()
+    settings = Settings(
+        _env_file=None,
+        token='123456:bench',
+        admin_id=ADMIN_ID,
+        url_sms_activate=f"{sms_url}?api_key=bench"
+                         "&action=getTopCountriesByService&service=s0",
+        url_api_sms=f"{sms_url}?api_key=bench&action=getBalance",
+        watch_rules=[{"service": f"s{i}", "country": 137, "max_price": 9}
+                     for i in range(args.services)],
+        poll_min_interval=args.interval,
+        poll_initial_interval=args.interval,
+        poll_max_interval=args.interval * 4,
+        poll_jitter=0,
+        history_path='',
+        state_path='',
+        subscriptions_path='',
+        cache_ttl=0,
+    )
+    session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_url))
+    bot = Bot(settings.token, session=session)
+    dp, handler = build_app(settings, bot)
+
+    # Задержка каждого цикла опроса измеряется снаружи, без изменения кода
+    poll_samples: list[float] = []
+    poll = handler.number_checker.poll
+
+    async def timed_poll(*poll_args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await poll(*poll_args, **kwargs)
+        finally:
+            poll_samples.append(time.perf_counter() - started)
+    handler.number_checker.poll = timed_poll
+
+    polling = asyncio.create_task(dp.start_polling(bot,
+                                                   handle_signals=False))
+    try:
+        started = time.perf_counter()
+        telegram.push_command(ADMIN_ID, '/start')
+        await telegram.wait_message(lambda text: text == "Работаем")
+        command_latency = time.perf_counter() - started
+
+        delivery: list[float] = []
+        for _ in range(args.changes):
+            mark = len(telegram.sent)
+            sms.set_payload(in_stock)
+            changed_at = time.perf_counter()
+            delivered_at, _, _ = await telegram.wait_message(
+                lambda text: "доступно" in text, since=mark)
+            delivery.append(delivered_at - changed_at)
+            mark = len(telegram.sent)
+            sms.set_payload(sold_out)
+            await telegram.wait_message(lambda text: "закончились" in text,
+                                        since=mark)
+            # Лимит на чат не должен попадать в следующий замер
+            await asyncio.sleep(1 / handler.sms_service.chat_rate)
+
+        mark = len(telegram.sent)
+        started = time.perf_counter()
+        for chat_id in range(args.messages):
+            await handler.sms_service.send_message(bot, "bench",
+                                                   chat_id=1000 + chat_id)
+        await handler.sms_service.flush()
+        throughput = (len(telegram.sent) - mark) \
+            / (time.perf_counter() - started)
+
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        await dp.stop_polling()
+        await polling
+        await sms.stop()
+        await telegram.stop()
+
+    return {
+        "version": version(),
+        "params": {"entries": args.entries, "services": args.services,
+                   "latency_s": args.latency, "interval_s": args.interval,
+                   "changes": args.changes, "messages": args.messages},
+        "command_latency_ms": round(command_latency * 1000, 2),
+        "poll_latency": percentiles(poll_samples),
+        "change_to_delivery": percentiles(delivery),
+        "messages_per_second": round(throughput, 1),
+        "upstream_requests": sms.requests,
+        "memory": {"traced_peak_kib": round(peak / 1024),
+                   "max_rss_kib": resource.getrusage(
+                       resource.RUSAGE_SELF).ru_maxrss},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=200)
+    parser.add_argument('--services', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--interval', type=float, default=0.5)
+    parser.add_argument('--changes', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=120)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    result = json.dumps(asyncio.run(run(args)), indent=2)
+    print(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(result + "\n")
+
+
+if __name__ == '__main__':
+    main()
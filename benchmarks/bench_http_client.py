@@ -0,0 +1,60 @@
+'''
+Сравнение задержки одного опроса: новая ClientSession на каждый запрос
+(прежнее поведение) и общий HttpClient с пулом соединений.
+
+    python -m benchmarks.bench_http_client [--polls 200]
+'''
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import aiohttp
+from http_client import HttpClient
+from benchmarks.stubs import SmsActivateStub
+
+
+async def poll_new_session(url: str) -> None:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            json.loads(await response.read())
+
+
+async def measure(poll, polls: int) -> dict:
+    samples = []
+    for _ in range(polls):
+        started = time.perf_counter()
+        await poll()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+    }
+
+
+async def run(polls: int) -> dict:
+    stub = SmsActivateStub()
+    base = await stub.start()
+    url = f"{base}?action=getTopCountriesByService&service=ig"
+    client = HttpClient()
+    try:
+        before = await measure(lambda: poll_new_session(url), polls)
+        after = await measure(lambda: client.get_json(url), polls)
+    finally:
+        await client.close()
+        await stub.stop()
+    return {"polls": polls, "new_session": before, "pooled": after}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--polls', type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.polls)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
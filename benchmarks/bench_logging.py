@@ -0,0 +1,173 @@
+'''
+Логирование в цикле событий: прежний FileHandler (запись в файл в потоке
+цикла) против очереди с потоком записи (log_setup.setup_logging). Диск
+медленный: после каждой записи выполняется fsync. Для каждого варианта -
+задержка вызова logging.info и наибольшее опоздание таймера цикла
+событий, пока задачи пишут лог. Затем проверки: лог дописывается при
+перезапуске, ротация по размеру, прореживание DEBUG и записи JSON.
+
+    python -m benchmarks.bench_logging [--records 5000]
+'''
+import argparse
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import tempfile
+import time
+from log_setup import TEXT_DATEFMT, TEXT_FORMAT, setup_logging
+from benchmarks.bench_e2e import percentiles
+
+
+class FsyncMixin:
+    def flush(self) -> None:
+        super().flush()
+        if self.stream is not None:
+            os.fsync(self.stream.fileno())
+
+
+class FsyncFileHandler(FsyncMixin, logging.FileHandler):
+    pass
+
+
+class FsyncRotatingFileHandler(FsyncMixin,
+                               logging.handlers.RotatingFileHandler):
+    pass
+
+
+def reset_root() -> logging.Logger:
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    return root
+
+
+async def load(records: int) -> dict:
+    '''
+    Пишет records записей из нескольких задач и измеряет опоздание
+    таймера, срабатывающего каждую миллисекунду.
+    '''
+    calls = []
+    lag = 0.0
+    stop = False
+
+    async def ticker() -> None:
+        nonlocal lag
+        while not stop:
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - expected)
+
+    async def writer(worker: int) -> None:
+        for i in range(records // 10):
+            started = time.perf_counter()
+            logging.info("Опрос %s: %d предложений", f"w{worker}", i)
+            calls.append(time.perf_counter() - started)
+            if i % 20 == 0:
+                await asyncio.sleep(0)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(worker) for worker in range(10)))
+    elapsed = time.perf_counter() - started
+    stop = True
+    await tick
+    return {"call": percentiles(calls),
+            "loop_lag_max_ms": round(lag * 1000, 2),
+            "loop_busy_s": round(elapsed, 3)}
+
+
+def run_sync(directory: str, records: int) -> dict:
+    root = reset_root()
+    handler = FsyncFileHandler(os.path.join(directory, 'sync.log'),
+                               encoding='utf-8')
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT, TEXT_DATEFMT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    try:
+        return {"pipeline": "file_handler", **asyncio.run(load(records))}
+    finally:
+        reset_root()
+
+
+def run_queue(directory: str, records: int) -> dict:
+    path = os.path.join(directory, 'queue.log')
+    listener = setup_logging(path, queue_size=records * 2)
+    # Тот же медленный диск за очередью
+    slow = FsyncRotatingFileHandler(path, maxBytes=10 * 1024 * 1024,
+                                    encoding='utf-8')
+    slow.setFormatter(logging.Formatter(TEXT_FORMAT, TEXT_DATEFMT))
+    listener.handlers = (slow,)
+    try:
+        result = asyncio.run(load(records))
+        started = time.perf_counter()
+    finally:
+        listener.stop()
+        reset_root()
+    drained = time.perf_counter() - started
+    with open(path, encoding='utf-8') as file:
+        written = sum(1 for _ in file)
+    return {"pipeline": "queue", **result,
+            "drain_after_s": round(drained, 3), "written": written}
+
+
+def checks(directory: str) -> dict:
+    path = os.path.join(directory, 'app.log')
+    for run in range(2):
+        listener = setup_logging(path)
+        logging.info("Запуск %d", run)
+        listener.stop()
+    with open(path, encoding='utf-8') as file:
+        kept = sum('Запуск' in line for line in file)
+
+    rotated = os.path.join(directory, 'rotated.log')
+    listener = setup_logging(rotated, max_bytes=2000, backup_count=3)
+    for i in range(200):
+        logging.info("Запись %d", i)
+    listener.stop()
+    backups = sorted(name for name in os.listdir(directory)
+                     if name.startswith('rotated.log.'))
+
+    sampled = os.path.join(directory, 'sampled.log')
+    listener = setup_logging(sampled, logging.DEBUG, debug_sample=10)
+    for i in range(1000):
+        logging.debug("Ответ цели %d", i)
+    logging.warning("Предупреждение")
+    listener.stop()
+    with open(sampled, encoding='utf-8') as file:
+        sampled_lines = sum(1 for _ in file)
+
+    structured = os.path.join(directory, 'json.log')
+    listener = setup_logging(structured, json_format=True)
+    logging.info("Опрос %s", "ig", extra={"target": "ig", "offers": 3})
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logging.exception("Ошибка")
+    listener.stop()
+    with open(structured, encoding='utf-8') as file:
+        entries = [json.loads(line) for line in file]
+    reset_root()
+    return {"restarts_kept": kept,
+            "rotation_backups": len(backups),
+            "debug_1000_sampled_to": sampled_lines,
+            "json_fields": sorted(entries[0]),
+            "json_exception": "ZeroDivisionError" in entries[1]["exception"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=5000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        report = [run_sync(directory, args.records),
+                  run_queue(directory, args.records),
+                  checks(directory)]
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
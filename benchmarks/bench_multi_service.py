@@ -0,0 +1,66 @@
+'''
+Время одного цикла опроса N сервисов: последовательно (прежнее
+поведение) и конкурентно через NumberChecker.poll.
+
+    python -m benchmarks.bench_multi_service [--services 50] [--latency 0.05]
+'''
+import argparse
+import asyncio
+import json
+import time
+from http_client import HttpClient
+from number_checker import NumberChecker
+from sms_service import SmsService
+from targets import build_targets
+from watch_rules import WatchEngine, WatchRule
+from benchmarks.stubs import SmsActivateStub
+
+
+async def run(services: int, latency: float, concurrency: int) -> dict:
+    stub = SmsActivateStub(latency=latency)
+    base = await stub.start()
+    url = f"{base}?api_key=bench&action=getTopCountriesByService&service=ig"
+    rules = [WatchRule(service=f"s{i}", country=137, max_price=9)
+             for i in range(services)]
+    engine = WatchEngine(rules)
+    client = HttpClient(limit_per_host=concurrency)
+    checker = NumberChecker(SmsService(0), url, url, engine, client,
+                            build_targets(url, engine.services),
+                            concurrency)
+    try:
+        await checker.poll(checker.targets[:1])
+
+        started = time.perf_counter()
+        for target in checker.targets:
+            await checker.fetch_target(target)
+        sequential = time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await checker.poll()
+        concurrent = time.perf_counter() - started
+        matches = checker.evaluate(results)
+    finally:
+        await client.close()
+        await stub.stop()
+    return {
+        "services": services,
+        "latency_s": latency,
+        "concurrency": concurrency,
+        "sequential_s": round(sequential, 3),
+        "concurrent_s": round(concurrent, 3),
+        "matches": len(matches),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.services, args.latency,
+                                     args.concurrency)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+Декодирование и фильтрация большого ответа getTopCountriesByService (по
+всем сервисам, часть записей с ценой null):
+- dicts: json.loads и проход правилами по словарям записей с проверкой
+  типов полей при каждой проверке (прежнее поведение);
+- offers_json / offers_orjson: декодирование стандартным json или orjson,
+  однократная проверка нужных правилам записей в Offer
+  (WatchEngine.offers) и проход правилами по ним;
+- scanner: потоковый разбор PayloadScanner со странами правил, как при
+  опросе (декодер offers.loads);
+- scanner_all: PayloadScanner без фильтра, все записи становятся Offer.
+Отдельно время одного прохода правилами по уже декодированным данным.
+
+    python -m benchmarks.bench_offers [--services 50] [--countries 200]
+        [--runs 20]
+'''
+import argparse
+import json
+import statistics
+import time
+from typing import Any, Callable
+from offers import JSON_BACKEND, orjson
+from stream_parser import PayloadScanner
+from watch_rules import WatchEngine, WatchRule, iter_entries
+
+
+def make_payload(services: int, countries: int) -> dict:
+    '''
+    Ответ по всем сервисам; у каждой двадцатой записи цена null.
+    '''
+    return {
+        f"s{s}": {
+            str(c): {"country": c,
+                     "count": 100 + (s + c) % 900,
+                     "price": None if (s + c) % 20 == 0
+                     else 5 + (s * 7 + c) % 40,
+                     "retail_price": 80}
+            for c in range(countries)
+        }
+        for s in range(services)
+    }
+
+
+def match_dicts(engine: WatchEngine, data: Any) -> int:
+    '''
+    Прежний проход: поля записи читаются и проверяются при каждой
+    проверке правилами.
+    '''
+    found = 0
+    for service, entry in iter_entries(data, ''):
+        countries = engine._index.get(service)
+        if not countries:
+            continue
+        bucket = countries.get(entry.get('country'))
+        if not bucket:
+            continue
+        price = entry.get('price')
+        count = entry.get('count')
+        if not isinstance(price, (int, float)) \
+                or not isinstance(count, int):
+            continue
+        for rule in bucket:
+            if rule.max_price < price:
+                break
+            if count >= rule.min_count:
+                found += 1
+    return found
+
+
+def measure(function: Callable[[], int], runs: int) -> dict:
+    found = function()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"mean_ms": round(statistics.fmean(samples), 2),
+            "min_ms": round(min(samples), 2),
+            "matches": found}
+
+
+def run(services: int, countries: int, runs: int) -> dict:
+    payload = make_payload(services, countries)
+    body = json.dumps(payload).encode()
+    # Правила на каждый сервис по нескольким странам
+    engine = WatchEngine(WatchRule(service=f"s{s}", country=c, max_price=30)
+                         for s in range(services)
+                         for c in range(0, countries, 10))
+
+    wanted = {service: engine.countries(service)
+              for service in engine.services}
+
+    def scanner(countries=None) -> int:
+        scanner = PayloadScanner('', countries)
+        scanner.feed(body)
+        return len(engine.evaluate_offers(scanner.close()))
+
+    cases = {
+        "dicts": lambda: match_dicts(engine, json.loads(body)),
+        "offers_json": lambda: len(engine.evaluate(json.loads(body))),
+    }
+    if orjson is not None:
+        cases["offers_orjson"] = lambda: len(
+            engine.evaluate(orjson.loads(body))
+        )
+    cases["scanner"] = lambda: scanner(wanted)
+    cases["scanner_all"] = scanner
+
+    data = json.loads(body)
+    offers = list(engine.offers(data))
+    return {
+        "entries": services * countries,
+        "body_kib": round(len(body) / 1024),
+        "json_backend": JSON_BACKEND,
+        "decode_and_filter": {name: measure(function, runs)
+                              for name, function in cases.items()},
+        "filter_only": {
+            "dicts": measure(lambda: match_dicts(engine, data), runs),
+            "offers": measure(lambda: len(engine.evaluate_offers(offers)),
+                              runs),
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', type=int, default=50)
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.services, args.countries, args.runs),
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
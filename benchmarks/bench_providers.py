@@ -0,0 +1,226 @@
+'''
+Несколько поставщиков номеров на локальных заглушках (SMS Activate,
+SMSHub, 5sim):
+- concurrent: опрос всех поставщиков одним poll против опроса
+  поставщиков по очереди; у каждого ответа задержка --latency секунд;
+- cheapest: /check по правилам на две страны показывает самое дешевое
+  предложение среди всех поставщиков; балансы всех поставщиков;
+- rate_limit: --requests одновременных запросов к SMSHub с
+  ограничением rate_limit=--rate, burst=2; наибольшее число запросов
+  за секунду на стороне заглушки;
+- health: 5sim отвечает 500; состояние поставщиков после нескольких
+  опросов и результаты остальных поставщиков.
+
+    python -m benchmarks.bench_providers [--latency 0.2] [--services 10]
+        [--rate 10] [--requests 30]
+'''
+import argparse
+import asyncio
+import json
+import time
+from functools import partial
+from http_client import HttpClient
+from number_checker import NumberChecker
+from providers import ProviderConfig, create_provider, provider_headers
+from resilience import ResilientClient
+from sms_service import SmsService
+from watch_rules import WatchEngine, WatchRule
+from benchmarks.bench_resilience import CountingBot
+from benchmarks.stubs import FiveSimStub, SmsActivateStub, SmsHubStub
+
+COUNTRIES = {"russia": 0, "kazakhstan": 2}
+
+
+def activate_payload() -> dict:
+    return {"0": {"country": 0, "count": 5, "price": 15},
+            "1": {"country": 2, "count": 7, "price": 12},
+            "2": {"country": 6, "count": 900, "price": 3}}
+
+
+class Stubs:
+    '''
+    Три заглушки и проверщик, опрашивающий их все.
+    '''
+    def __init__(self, latency: float, services: int):
+        self.services = [f"s{i}" for i in range(services)] \
+            if services > 1 else ["ig"]
+        self.activate = SmsActivateStub(activate_payload(), latency=latency)
+        self.hub = SmsHubStub(
+            {(service, country): prices
+             for service in self.services
+             for country, prices in ((0, {10: 5, 8: 0, 14: 50}),
+                                     (2, {13: 1}))},
+            latency=latency
+        )
+        self.five = FiveSimStub(
+            {(service, country): operators
+             for service in self.services
+             for country, operators in (
+                 ("russia", {"beeline": (9, 3), "mts": (7, 0)}),
+                 ("kazakhstan", {"tele2": (16, 40)}),
+                 ("usa", {"virtual": (1, 1000)}))},
+            latency=latency
+        )
+
+    async def start(self,
+                    concurrency: int = 10,
+                    configs: dict = {}) -> NumberChecker:
+        base = await self.activate.start()
+        hub = ProviderConfig(type='smshub', url=await self.hub.start(),
+                             api_key='bench', **configs.get('smshub', {}))
+        five = ProviderConfig(type='5sim', url=await self.five.start(),
+                              api_key='bench', countries=COUNTRIES,
+                              **configs.get('5sim', {}))
+        providers = [
+            create_provider(config,
+                            ResilientClient(
+                                HttpClient(timeout_total=5,
+                                           headers=provider_headers(config)),
+                                failure_threshold=3, reset_timeout=60))
+            for config in (hub, five)
+        ]
+        engine = WatchEngine(WatchRule(service=service, country=country,
+                                       max_price=20)
+                             for service in self.services
+                             for country in (0, 2))
+        self.checker = NumberChecker(
+            SmsService(1),
+            f"{base}?api_key=bench&action=getTopCountriesByService",
+            f"{base}?api_key=bench&action=getBalance",
+            engine,
+            ResilientClient(HttpClient(timeout_total=5)),
+            concurrency=concurrency,
+            history=None,
+            providers=providers
+        )
+        for provider in providers:
+            provider.client.on_state_change = partial(
+                self.checker.breaker_changed, provider=provider.name
+            )
+        return self.checker
+
+    async def stop(self) -> None:
+        await self.checker.close()
+        await self.checker.sms_service.close()
+        for stub in (self.activate, self.hub, self.five):
+            await stub.stop()
+
+
+async def concurrent(latency: float, services: int) -> dict:
+    stubs = Stubs(latency, services)
+    checker = await stubs.start(concurrency=100)
+    try:
+        # Прогрев соединений
+        await checker.poll()
+        started = time.perf_counter()
+        results = await checker.poll()
+        together = time.perf_counter() - started
+        one_by_one = 0.0
+        for name in checker.providers:
+            targets = [target for target in checker.targets
+                       if target.provider == name]
+            started = time.perf_counter()
+            await checker.poll(targets)
+            one_by_one += time.perf_counter() - started
+    finally:
+        await stubs.stop()
+    return {"scenario": "concurrent",
+            "targets": len(results),
+            "failed": sum(not result.ok for result in results),
+            "all_providers_s": round(together, 3),
+            "providers_one_by_one_s": round(one_by_one, 3)}
+
+
+async def cheapest() -> dict:
+    stubs = Stubs(0.0, 1)
+    checker = await stubs.start()
+    bot = CountingBot()
+    try:
+        results = await checker.check_targets(bot, report_all=True)
+        await checker.get_balance(bot)
+    finally:
+        await stubs.stop()
+    offers = {result.target.provider: sorted(
+        (offer.country, offer.price, offer.count)
+        for offer in result.payload) for result in results}
+    return {"scenario": "cheapest",
+            "offers": offers,
+            "check": bot.messages[0][1].splitlines(),
+            "balance": bot.messages[1][1].splitlines()}
+
+
+async def rate_limit(rate: float, requests: int) -> dict:
+    stubs = Stubs(0.0, requests)
+    checker = await stubs.start(
+        concurrency=100,
+        configs={'smshub': {'rate_limit': rate, 'burst': 2}}
+    )
+    try:
+        targets = [target for target in checker.targets
+                   if target.provider == 'smshub']
+        started = time.perf_counter()
+        await checker.poll(targets)
+        elapsed = time.perf_counter() - started
+        others = [target for target in checker.targets
+                  if target.provider != 'smshub']
+        started = time.perf_counter()
+        await checker.poll(others)
+        unlimited = time.perf_counter() - started
+    finally:
+        await stubs.stop()
+    moments = [moment for moment, _ in stubs.hub.served]
+    busiest = max(sum(1 for other in moments if 0 <= other - moment < 1)
+                  for moment in moments)
+    return {"scenario": "rate_limit",
+            "requests": len(moments),
+            "rate_limit": rate,
+            "burst": 2,
+            "busiest_second": busiest,
+            "elapsed_s": round(elapsed, 2),
+            "expected_s": round((len(moments) - 2) / rate, 2),
+            "unlimited_providers_s": round(unlimited, 3)}
+
+
+async def health() -> dict:
+    stubs = Stubs(0.0, 1)
+    checker = await stubs.start()
+    stubs.five.status = 500
+    bot = CountingBot()
+    polls = []
+    try:
+        for _ in range(5):
+            results = await checker.check_targets(bot)
+            polls.append({result.target.provider: result.ok
+                          for result in results})
+        states = {name: provider.health.healthy
+                  for name, provider in checker.providers.items()}
+        report = checker.describe_providers().splitlines()
+    finally:
+        await stubs.stop()
+    return {"scenario": "health",
+            "five_sim_requests": stubs.five.requests,
+            "polls_ok": polls,
+            "healthy": states,
+            "admin_messages": [text for _, text in bot.messages],
+            "stats": report}
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    return [await concurrent(args.latency, args.services),
+            await cheapest(),
+            await rate_limit(args.rate, args.requests),
+            await health()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--services', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=10)
+    parser.add_argument('--requests', type=int, default=30)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
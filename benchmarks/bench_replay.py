@@ -0,0 +1,156 @@
+'''
+Запись и воспроизведение (replay.py):
+- record: опрос заглушки SMS Activate через RecordingClient, цена
+  меняется каждые 5 опросов; число строк записи, строк с телом и
+  совпадение ответов записи с ответами заглушки;
+- replay: синтетическая запись рынка за --days суток (ответ раз в
+  минуту по каждому сервису, цена меняется случайно) проигрывается
+  циклом проверки бота на виртуальных часах с разными наибольшими
+  интервалами опроса: реальное время, ускорение, запросы к API в час,
+  уведомления и время обнаружения изменений; повторный запуск с тем же
+  seed дает те же уведомления.
+
+    python -m benchmarks.bench_replay [--days 7] [--services 3]
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+from config import Settings
+from http_client import HttpClient
+from metrics import metrics
+from number_checker import NumberChecker
+from replay import Recorder, RecordingClient, Recording, run
+from sms_service import SmsService
+from targets import build_targets
+from watch_rules import WatchEngine, WatchRule
+from benchmarks.stubs import SmsActivateStub, make_top_countries_payload
+
+URL = "http://localhost/stubs/handler_api.php?api_key=bench-key-1234"
+
+
+async def record(path: str, polls: int) -> dict:
+    stub = SmsActivateStub()
+    base = await stub.start()
+    url = f"{base}?api_key=bench-key-1234&action=getTopCountriesByService"
+    recorder = Recorder(path)
+    client = RecordingClient(HttpClient(), recorder)
+    engine = WatchEngine([WatchRule(service='ig', country=137,
+                                    max_price=9)])
+    checker = NumberChecker(SmsService(1), f"{url}&service=ig",
+                            f"{base}?action=getBalance", engine, client)
+    served = []
+    try:
+        for poll in range(polls):
+            stub.set_payload(make_top_countries_payload(
+                price=8 - poll // 5 * 0.5
+            ))
+            served.append(stub._body)
+            await checker.poll()
+    finally:
+        await checker.close()
+        await stub.stop()
+    with open(path, encoding='utf-8') as file:
+        lines = [json.loads(line) for line in file]
+    recording = Recording(path)
+    replayed = [recording.response(f"{url}&service=ig", line["t"]).body
+                for line in lines]
+    return {"polls": polls,
+            "lines": len(lines),
+            "bodies_written": sum("body" in line for line in lines),
+            "api_key_hidden": all("bench-key-1234" not in line["url"]
+                                  for line in lines),
+            "replayed_equal": replayed == served}
+
+
+def synthesize(path: str, days: float, services: list[str]) -> int:
+    '''
+    Запись рынка: ответ раз в минуту по каждому сервису, цена страны 137
+    с вероятностью 1% в минуту меняется на случайную из 6..12.
+    '''
+    rng = random.Random(7)
+    now = [1_700_000_000.0]
+    recorder = Recorder(path, clock=lambda: now[0])
+    urls = [target.url for target in build_targets(
+        f"{URL}&action=getTopCountriesByService", services
+    )]
+    prices = {url: 10 for url in urls}
+    for _ in range(int(days * 24 * 60)):
+        now[0] += 60
+        for url in urls:
+            if rng.random() < 0.01:
+                prices[url] = rng.randint(6, 12)
+            body = json.dumps(make_top_countries_payload(
+                size=50, price=prices[url], count=5
+            )).encode()
+            recorder.record(url, rng.uniform(0.05, 0.3), body)
+    recorder.close()
+    return recorder.records
+
+
+def settings_for(services: list[str], max_interval: float) -> Settings:
+    return Settings(
+        _env_file=None,
+        token='123456:replay',
+        admin_id=1,
+        url_sms_activate=f"{URL}&action=getTopCountriesByService"
+                         f"&service={services[0]}",
+        url_api_sms=f"{URL}&action=getBalance",
+        watch_rules=[{"service": service, "country": 137, "max_price": 8}
+                     for service in services],
+        poll_max_interval=max_interval,
+        history_path='',
+        state_path='',
+        subscriptions_path='',
+    )
+
+
+def replay_case(recording: Recording,
+                services: list[str],
+                max_interval: float,
+                seed: int = 1) -> tuple[dict, list]:
+    metrics.histograms.clear()
+    metrics.counters.clear()
+    summary, messages = run(settings_for(services, max_interval), recording,
+                            seed)
+    return {"max_interval": max_interval,
+            "real_seconds": summary["real_seconds"],
+            "speedup": summary["speedup"],
+            "requests_per_hour": summary["requests_per_hour"],
+            "notifications": summary["notifications"],
+            "change_detection_max_s":
+                summary["change_detection_max_s"]}, messages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--services', type=int, default=3)
+    args = parser.parse_args()
+    services = [f"s{i}" for i in range(args.services)]
+    report = []
+    with tempfile.TemporaryDirectory() as directory:
+        report.append(asyncio.run(record(os.path.join(directory,
+                                                      'recorded.jsonl'),
+                                         20)))
+        path = os.path.join(directory, 'week.jsonl.gz')
+        records = synthesize(path, args.days, services)
+        recording = Recording(path)
+        report.append({"days": args.days,
+                       "records": records,
+                       "file_kib": round(os.path.getsize(path) / 1024)})
+        first = None
+        for max_interval in (1800, 600, 120):
+            case, messages = replay_case(recording, services, max_interval)
+            report.append(case)
+            if first is None:
+                first = messages
+        _, again = replay_case(recording, services, 1800)
+        report.append({"deterministic": again == first})
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
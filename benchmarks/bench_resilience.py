@@ -0,0 +1,168 @@
+'''
+Устойчивость запросов к API SMS Activate: HttpClient против
+ResilientClient на локальной заглушке.
+- tail: 3% ответов задерживаются на --slow секунд; перцентили задержки
+  запроса и доля лишних запросов к API из-за дублирования;
+- outage: API отвечает 500 в течение --outage секунд, пока работает цикл
+  проверки BotHandler; число запросов к API и сообщений администратору
+  за время сбоя и время до первого успешного опроса после него;
+- mirror: основной адрес недоступен, задано зеркало; доля успешных
+  запросов.
+
+    python -m benchmarks.bench_resilience [--requests 300] [--slow 1]
+        [--outage 3]
+'''
+import argparse
+import asyncio
+import json
+import random
+import time
+from http_client import HttpClient
+from number_checker import NumberChecker
+from resilience import ResilientClient
+from scheduler import AdaptiveScheduler
+from sms_service import SmsService
+from watch_rules import WatchEngine, WatchRule
+from benchmarks.bench_e2e import percentiles
+from benchmarks.bench_webhook import free_port
+from benchmarks.stubs import SmsActivateStub
+
+
+class CountingBot:
+    def __init__(self):
+        self.messages: list[tuple[float, str]] = []
+
+    async def send_message(self, chat_id: int, text: str) -> None:
+        self.messages.append((time.perf_counter(), text))
+
+    async def set_my_commands(self, commands: list) -> None:
+        pass
+
+
+def make_client(resilient: bool, mirrors: tuple = ()) -> HttpClient:
+    client = HttpClient(timeout_total=5)
+    if resilient:
+        return ResilientClient(client, mirrors, failure_threshold=5,
+                               reset_timeout=1)
+    return client
+
+
+async def tail(resilient: bool, requests: int, slow: float) -> dict:
+    rng = random.Random(1)
+    stub = SmsActivateStub(
+        latency=lambda: slow if rng.random() < 0.03 else 0.01
+    )
+    base = await stub.start()
+    url = f"{base}?api_key=bench&action=getTopCountriesByService&service=ig"
+    client = make_client(resilient)
+    semaphore = asyncio.Semaphore(5)
+    samples = []
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await client.get_bytes(url)
+            samples.append(time.perf_counter() - started)
+
+    try:
+        await asyncio.gather(*(one() for _ in range(requests)))
+    finally:
+        await client.close()
+        await stub.stop()
+    return {"scenario": "tail",
+            "client": "resilient" if resilient else "plain",
+            "latency": percentiles(samples),
+            "extra_requests_pct": round(
+                (stub.requests - requests) / requests * 100, 1)}
+
+
+async def outage(resilient: bool, duration: float) -> dict:
+    from bot_handler import BotHandler
+    stub = SmsActivateStub()
+    base = await stub.start()
+    url = f"{base}?api_key=bench&action=getTopCountriesByService&service=s0"
+    engine = WatchEngine([WatchRule(service=f"s{i}", country=137,
+                                    max_price=9) for i in range(10)])
+    client = make_client(resilient)
+    checker = NumberChecker(SmsService(1), url, f"{base}?action=getBalance",
+                            engine, client)
+    if resilient:
+        client.on_state_change = checker.breaker_changed
+    scheduler = AdaptiveScheduler(checker.targets_by_key, 0.1, 0.2, 0.1,
+                                  jitter=0, max_backoff=2)
+    bot = CountingBot()
+    handler = BotHandler(bot, 1, checker.sms_service, checker, scheduler)
+    try:
+        handler.start_check_loop()
+        await asyncio.sleep(0.5)
+        stub.status = 500
+        requests = stub.requests
+        messages = len(bot.messages)
+        await asyncio.sleep(duration)
+        stub.status = 200
+        restored = time.perf_counter()
+        during = stub.requests - requests
+        alerts = len(bot.messages) - messages
+        while not any(action == 'getTopCountriesByService'
+                      and moment > restored
+                      for moment, action in stub.served):
+            await asyncio.sleep(0.01)
+        recovered = next(moment for moment, _ in stub.served
+                         if moment > restored) - restored
+    finally:
+        await handler.close()
+        await checker.sms_service.close()
+        await client.close()
+        await stub.stop()
+    return {"scenario": "outage",
+            "client": "resilient" if resilient else "plain",
+            "requests_during_outage": during,
+            "admin_messages_during_outage": alerts,
+            "first_poll_after_recovery_s": round(recovered, 2)}
+
+
+async def mirror(resilient: bool, requests: int) -> dict:
+    stub = SmsActivateStub()
+    base = await stub.start()
+    dead = f"http://127.0.0.1:{free_port()}"
+    url = (f"{dead}/stubs/handler_api.php?api_key=bench"
+           "&action=getTopCountriesByService&service=ig")
+    client = make_client(resilient, (f"http://localhost:{stub.port}",))
+    ok = 0
+    try:
+        for _ in range(requests):
+            try:
+                await client.get_bytes(url)
+                ok += 1
+            except Exception:
+                pass
+    finally:
+        await client.close()
+        await stub.stop()
+    return {"scenario": "mirror",
+            "client": "resilient" if resilient else "plain",
+            "success_pct": round(ok / requests * 100, 1)}
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    report = []
+    for resilient in (False, True):
+        report.append(await tail(resilient, args.requests, args.slow))
+    for resilient in (False, True):
+        report.append(await outage(resilient, args.outage))
+    for resilient in (False, True):
+        report.append(await mirror(resilient, 20))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--slow', type=float, default=1.0)
+    parser.add_argument('--outage', type=float, default=3.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+'''
+Отзывчивость обработчиков команд, пока запрос к API висит.
+Для каждой точки входа (main.py, checker.py, checker_solid.py) /check
+запускается против заглушки, отвечающей через --hang секунд; в это время
+каждые 50 мс вызывается быстрый обработчик команды и измеряется его
+задержка. С блокирующим HTTP-клиентом задержка равнялась бы времени
+зависания. Код возврата 1, если задержка превысила --limit.
+
+    python -m benchmarks.bench_responsiveness [--hang 2] [--limit 0.1]
+'''
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+from benchmarks.stubs import SmsActivateStub
+
+
+class FakeBot:
+    async def send_message(self, chat_id: int, text: str) -> None:
+        pass
+
+    async def set_my_commands(self, commands: list) -> None:
+        pass
+
+
+def fake_message(text: str) -> SimpleNamespace:
+    async def answer(*args, **kwargs) -> None:
+        pass
+    return SimpleNamespace(text=text, chat=SimpleNamespace(id=1),
+                           answer=answer)
+
+
+async def probe(handler, hang: float) -> float:
+    '''
+    Максимальная задержка вызовов handler, пока висит запрос.
+    '''
+    worst = 0.0
+    deadline = time.perf_counter() + hang * 0.8
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await handler(fake_message('/rules'))
+        worst = max(worst, time.perf_counter() - started)
+        # Запаздывание пробуждения показывает блокировку цикла событий
+        started = time.perf_counter()
+        await asyncio.sleep(0.05)
+        worst = max(worst, time.perf_counter() - started - 0.05)
+    return worst
+
+
+async def measure(name: str, handler, check, hang: float) -> dict:
+    started = time.perf_counter()
+    task = asyncio.create_task(check())
+    await asyncio.sleep(0.05)
+    worst = await probe(handler, hang)
+    await task
+    return {'entry_point': name,
+            'check_seconds': round(time.perf_counter() - started, 3),
+            'max_handler_latency_ms': round(worst * 1000, 2)}
+
+
+async def run(hang: float) -> list[dict]:
+    stub = SmsActivateStub(latency=hang)
+    base = await stub.start()
+    numbers = f"{base}?api_key=bench&action=getTopCountriesByService" \
+        "&service=ig"
+    balance = f"{base}?api_key=bench&action=getBalance"
+    bot = FakeBot()
+    from watch_rules import WatchEngine, WatchRule
+    engine = WatchEngine([WatchRule(service='ig', country=137,
+                                    max_price=9)])
+    results = []
+    try:
+        import bot_handler
+        import number_checker
+        import sms_service
+        checker = number_checker.NumberChecker(
+            sms_service.SmsService(1), numbers, balance, engine, cache_ttl=0
+        )
+        handler = bot_handler.BotHandler(bot, 1, checker.sms_service,
+                                         checker)
+        results.append(await measure(
+            'main.py', handler.rules_command,
+            lambda: checker.get_numbers(bot), hang
+        ))
+        await checker.close()
+
+        import checker_solid
+        solid_checker = checker_solid.NumberChecker(
+            checker_solid.SmsService(1), numbers, balance, engine
+        )
+        solid = checker_solid.BotHandler(bot, 1, solid_checker.sms_service,
+                                         solid_checker)
+        results.append(await measure(
+            'checker_solid.py', solid.stop_command,
+            lambda: solid_checker.get_numbers(bot), hang
+        ))
+        await solid_checker.close()
+
+        os.environ['url_sms_activate'] = numbers
+        os.environ['url_api_sms'] = balance
+        import checker
+        legacy = checker.BotHandler(bot, 1, engine)
+        results.append(await measure(
+            'checker.py', legacy.stop_command, legacy.get_numbers, hang
+        ))
+        await legacy.client.close()
+    finally:
+        await stub.stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hang', type=float, default=2.0)
+    parser.add_argument('--limit', type=float, default=0.1)
+    args = parser.parse_args()
+    results = asyncio.run(run(args.hang))
+    print(json.dumps(results, indent=2))
+    if any(result['max_handler_latency_ms'] > args.limit * 1000
+           for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
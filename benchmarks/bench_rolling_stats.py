@@ -0,0 +1,85 @@
+'''
+Скользящая статистика RollingStats: время обновления одним опросом и
+память при росте числа замеров (не должны расти), время запроса
+статистики и стоимость проверки правил с условиями по статистике.
+
+    python -m benchmarks.bench_rolling_stats [--pairs 100]
+        [--polls 100 1000 10000]
+'''
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from offers import Offer
+from rolling_stats import RollingStats
+from watch_rules import StatCondition, WatchEngine, WatchRule
+
+
+def make_poll(pairs: int, rng: random.Random) -> list[Offer]:
+    return [Offer(f"s{i % 10}", i, rng.randint(5, 40), rng.randint(0, 500))
+            for i in range(pairs)]
+
+
+def feed(pairs: int, polls: int) -> RollingStats:
+    rng = random.Random(polls)
+    now = [0.0]
+    stats = RollingStats((3600, 86400), clock=lambda: now[0])
+    batches = [make_poll(pairs, rng) for _ in range(50)]
+    for poll in range(polls):
+        # Опрос раз в минуту
+        now[0] += 60
+        stats.update(batches[poll % len(batches)], now[0])
+    return stats
+
+
+def run_case(pairs: int, polls: int) -> dict:
+    started = time.perf_counter()
+    stats = feed(pairs, polls)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    feed(pairs, polls)
+    _, memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for i in range(pairs):
+        stats.value(f"s{i % 10}", i, 'price', 'p50', 86400)
+    query = time.perf_counter() - started
+
+    plain = WatchEngine(WatchRule(service=f"s{i % 10}", country=i,
+                                  max_price=40) for i in range(pairs))
+    conditional = WatchEngine(
+        WatchRule(service=f"s{i % 10}", country=i, max_price=40,
+                  conditions=[StatCondition(stat='p50', value=0.9),
+                              StatCondition(stat='mean', field='count',
+                                            op='>=', value=1.5)])
+        for i in range(pairs)
+    )
+    offers = make_poll(pairs, random.Random(0))
+    timings = {}
+    for name, engine in (("plain", plain), ("conditions", conditional)):
+        started = time.perf_counter()
+        for _ in range(100):
+            engine.evaluate_offers(offers, stats)
+        timings[name] = round((time.perf_counter() - started) * 10, 3)
+    return {"pairs": pairs,
+            "polls": polls,
+            "update_us_per_offer": round(elapsed / (polls * pairs) * 1e6, 2),
+            "peak_memory_kib": round(memory / 1024),
+            "query_us": round(query / pairs * 1e6, 2),
+            "evaluate_ms": timings}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pairs', type=int, default=100)
+    parser.add_argument('--polls', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    args = parser.parse_args()
+    print(json.dumps([run_case(args.pairs, polls) for polls in args.polls],
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Задержка и пиковая память разбора большого ответа
+getTopCountriesByService: чтение тела целиком с json.loads (прежнее
+поведение) и потоковый разбор PayloadScanner с ранним выходом.
+
+    python -m benchmarks.bench_stream_parser [--entries 50000] [--runs 10]
+'''
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+from http_client import HttpClient
+from number_checker import NumberChecker
+from sms_service import SmsService
+from targets import build_targets
+from watch_rules import WatchEngine, WatchRule
+from benchmarks.stubs import SmsActivateStub, make_top_countries_payload
+
+
+async def measure(poll, runs: int) -> dict:
+    await poll()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await poll()
+        samples.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    await poll()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"mean_ms": round(statistics.fmean(samples), 2),
+            "peak_kib": round(peak / 1024)}
+
+
+async def run_case(entries: int, position: int, runs: int) -> dict:
+    payload = make_top_countries_payload(entries, position=position)
+    stub = SmsActivateStub(payload)
+    base = await stub.start()
+    url = f"{base}?api_key=bench&action=getTopCountriesByService&service=ig"
+    engine = WatchEngine([WatchRule(service='ig', country=137,
+                                    max_price=9)])
+    client = HttpClient()
+    checker = NumberChecker(SmsService(0), url, url, engine, client,
+                            build_targets(url, engine.services))
+    target = checker.targets[0]
+
+    async def buffered() -> None:
+        data = json.loads(await client.get_bytes(target.url))
+        assert engine.evaluate(data, 'ig')
+
+    async def streaming() -> None:
+        result = await checker.fetch_target(target)
+        assert engine.evaluate_offers(result.payload), result.error
+
+    try:
+        return {
+            "entries": entries,
+            "body_kib": round(len(json.dumps(payload)) / 1024),
+            "match_position": position,
+            "buffered": await measure(buffered, runs),
+            "streaming": await measure(streaming, runs),
+        }
+    finally:
+        await client.close()
+        await stub.stop()
+
+
+async def run(entries: int, runs: int) -> list:
+    return [await run_case(entries, position, runs)
+            for position in (entries // 10, entries // 2, entries - 1)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.entries, args.runs)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+'''
+Перезапуск бота с сохраненным состоянием против локальных заглушек SMS
+Activate и Telegram Bot API: первый запуск получает /start и отправляет
+уведомление о появившихся номерах, второй запускается с тем же
+STATE_PATH. Отчет в JSON: время восстановления состояния, число
+повторных уведомлений после перезапуска (с состоянием и без него),
+запустился ли цикл проверки без /start и сохранились ли интервалы
+опроса. Затем процесс, непрерывно пишущий контрольные точки, убивается
+SIGKILL, и проверяется целостность файла.
+
+    python -m benchmarks.bench_warm_start [--services 20] [--kills 5]
+'''
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import Settings
+from main import build_app
+from warm_state import StateStore
+from benchmarks.stubs import (SmsActivateStub, TelegramStub,
+                              make_top_countries_payload)
+
+ADMIN_ID = 1
+
+
+async def run_bot(settings: Settings,
+                  telegram_url: str,
+                  telegram: TelegramStub,
+                  sms: SmsActivateStub,
+                  command: bool,
+                  duration: float) -> dict:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_url))
+    bot = Bot(settings.token, session=session)
+    started = time.perf_counter()
+    dp, handler = build_app(settings, bot)
+    build_seconds = time.perf_counter() - started
+    mark = len(telegram.sent)
+    requests = sms.requests
+    polling = asyncio.create_task(dp.start_polling(bot,
+                                                   handle_signals=False))
+    if command:
+        telegram.push_command(ADMIN_ID, '/start')
+    await asyncio.sleep(duration)
+    intervals = {key: round(state.interval, 3)
+                 for key, state in handler.scheduler.states.items()}
+    await dp.stop_polling()
+    await polling
+    return {"build_ms": round(build_seconds * 1000, 2),
+            "alerts": sum('доступно' in text
+                          for _, _, text in telegram.sent[mark:]),
+            "polls": sms.requests - requests,
+            "intervals": intervals}
+
+
+async def restart(services: int, warm: bool, directory: str) -> dict:
+    sms = SmsActivateStub(make_top_countries_payload(price=8))
+    telegram = TelegramStub()
+    sms_url = await sms.start()
+    telegram_url = await telegram.start()
+    settings = Settings(
+        _env_file=None,
+        token='123456:bench',
+        admin_id=ADMIN_ID,
+        url_sms_activate=f"{sms_url}?api_key=bench"
+                         "&action=getTopCountriesByService&service=s0",
+        url_api_sms=f"{sms_url}?api_key=bench&action=getBalance",
+        watch_rules=[{"service": f"s{i}", "country": 137, "max_price": 9}
+                     for i in range(services)],
+        poll_min_interval=0.2,
+        poll_initial_interval=0.2,
+        poll_max_interval=2,
+        poll_jitter=0,
+        history_path='',
+        subscriptions_path='',
+        state_path=os.path.join(directory, f"state-{warm}.db"),
+        state_checkpoint_interval=0.5,
+    )
+    try:
+        first = await run_bot(settings, telegram_url, telegram, sms,
+                              True, 1.5)
+        if not warm:
+            os.remove(settings.state_path)
+        second = await run_bot(settings, telegram_url, telegram, sms,
+                               False, 0.5)
+    finally:
+        await sms.stop()
+        await telegram.stop()
+    return {"state": "warm" if warm else "cold",
+            "build_ms": second["build_ms"],
+            "alerts_before": first["alerts"],
+            "alerts_after_restart": second["alerts"],
+            "resumed_without_start": second["polls"] > 0,
+            "intervals_kept": all(
+                second["intervals"].get(key, 0) >= interval
+                for key, interval in first["intervals"].items()
+            )}
+
+
+WRITER = '''
+import asyncio, sys
+from warm_state import StateStore
+
+async def main():
+    store = StateStore(sys.argv[1], interval=0)
+    counter = [0]
+    store.register('load', lambda: {f"k{i}": [counter[0]] * 50
+                                    for i in range(2000)}, lambda saved: None)
+    print("ready", flush=True)
+    while True:
+        counter[0] += 1
+        await store.checkpoint()
+
+asyncio.run(main())
+'''
+
+
+def crash(directory: str, kills: int) -> dict:
+    '''
+    Убивает процесс во время записи контрольных точек и проверяет файл.
+    '''
+    path = os.path.join(directory, 'crash.db')
+    intact = 0
+    for attempt in range(kills):
+        process = subprocess.Popen([sys.executable, '-c', WRITER, path],
+                                   stdout=subprocess.PIPE,
+                                   cwd=os.path.dirname(os.path.dirname(
+                                       os.path.abspath(__file__))))
+        process.stdout.readline()
+        time.sleep(0.2 + 0.07 * attempt)
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+        db = sqlite3.connect(path)
+        ok = db.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+        values = {value for value, in db.execute(
+            "SELECT value FROM state WHERE section = 'load'")}
+        db.close()
+        # Контрольная точка записывается целиком: все ключи одинаковы
+        if ok and len(values) <= 1:
+            intact += 1
+        started = time.perf_counter()
+        StateStore(path)
+        restore_ms = (time.perf_counter() - started) * 1000
+    return {"kills": kills, "intact": intact,
+            "open_2000_keys_ms": round(restore_ms, 2)}
+
+
+async def run(services: int) -> list[dict]:
+    with tempfile.TemporaryDirectory() as directory:
+        return [await restart(services, True, directory),
+                await restart(services, False, directory)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--kills', type=int, default=5)
+    args = parser.parse_args()
+    report = asyncio.run(run(args.services))
+    with tempfile.TemporaryDirectory() as directory:
+        report.append(crash(directory, args.kills))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+'''
+Задержка команды бота в режимах long polling и webhook против локальной
+заглушки Telegram Bot API: от появления обновления /rules на стороне
+Telegram до получения ответа бота. Команды отправляются по одной
+(sequential) и потоком с интервалом spacing (burst). latency - задержка
+сети в одну сторону.
+
+    python -m benchmarks.bench_webhook [--commands 50] [--latency 0.02]
+        [--spacing 0.01]
+'''
+import argparse
+import asyncio
+import json
+import socket
+import time
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import Settings
+from main import build_app
+from webhook import start_webhook
+from benchmarks.bench_e2e import percentiles
+from benchmarks.stubs import SmsActivateStub, TelegramStub
+
+ADMIN_ID = 1
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def run_mode(mode: str,
+                   commands: int,
+                   latency: float,
+                   spacing: float) -> dict:
+    sms = SmsActivateStub()
+    telegram = TelegramStub(latency=latency)
+    sms_url = await sms.start()
+    telegram_url = await telegram.start()
+    port = free_port()
+    settings = Settings(
+        _env_file=None,
+        token='123456:bench',
+        admin_id=ADMIN_ID,
+        url_sms_activate=f"{sms_url}?api_key=bench"
+                         "&action=getTopCountriesByService&service=ig",
+        url_api_sms=f"{sms_url}?api_key=bench&action=getBalance",
+        watch_rules=[{"service": "ig", "country": 137, "max_price": 9}],
+        history_path='',
+        state_path='',
+        subscriptions_path='',
+        webhook_url=f"http://127.0.0.1:{port}/webhook"
+        if mode == 'webhook' else None,
+        webhook_host='127.0.0.1',
+        webhook_port=port,
+    )
+    session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_url))
+    bot = Bot(settings.token, session=session)
+    dp, handler = build_app(settings, bot)
+    if mode == 'webhook':
+        runner = await start_webhook(dp, bot, settings)
+        while telegram.webhook_url is None:
+            await asyncio.sleep(0.01)
+    else:
+        polling = asyncio.create_task(
+            dp.start_polling(bot, handle_signals=False)
+        )
+    sequential = []
+    burst = []
+    try:
+        for _ in range(commands + 1):
+            mark = len(telegram.sent)
+            started = time.perf_counter()
+            telegram.push_command(ADMIN_ID, '/rules')
+            delivered_at, _, _ = await telegram.wait_message(
+                lambda text: True, since=mark)
+            sequential.append(delivered_at - started)
+        # Поток команд: следующая приходит, не дожидаясь ответа
+        mark = len(telegram.sent)
+        pushed = []
+        for _ in range(commands):
+            pushed.append(time.perf_counter())
+            telegram.push_command(ADMIN_ID, '/rules')
+            await asyncio.sleep(spacing)
+        while len(telegram.sent) < mark + commands:
+            await telegram.wait_message(lambda text: True,
+                                        since=len(telegram.sent))
+        burst = [message[0] - started for message, started
+                 in zip(telegram.sent[mark:], pushed)]
+    finally:
+        if mode == 'webhook':
+            await runner.cleanup()
+            await bot.session.close()
+        else:
+            await dp.stop_polling()
+            await polling
+        await sms.stop()
+        await telegram.stop()
+    # Первая команда прогревает соединения
+    return {"mode": mode,
+            "sequential": percentiles(sequential[1:]),
+            "burst": percentiles(burst)}
+
+
+async def run(commands: int, latency: float, spacing: float) -> list[dict]:
+    return [await run_mode(mode, commands, latency, spacing)
+            for mode in ('polling', 'webhook')]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commands', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--spacing', type=float, default=0.01)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.commands, args.latency,
+                                     args.spacing)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
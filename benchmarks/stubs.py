@@ -0,0 +1,392 @@
+'''
+Локальные заглушки внешних API (SMS Activate, SMSHub, 5sim и Telegram
+Bot API) для бенчмарков.
+'''
+import asyncio
+import json
+import time
+from typing import Any, Callable, Optional, Union
+from aiohttp import ClientSession, web
+
+
+def make_top_countries_payload(size: int = 200,
+                               country: int = 137,
+                               price: float = 8,
+                               count: int = 5,
+                               position: Optional[int] = None) -> dict:
+    '''
+    Формирует ответ getTopCountriesByService из size записей.
+    Запись с указанной страной стоит на позиции position (по умолчанию
+    последней).
+    '''
+    if position is None:
+        position = size - 1
+    payload = {}
+    for i in range(size):
+        if i == position:
+            payload[str(i)] = {"country": country,
+                               "count": count,
+                               "price": price,
+                               "retail_price": price * 2}
+            continue
+        payload[str(i)] = {"country": i if i != country else size,
+                           "count": 100 + i,
+                           "price": 20 + i % 50,
+                           "retail_price": 40 + i % 50}
+    return payload
+
+
+class SmsActivateStub:
+    '''
+    Заглушка handler_api.php сервиса SMS Activate.
+    Поддерживает действия getTopCountriesByService, getBalance и
+    getNumber (списывает maxPrice с баланса, пока есть stock номеров),
+    умеет добавлять искусственную задержку к каждому ответу (latency -
+    число или функция без аргументов) и отвечать статусом status.
+    '''
+    def __init__(self,
+                 payload: Optional[dict] = None,
+                 balance: float = 100.0,
+                 latency: Union[float, Callable[[], float]] = 0.0,
+                 stock: int = 1000):
+        self.stock = stock
+        self.status = 200
+        self.purchases: list[dict] = []
+        self.payload = payload if payload is not None \
+            else make_top_countries_payload()
+        self.balance = balance
+        self.latency = latency
+        self.requests = 0
+        # Моменты ответов (time.perf_counter) по действиям
+        self.served: list[tuple[float, str]] = []
+        self._body = json.dumps(self.payload).encode()
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    def set_payload(self, payload: dict) -> None:
+        self.payload = payload
+        self._body = json.dumps(payload).encode()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        action = request.query.get('action')
+        self.served.append((time.perf_counter(), str(action)))
+        if self.status != 200:
+            return web.Response(status=self.status, text="ERROR")
+        if action == 'getTopCountriesByService':
+            return web.Response(body=self._body,
+                                content_type='application/json')
+        if action == 'getBalance':
+            return web.Response(text=f"ACCESS_BALANCE:{self.balance}")
+        if action == 'getNumber':
+            price = float(request.query.get('maxPrice', 0))
+            if self.stock <= 0:
+                return web.Response(text="NO_NUMBERS")
+            if price > self.balance:
+                return web.Response(text="NO_BALANCE")
+            self.stock -= 1
+            self.balance -= price
+            self.purchases.append(dict(request.query))
+            activation = len(self.purchases)
+            return web.Response(
+                text=f"ACCESS_NUMBER:{activation}:7900{activation:07d}"
+            )
+        return web.Response(text="BAD_ACTION")
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get('/stubs/handler_api.php', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://localhost:{self.port}/stubs/handler_api.php"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class ProviderStub:
+    '''
+    Общая часть заглушек других поставщиков: задержка ответа (число или
+    функция без аргументов), статус ответа, число запросов и моменты
+    ответов (time.perf_counter) для проверки ограничения частоты.
+    '''
+    def __init__(self,
+                 balance: float = 100.0,
+                 latency: Union[float, Callable[[], float]] = 0.0):
+        self.balance = balance
+        self.latency = latency
+        self.status = 200
+        self.requests = 0
+        self.served: list[tuple[float, str]] = []
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def _begin(self, name: str) -> Optional[web.Response]:
+        self.requests += 1
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        self.served.append((time.perf_counter(), name))
+        if self.status != 200:
+            return web.Response(status=self.status, text="ERROR")
+        return None
+
+    def routes(self, app: web.Application) -> None:
+        raise NotImplementedError
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        self.routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://localhost:{self.port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class SmsHubStub(ProviderStub):
+    '''
+    Заглушка handler_api.php сервиса SMSHub: getPrices с ответом
+    {страна: {сервис: {цена: количество}}} из prices
+    {(сервис, страна): {цена: количество}} и getBalance.
+    '''
+    def __init__(self,
+                 prices: dict[tuple[str, int], dict[float, int]],
+                 balance: float = 50.0,
+                 latency: Union[float, Callable[[], float]] = 0.0):
+        super().__init__(balance, latency)
+        self.prices = prices
+
+    async def handle(self, request: web.Request) -> web.Response:
+        action = str(request.query.get('action'))
+        failed = await self._begin(action)
+        if failed is not None:
+            return failed
+        if action == 'getPrices':
+            service = request.query.get('service')
+            payload: dict = {}
+            for (name, country), prices in self.prices.items():
+                if service in (None, name):
+                    payload.setdefault(str(country), {})[name] = {
+                        f"{price:.2f}": count
+                        for price, count in prices.items()
+                    }
+            return web.json_response(payload)
+        if action == 'getBalance':
+            return web.Response(text=f"ACCESS_BALANCE:{self.balance}")
+        return web.Response(text="BAD_ACTION")
+
+    def routes(self, app: web.Application) -> None:
+        app.router.add_get('/stubs/handler_api.php', self.handle)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        return await super().start(host, port) + "/stubs/handler_api.php"
+
+
+class FiveSimStub(ProviderStub):
+    '''
+    Заглушка API 5sim: /v1/guest/prices?product=... с ответом
+    {сервис: {страна: {оператор: {"cost", "count", "rate"}}}} из prices
+    {(сервис, страна): {оператор: (цена, количество)}} и
+    /v1/user/profile (требует заголовок Authorization: Bearer token).
+    '''
+    def __init__(self,
+                 prices: dict[tuple[str, str], dict[str, tuple[float, int]]],
+                 token: str = 'bench',
+                 balance: float = 25.0,
+                 latency: Union[float, Callable[[], float]] = 0.0):
+        super().__init__(balance, latency)
+        self.prices = prices
+        self.token = token
+
+    async def handle_prices(self, request: web.Request) -> web.Response:
+        failed = await self._begin('prices')
+        if failed is not None:
+            return failed
+        product = request.query.get('product')
+        payload: dict = {}
+        for (name, country), operators in self.prices.items():
+            if product in (None, name):
+                payload.setdefault(name, {})[country] = {
+                    operator: {"cost": cost, "count": count, "rate": 90.0}
+                    for operator, (cost, count) in operators.items()
+                }
+        return web.json_response(payload)
+
+    async def handle_profile(self, request: web.Request) -> web.Response:
+        failed = await self._begin('profile')
+        if failed is not None:
+            return failed
+        if request.headers.get('Authorization') != f"Bearer {self.token}":
+            return web.Response(status=401, text="Unauthorized")
+        return web.json_response({"id": 1, "email": "bench@example.com",
+                                  "balance": self.balance, "rating": 96})
+
+    def routes(self, app: web.Application) -> None:
+        app.router.add_get('/v1/guest/prices', self.handle_prices)
+        app.router.add_get('/v1/user/profile', self.handle_profile)
+
+
+class TelegramStub:
+    '''
+    Заглушка Telegram Bot API (/bot<token>/<method>) для бота aiogram,
+    созданного с TelegramAPIServer.from_base(url). Обновления, добавленные
+    через push_command, отдаются в getUpdates или, если бот вызвал
+    setWebhook, отправляются POST-запросом на адрес webhook с секретным
+    токеном. sendMessage запоминает сообщения с моментом получения,
+    остальные методы возвращают True. latency - задержка сети в одну
+    сторону.
+    '''
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: list[tuple[float, int, str]] = []
+        # Моменты вызовов методов Bot API (time.perf_counter)
+        self.calls: list[tuple[float, str]] = []
+        self._updates: list[dict] = []
+        self._update_id = 0
+        self._new_update = asyncio.Event()
+        self._new_message = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self._client: Optional[ClientSession] = None
+        self._deliveries: set[asyncio.Task] = set()
+
+    def push_command(self, chat_id: int, text: str) -> None:
+        '''
+        Добавляет обновление с командой text от пользователя chat_id.
+        '''
+        self._update_id += 1
+        command = text.split()[0]
+        self._updates.append({
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False,
+                         "first_name": "bench"},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0,
+                              "length": len(command)}],
+            },
+        })
+        if self.webhook_url:
+            task = asyncio.create_task(self._deliver(self._updates.pop()))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+            return
+        self._new_update.set()
+
+    async def _deliver(self, update: dict) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._client is None:
+            self._client = ClientSession()
+        headers = {'X-Telegram-Bot-Api-Secret-Token':
+                   self.webhook_secret or ''}
+        async with self._client.post(self.webhook_url, json=update,
+                                     headers=headers) as response:
+            response.raise_for_status()
+
+    async def wait_message(self,
+                           predicate: Callable[[str], bool],
+                           since: int = 0,
+                           timeout: float = 30) -> tuple[float, int, str]:
+        '''
+        Ждет сообщение с индексом не меньше since, текст которого
+        удовлетворяет predicate.
+        '''
+        deadline = time.perf_counter() + timeout
+        while True:
+            for message in self.sent[since:]:
+                if predicate(message[2]):
+                    return message
+            since = len(self.sent)
+            self._new_message.clear()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("Сообщение не получено")
+            try:
+                await asyncio.wait_for(self._new_message.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls.append((time.perf_counter(), method))
+        params = dict(request.query)
+        if request.can_read_body:
+            params.update(await request.post())
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == 'setWebhook':
+            self.webhook_url = str(params['url'])
+            self.webhook_secret = params.get('secret_token')
+            return self._ok(True)
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return self._ok(True)
+        if method == 'getMe':
+            return self._ok({"id": 1, "is_bot": True, "first_name": "bench",
+                             "username": "bench_bot"})
+        if method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            self.sent.append((time.perf_counter(), chat_id,
+                              str(params.get('text', ''))))
+            self._new_message.set()
+            return self._ok({"message_id": len(self.sent),
+                             "date": int(time.time()),
+                             "chat": {"id": chat_id, "type": "private"},
+                             "text": params.get('text', '')})
+        return self._ok(True)
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get('offset') or 0)
+        self._updates = [update for update in self._updates
+                         if update['update_id'] >= offset]
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(),
+                                       float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        if self._updates and self.latency:
+            await asyncio.sleep(self.latency)
+        return list(self._updates)
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://localhost:{port}"
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
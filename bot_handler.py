@@ -1,8 +1,24 @@
 import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Optional, TypeVar
 from aiogram import Bot, types
-from aiogram.types import BotCommand
+from aiogram.types import BotCommand, BufferedInputFile
 from sms_service import SmsService
 from number_checker import NumberChecker
+from scheduler import AdaptiveScheduler
+from history import summarize
+from metrics import format_stats, metrics
+from subscriptions import SubscriptionRegistry
+from watch_rules import WatchRule
+
+if TYPE_CHECKING:
+    from cluster import ShardCoordinator
+
+# Наибольший период отчета /report в сутках
+MAX_REPORT_DAYS = 366
+
+T = TypeVar('T')
 
 
 class BotHandler:
@@ -10,12 +26,31 @@ class BotHandler:
                  bot: Bot,
                  admin_id: int,
                  sms_service: SmsService,
-                 number_checker: NumberChecker) -> None:
+                 number_checker: NumberChecker,
+                 scheduler: Optional[AdaptiveScheduler] = None,
+                 subscriptions: Optional[SubscriptionRegistry] = None,
+                 coordinator: Optional['ShardCoordinator'] = None
+                 ) -> None:
         self.bot = bot
         self.admin_id = admin_id
         self.stop = False
+        # Работает ли цикл проверки: None - неизвестно (первый запуск),
+        # False - остановлен командой /stop. Сохраняется между
+        # перезапусками, в отличие от stop
+        self.active: Optional[bool] = None
         self.sms_service = sms_service
         self.number_checker = number_checker
+        if scheduler is None:
+            scheduler = AdaptiveScheduler(number_checker.targets_by_key)
+        self.scheduler = scheduler
+        if subscriptions is None:
+            subscriptions = SubscriptionRegistry(admin_id,
+                                                 number_checker.engine.rules)
+        self.subscriptions = subscriptions
+        self.coordinator = coordinator
+        if coordinator is not None:
+            coordinator.on_change = self.sync_shard
+            coordinator.on_rules = self.load_rules
 
     async def start_command(self, message: types.Message) -> None:
         '''
@@ -24,15 +59,131 @@ class BotHandler:
         доступных номеров.
         '''
         await message.answer(text="Работаем")
+        self.start_check_loop()
+
+    def start_check_loop(self) -> None:
+        '''
+        Запускает цикл проверки, если он еще не запущен.
+        '''
+        self.active = True
         if not hasattr(self, 'check_loop_task') or self.check_loop_task.done():
             self.check_loop_task = asyncio.create_task(self.check_loop())
 
     async def check_command(self, message: types.Message) -> None:
         '''
         Обработчик команды /check.
-        Вызывает функцию get_numbers для проверки доступных номеров.
+        Вызывает функцию get_numbers для проверки доступных номеров по
+        правилам отправителя.
+        '''
+        if not self.subscriptions.is_allowed(message.chat.id):
+            await message.answer("Нет доступа")
+            return
+        await self.number_checker.get_numbers(self.bot, message.chat.id)
+
+    async def watch_command(self, message: types.Message) -> None:
+        '''
+        Обработчик команды /watch сервис страна цена [количество].
+        Добавляет отправителю правило отслеживания.
+        '''
+        if not self.subscriptions.is_allowed(message.chat.id):
+            await message.answer("Нет доступа")
+            return
+        args = (message.text or '').split()[1:]
+        try:
+            rule = WatchRule(service=args[0],
+                             country=int(args[1]),
+                             max_price=float(args[2]),
+                             min_count=int(args[3]) if len(args) > 3 else 1,
+                             chat_id=message.chat.id)
+        except (IndexError, ValueError):
+            await message.answer(
+                "Использование: /watch сервис страна цена [количество]"
+            )
+            return
+        await self.change_rules(lambda: self.subscriptions.add(rule))
+        await message.answer(f"Правило добавлено: {describe_rule(rule)}")
+
+    async def unwatch_command(self, message: types.Message) -> None:
+        '''
+        Обработчик команды /unwatch сервис [страна].
+        Удаляет правила отправителя по сервису или по сервису и стране.
         '''
-        await self.number_checker.get_numbers(self.bot)
+        if not self.subscriptions.is_allowed(message.chat.id):
+            await message.answer("Нет доступа")
+            return
+        args = (message.text or '').split()[1:]
+        try:
+            service = args[0]
+            country = int(args[1]) if len(args) > 1 else None
+        except (IndexError, ValueError):
+            await message.answer("Использование: /unwatch сервис [страна]")
+            return
+        removed = await self.change_rules(
+            lambda: self.subscriptions.remove(message.chat.id, service,
+                                              country)
+        )
+        await message.answer(f"Удалено правил: {removed}")
+
+    async def rules_command(self, message: types.Message) -> None:
+        '''
+        Обработчик команды /rules.
+        Отправляет список правил отправителя.
+        '''
+        if not self.subscriptions.is_allowed(message.chat.id):
+            await message.answer("Нет доступа")
+            return
+        rules = self.subscriptions.rules_of(message.chat.id)
+        await message.answer("\n".join(map(describe_rule, rules))
+                             if rules else "Правил нет")
+
+    async def change_rules(self, change: Callable[[], T]) -> T:
+        '''
+        Изменяет подписки функцией change и применяет новые правила. В
+        режиме нескольких воркеров правила перед изменением загружаются из
+        общего хранилища, а после записываются в него, чтобы цели новых
+        правил опрашивал воркер, которому они принадлежат по кольцу. Если
+        другой воркер успел изменить правила раньше, изменение повторяется
+        поверх его правил.
+        '''
+        while True:
+            if self.coordinator is not None:
+                await self.coordinator.sync_rules()
+            before = self.subscriptions.dump()
+            result = change()
+            text = self.subscriptions.dump()
+            if text == before:
+                return result
+            if self.coordinator is None \
+                    or await self.coordinator.publish_rules(text):
+                self.apply_rules()
+                return result
+
+    def load_rules(self, text: str) -> None:
+        '''
+        Заменяет правила, добавленные командами, общими правилами воркеров
+        (JSON-список из хранилища координации).
+        '''
+        self.subscriptions.load(text)
+        self.apply_rules()
+
+    def apply_rules(self) -> None:
+        '''
+        Передает проверщику общий индекс правил после изменения подписок и
+        обновляет цели планировщика (в режиме нескольких воркеров - через
+        перераспределение целей).
+        '''
+        self.number_checker.set_engine(self.subscriptions.engine)
+        if self.coordinator is not None:
+            self.coordinator.set_keys(self.number_checker.targets_by_key)
+        else:
+            self.scheduler.sync(self.number_checker.targets_by_key)
+
+    def sync_shard(self, owned: set[str]) -> None:
+        '''
+        Оставляет в планировщике только цели, принадлежащие этому воркеру.
+        '''
+        self.scheduler.sync(key for key in self.number_checker.targets_by_key
+                            if key in owned)
 
     async def balance_command(self, message: types.Message) -> None:
         '''
@@ -41,6 +192,90 @@ class BotHandler:
         '''
         await self.number_checker.get_balance(self.bot)
 
+    async def history_command(self, message: types.Message) -> None:
+        '''
+        Обработчик команды /history [страна] [часы].
+        Отправляет сводку по сохраненной истории цен и количества номеров
+        за последние часы (по умолчанию 24) по всем странам или по одной.
+        '''
+        if not self.subscriptions.is_allowed(message.chat.id):
+            await message.answer("Нет доступа")
+            return
+        history = self.number_checker.history
+        if history is None:
+            await message.answer("История не ведется")
+            return
+        args = (message.text or '').split()[1:]
+        try:
+            country = int(args[0]) if args else None
+            hours = float(args[1]) if len(args) > 1 else 24
+        except ValueError:
+            await message.answer("Использование: /history [страна] [часы]")
+            return
+        records = await asyncio.to_thread(history.query,
+                                          time.time() - hours * 3600,
+                                          country=country)
+        await message.answer(summarize(records))
+
+    async def report_command(self, message: types.Message) -> None:
+        '''
+        Обработчик команды /report [страна] [дни] [график].
+        Отправляет отчет по истории за последние дни (по умолчанию 30, не
+        больше MAX_REPORT_DAYS): пополнения по часам суток, длительность
+        наличия номеров и цены по странам; со словом "график" - еще и
+        картинку пополнений по часам. Отчет считается в отдельном потоке и
+        не задерживает цикл проверки.
+        '''
+        if not self.subscriptions.is_allowed(message.chat.id):
+            await message.answer("Нет доступа")
+            return
+        history = self.number_checker.history
+        if history is None:
+            await message.answer("История не ведется")
+            return
+        args = (message.text or '').split()[1:]
+        chart = 'график' in args
+        args = [arg for arg in args if arg != 'график']
+        try:
+            country = int(args[0]) if args else None
+            days = min(float(args[1]) if len(args) > 1 else 30,
+                       MAX_REPORT_DAYS)
+            # not days > 0 отсекает и nan
+            if not days > 0:
+                raise ValueError(days)
+        except ValueError:
+            await message.answer("Использование: /report [страна] [дни] "
+                                 "[график]")
+            return
+        # NumPy загружается только при первом отчете, а не при запуске
+        from analytics import build_report, format_report, render_chart
+        with metrics.timer('report_seconds'):
+            report = await asyncio.to_thread(build_report, history,
+                                             time.time() - days * 86400,
+                                             country=country)
+        await message.answer(format_report(report))
+        if chart and report.samples:
+            image = await asyncio.to_thread(render_chart, report)
+            await message.answer_photo(
+                BufferedInputFile(image, filename='report.png'),
+                caption="Пополнения по часам суток"
+            )
+
+    async def stats_command(self, message: types.Message) -> None:
+        '''
+        Обработчик команды /stats.
+        Отправляет перцентили задержек (HTTP, разбор, проверка правил,
+        отправка в Telegram, опоздание опроса), счетчики ошибок и, если
+        поставщиков несколько, состояние каждого из них.
+        '''
+        if not self.subscriptions.is_allowed(message.chat.id):
+            await message.answer("Нет доступа")
+            return
+        text = format_stats(metrics.snapshot())
+        if len(self.number_checker.providers) > 1:
+            text += "\n\n" + self.number_checker.describe_providers()
+        await message.answer(text)
+
     async def stop_command(self, message: types.Message) -> None:
         '''
         Обработчик команды /stop.
@@ -49,33 +284,97 @@ class BotHandler:
         '''
         await message.answer("Остановлен")
         self.stop = True
+        self.active = False
         if hasattr(self, 'check_loop_task'):
             self.check_loop_task.cancel()
 
+    def dump_state(self) -> dict[str, Optional[bool]]:
+        return {"active": self.active}
+
+    def restore_state(self, saved: dict[str, Optional[bool]]) -> None:
+        self.active = saved.get("active")
+
+    async def close(self) -> None:
+        '''
+        Останавливает цикл проверки. Вызывается при остановке бота до
+        закрытия HTTP-клиента и очереди сообщений.
+        '''
+        self.stop = True
+        task = getattr(self, 'check_loop_task', None)
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
     async def check_loop(self) -> None:
         '''
-        Бесконечный цикл, который проверяет доступные телефонные номера
-        каждые 10 минут (600 секунд).
-        Если доступные номера найдены, он ожидает 30 минут (1800 секунд) перед
-        следующей проверкой.
+        Бесконечный цикл, который проверяет доступные телефонные номера.
+        Сроки опроса каждой цели задает AdaptiveScheduler: цели, по которым
+        рынок меняется, опрашиваются чаще, при ошибках и ответе 429 опрос
+        цели откладывается. Каждый подписчик получает уведомления только об
+        изменениях предложений, подходящих под его правила.
         '''
         self.stop = False
+        # Первый цикл использует ответы, полученные во время запуска
+        max_age = self.number_checker.prefetch_age()
         while not self.stop:
-            if await self.number_checker.get_numbers(self.bot):
-                await asyncio.sleep(1800)
-            await asyncio.sleep(600)
+            targets = self.number_checker.targets_by_key
+            due = [targets[key] for key in self.scheduler.due()
+                   if key in targets]
+            if due:
+                with metrics.timer('check_cycle_seconds'):
+                    results = await self.number_checker.check_targets(
+                        self.bot, due, max_age=max_age
+                    )
+                for result in results:
+                    if result.target.key not in self.scheduler.states:
+                        # Цель ушла другому воркеру, пока шел опрос
+                        continue
+                    if result.ok:
+                        self.scheduler.record_success(result.target.key,
+                                                      result.changed)
+                    else:
+                        self.scheduler.record_error(result.target.key,
+                                                    result.error)
+            max_age = 0.0
+            await self.scheduler.wait()
 
     async def on_startup(self) -> None:
         '''
         Функция, вызываемая при запуске бота.
-        Устанавливает команды бота и запускает бесконечный цикл проверки
-        доступных номеров.
+        Запускает цикл проверки доступных номеров (если он не был
+        остановлен командой /stop до перезапуска) и параллельно с первым
+        опросом устанавливает команды бота. Первый воркер кластера
+        записывает свои правила в общее хранилище.
         '''
+        if self.coordinator is not None \
+                and not await self.coordinator.sync_rules():
+            # Общих правил еще нет: их задают правила этого воркера
+            await self.coordinator.publish_rules(self.subscriptions.dump())
+        if self.coordinator is not None or self.active is not False:
+            self.start_check_loop()
         bot_commands = [
             BotCommand(command="/start", description="Запуск"),
             BotCommand(command="/check", description="Проверка номеров"),
             BotCommand(command="/balance", description="Проверка баланса"),
+            BotCommand(command="/history", description="История цен"),
+            BotCommand(command="/report", description="Отчет по истории"),
+            BotCommand(command="/watch", description="Добавить правило"),
+            BotCommand(command="/unwatch", description="Удалить правила"),
+            BotCommand(command="/rules", description="Мои правила"),
+            BotCommand(command="/stats", description="Метрики"),
             BotCommand(command="/stop", description="Остановить работу")
         ]
-        await self.bot.set_my_commands(bot_commands)
-        asyncio.create_task(self.check_loop())
+        try:
+            await self.bot.set_my_commands(bot_commands)
+        except Exception:
+            # Без меню команд бот работает, запуск не прерывается
+            logging.exception("Не удалось установить команды бота")
+
+
+def describe_rule(rule: WatchRule) -> str:
+    text = (f"{rule.service}, страна {rule.country}: цена до "
+            f"{rule.max_price}, от {rule.min_count} номеров")
+    if rule.conditions:
+        text += ", " + ", ".join(condition.describe()
+                                 for condition in rule.conditions)
+    return text
@@ -6,34 +6,33 @@
     - admin_id
     - url_sms_activate
     - url_api_sms
+    - watch_rules (JSON-список правил) и/или rules_file
 '''
 import logging
 import os
 import asyncio
-import requests
+from typing import Optional
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
 from dotenv import load_dotenv
+from http_client import HttpClient
+from log_setup import setup_logging
+from watch_rules import (WatchEngine, format_matches, load_rules,
+                         parse_rules, service_from_url)
 
 
 class BotHandler:
-
-    TOKEN_API = os.getenv('TOKEN_API')
-    if TOKEN_API is None:
-        raise ValueError("Переменная окружения 'TOKEN_API' не установлена")
-
-    bot = Bot(TOKEN_API)
-    dp = Dispatcher(storage=MemoryStorage())
-
-    admin_id = os.getenv('admin_id')
-    if admin_id is None:
-        raise ValueError("Переменная окружения 'admin_id' не установлена")
-
-    def __init__(self, bot: Bot, admin_id: int) -> None:
+    def __init__(self,
+                 bot: Bot,
+                 admin_id: int,
+                 engine: WatchEngine,
+                 client: Optional[HttpClient] = None) -> None:
         self.bot = bot
         self.admin_id = admin_id
+        self.engine = engine
+        self.client = client if client is not None else HttpClient()
         self.stop = False
 
     async def start_command(self, message: types.Message) -> None:
@@ -83,10 +82,9 @@ class BotHandler:
     async def get_numbers(self) -> bool:
         '''
         Отправляет GET-запрос к API SMS Activate для получения списка доступных
-        телефонных номеров. Функция фильтрует результаты, чтобы включать только
-        номера из страны 22 с ценой менее или равной 4.
-        Если номера найдены, функция отправляет сообщение администратору с
-        количеством и ценой номеров.
+        телефонных номеров. Результаты проверяются всеми правилами WatchEngine.
+        Если есть срабатывания, функция отправляет администратору одно
+        сообщение со всеми найденными номерами, их количеством и ценой.
         '''
         try:
             url = os.getenv('url_sms_activate')
@@ -94,27 +92,12 @@ class BotHandler:
                 raise ValueError(
                     "Переменная окружения 'url_sms_activate' не установлена."
                     )
-            headers = {
-                'user-agent': (
-                    'Mozilla/5.0 (iPad; CPU OS 16_3 like Mac OS X) '
-                    'AppleWebKit/605.1.15 (KHTML, like Gecko) '
-                    'GSA/289.0.577695730 Mobile/15E148 Safari/604.1'
-                    )
-                }
-            r = requests.get(url, headers=headers, timeout=10)
-            print(r.text)
-            json_data = r.json()
-            # print(json_data)
-            for value in json_data.values():
-                if value.get("country") == 137 and value.get('price') <= 12:
-                    count_numbers = value.get("count")
-                    if count_numbers != 0:
-                        message = (
-                            f"Доступно {count_numbers} номеров по цене"
-                            f" {value.get('price')}"
-                        )
-                        await self.send_message(message)
-                        return True
+            json_data = await self.client.get_json(url)
+            matches = self.engine.evaluate(json_data,
+                                           service_from_url(url))
+            if matches:
+                await self.send_message(format_matches(matches))
+                return True
         except Exception as e:
             # print(e)
             await self.send_message(f"Ошибка: {e}")
@@ -132,9 +115,9 @@ class BotHandler:
                 raise ValueError(
                     "Переменная окружения 'url_api_sms' не установлена."
                     )
-            r = requests.get(url, timeout=10)
+            text = await self.client.get_text(url)
             await self.send_message(f"Баланс: "
-                                    f"{r.text.split('ACCESS_BALANCE:')[-1]}")
+                                    f"{text.split('ACCESS_BALANCE:')[-1]}")
         except Exception as e:
             # print(e)
             await self.send_message(f"Ошибка: {e}")
@@ -145,7 +128,7 @@ class BotHandler:
         '''
         if self.admin_id is None:
             raise ValueError("Переменная окружения 'admin_id' не установлена")
-        await bot.send_message(self.admin_id, message)
+        await self.bot.send_message(self.admin_id, message)
 
     async def on_startup(self):
         '''
@@ -176,19 +159,12 @@ class BotHandler:
                             Command(commands=['balance']))
         dp.message.register(self.stop_command,
                             Command(commands=['stop']))
+        dp.shutdown.register(self.client.close)
         await dp.start_polling(self.bot)
 
 
-logging.basicConfig(level=logging.DEBUG,
-                    filename='logs.log',
-                    format='%(levelname)s (%(asctime)s): %(message)s '
-                    '(Line: %(lineno)d) [%(filename)s]',
-                    datefmt='%d/%m/%Y %I:%M:%S',
-                    encoding='utf-8',
-                    filemode='w')
-
-
 if __name__ == '__main__':
+    listener = setup_logging('logs.log', logging.DEBUG, debug_sample=10)
     load_dotenv()
     TOKEN_API = os.getenv('TOKEN_API')
     admin_id = int(os.getenv('admin_id', 0))
@@ -197,6 +173,17 @@ if __name__ == '__main__':
         raise ValueError("Переменные окружения 'TOKEN_API' и 'admin_id' должны"
                          "быть установлены")
 
+    rules = parse_rules(os.getenv('watch_rules', '[]'))
+    rules_file = os.getenv('rules_file')
+    if rules_file:
+        rules.extend(load_rules(rules_file))
+    if not rules:
+        raise ValueError("Не заданы правила отслеживания: переменные "
+                         "окружения 'watch_rules' или 'rules_file'")
+
     bot = Bot(TOKEN_API)
-    bot_handler = BotHandler(bot, admin_id)
-    asyncio.run(bot_handler.main())
+    bot_handler = BotHandler(bot, admin_id, WatchEngine(rules))
+    try:
+        asyncio.run(bot_handler.main())
+    finally:
+        listener.stop()
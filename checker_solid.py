@@ -6,11 +6,15 @@
     - admin_id
     - url_sms_activate
     - url_api_sms
+    - watch_rules (JSON-список правил) и/или rules_file
 '''
 import asyncio
-import requests
+from typing import Optional
 from aiogram import Bot, types
 from aiogram.types import BotCommand
+from http_client import HttpClient
+from number_checker import describe_error
+from watch_rules import WatchEngine, format_matches, service_from_url
 
 
 class SmsService:
@@ -28,47 +32,38 @@ class NumberChecker:
     def __init__(self,
                  sms_service: SmsService,
                  url_sms_activate: str,
-                 url_api_sms: str):
+                 url_api_sms: str,
+                 engine: WatchEngine,
+                 client: Optional[HttpClient] = None):
         self.sms_service = sms_service
         self.url_sms_activate = url_sms_activate
         self.url_api_sms = url_api_sms
+        self.engine = engine
+        self.client = client if client is not None else HttpClient()
+
+    async def close(self) -> None:
+        '''
+        Закрывает HTTP-клиент проверщика. Вызывается при остановке бота.
+        '''
+        await self.client.close()
 
     async def get_numbers(self, bot: Bot) -> bool:
         '''
         Отправляет GET-запрос к API SMS Activate для получения списка доступных
-        телефонных номеров. Функция фильтрует результаты, чтобы включать только
-        номера из страны 22 с ценой менее или равной 4.
-        Если номера найдены, функция отправляет сообщение администратору с
-        количеством и ценой номеров.
+        телефонных номеров. Результаты проверяются всеми правилами WatchEngine.
+        Если есть срабатывания, функция отправляет администратору одно
+        сообщение со всеми найденными номерами, их количеством и ценой.
         '''
         try:
-            headers = {
-                'user-agent': (
-                    'Mozilla/5.0 (iPad; CPU OS 16_3 like Mac OS X) '
-                    'AppleWebKit/605.1.15 (KHTML, like Gecko) '
-                    'GSA/289.0.577695730 Mobile/15E148 Safari/604.1'
-                )
-            }
-            r = requests.get(self.url_sms_activate,
-                             headers=headers,
-                             timeout=10)
-            r.raise_for_status()
-            json_data = r.json()
-            for value in json_data.values():
-                if value.get("country") == 137 and value.get('price') <= 12:
-                    count_numbers = value.get("count")
-                    if count_numbers != 0:
-                        message = (
-                            f"Доступно {count_numbers} номеров по "
-                            f"цене {value.get('price')}"
-                        )
-                        await self.sms_service.send_message(bot, message)
-                        return True
-        except requests.RequestException as e:
-            await self.sms_service.send_message(bot, f"Ошибка запроса: {e}")
-        except ValueError as e:
-            await self.sms_service.send_message(bot, f"Ошибка обработки "
-                                                f"данных: {e}")
+            json_data = await self.client.get_json(self.url_sms_activate)
+            matches = self.engine.evaluate(
+                json_data, service_from_url(self.url_sms_activate))
+            if matches:
+                await self.sms_service.send_message(bot,
+                                                    format_matches(matches))
+                return True
+        except Exception as e:
+            await self.sms_service.send_message(bot, describe_error(e))
         await self.sms_service.send_message(bot, "Нет доступных номеров")
         return False
 
@@ -78,14 +73,11 @@ class NumberChecker:
         Функция отправляет сообщение администратору с полученным балансом.
         '''
         try:
-            r = requests.get(self.url_api_sms, timeout=10)
-            r.raise_for_status()
-            balance = r.text.split('ACCESS_BALANCE:')[-1]
+            text = await self.client.get_text(self.url_api_sms)
+            balance = text.split('ACCESS_BALANCE:')[-1]
             await self.sms_service.send_message(bot, f"Баланс: {balance}")
-        except requests.RequestException as e:
-            await self.sms_service.send_message(bot, f"Ошибка запроса: {e}")
         except Exception as e:
-            await self.sms_service.send_message(bot, f"Ошибка: {e}")
+            await self.sms_service.send_message(bot, describe_error(e))
 
 
 class BotHandler:
@@ -0,0 +1,549 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect
+from typing import Callable, Iterable, Optional
+from metrics import metrics
+
+
+# Ключ аренды, владелец которой получает обновления Telegram (long polling)
+LEADER_KEY = '__leader__'
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(),
+                                          digest_size=8).digest(), 'big')
+
+
+class ConsistentHashRing:
+    '''
+    Кольцо согласованного хеширования: каждый узел представлен replicas
+    точками, ключ принадлежит узлу первой точки по часовой стрелке. При
+    добавлении или уходе узла переезжает только доля ключей этого узла.
+    '''
+    def __init__(self, nodes: Iterable[str], replicas: int = 64):
+        points = sorted((_hash(f"{node}#{index}"), node)
+                        for node in set(nodes) for index in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._nodes:
+            return None
+        index = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class CoordinationStore(ABC):
+    '''
+    Общее хранилище координации воркеров: живые воркеры (heartbeat с
+    TTL), аренды целей опроса, отпечатки отправленных уведомлений,
+    правила подписчиков и последние снимки предложений целей. Время
+    аренд - unix-время, общее для всех процессов.
+    '''
+    @abstractmethod
+    async def heartbeat(self, worker_id: str, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    async def workers(self) -> list[str]:
+        '''
+        Воркеры, heartbeat которых еще не истек.
+        '''
+
+    @abstractmethod
+    async def acquire(self,
+                      keys: Iterable[str],
+                      owner: str,
+                      ttl: float) -> set[str]:
+        '''
+        Берет или продлевает аренду ключей. Возвращает ключи, аренда
+        которых теперь принадлежит owner; ключи с чужой действующей
+        арендой пропускаются.
+        '''
+
+    @abstractmethod
+    async def release(self, keys: Iterable[str], owner: str) -> None:
+        ...
+
+    @abstractmethod
+    async def claim(self, fingerprint: str, ttl: float) -> bool:
+        '''
+        Отмечает уведомление отправленным. False, если его уже отправил
+        другой воркер за последние ttl секунд.
+        '''
+
+    @abstractmethod
+    async def rules(self) -> tuple[int, Optional[str]]:
+        '''
+        Правила подписчиков, общие для всех воркеров: версия (0 - правила
+        еще не записаны) и JSON-список правил.
+        '''
+
+    @abstractmethod
+    async def publish_rules(self, text: str, version: int) -> bool:
+        '''
+        Записывает правила версией version + 1, если текущая версия -
+        version. False, если правила уже изменил другой воркер.
+        '''
+
+    @abstractmethod
+    async def save_snapshot(self, key: str, text: str) -> None:
+        '''
+        Записывает последний снимок предложений цели key (JSON).
+        '''
+
+    @abstractmethod
+    async def snapshots(self, keys: Iterable[str]) -> dict[str, str]:
+        '''
+        Записанные снимки целей keys; цели без снимка пропускаются.
+        '''
+
+    async def close(self) -> None:
+        pass
+
+
+class SqliteStore(CoordinationStore):
+    '''
+    Хранилище координации в файле SQLite (общий том для контейнеров
+    одного хоста). Каждая операция - одна короткая транзакция в
+    отдельном потоке, чтобы ожидание блокировки не останавливало цикл
+    событий.
+    '''
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY, expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS leases (
+                key TEXT PRIMARY KEY, owner TEXT NOT NULL,
+                expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS notifications (
+                fingerprint TEXT PRIMARY KEY, expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS rules (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS snapshots (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+
+    def _run(self, function: Callable, *args):
+        def locked():
+            with self._lock:
+                return function(*args)
+        return asyncio.to_thread(locked)
+
+    async def heartbeat(self, worker_id: str, ttl: float) -> None:
+        def write():
+            now = time.time()
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO workers "
+                                 "VALUES (?, ?)", (worker_id, now + ttl))
+                self._db.execute("DELETE FROM workers WHERE expires < ?",
+                                 (now,))
+        await self._run(write)
+
+    async def workers(self) -> list[str]:
+        def read():
+            return [row[0] for row in self._db.execute(
+                "SELECT id FROM workers WHERE expires >= ? ORDER BY id",
+                (time.time(),))]
+        return await self._run(read)
+
+    async def acquire(self,
+                      keys: Iterable[str],
+                      owner: str,
+                      ttl: float) -> set[str]:
+        keys = list(keys)
+
+        def write():
+            now = time.time()
+            acquired = set()
+            with self._db:
+                for key in keys:
+                    cursor = self._db.execute(
+                        "INSERT INTO leases VALUES (?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET "
+                        "owner = excluded.owner, expires = excluded.expires "
+                        "WHERE leases.owner = excluded.owner "
+                        "OR leases.expires < ?",
+                        (key, owner, now + ttl, now))
+                    if cursor.rowcount:
+                        acquired.add(key)
+            return acquired
+        return await self._run(write)
+
+    async def release(self, keys: Iterable[str], owner: str) -> None:
+        keys = list(keys)
+
+        def write():
+            with self._db:
+                self._db.executemany(
+                    "DELETE FROM leases WHERE key = ? AND owner = ?",
+                    [(key, owner) for key in keys])
+        await self._run(write)
+
+    async def claim(self, fingerprint: str, ttl: float) -> bool:
+        def write():
+            now = time.time()
+            with self._db:
+                self._db.execute("DELETE FROM notifications "
+                                 "WHERE expires < ?", (now,))
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO notifications VALUES (?, ?)",
+                    (fingerprint, now + ttl))
+                return bool(cursor.rowcount)
+        return await self._run(write)
+
+    async def rules(self) -> tuple[int, Optional[str]]:
+        def read():
+            row = self._db.execute(
+                "SELECT version, value FROM rules WHERE id = 0").fetchone()
+            return (row[0], row[1]) if row is not None else (0, None)
+        return await self._run(read)
+
+    async def publish_rules(self, text: str, version: int) -> bool:
+        def write():
+            with self._db:
+                if version == 0:
+                    cursor = self._db.execute(
+                        "INSERT OR IGNORE INTO rules VALUES (0, 1, ?)",
+                        (text,))
+                else:
+                    cursor = self._db.execute(
+                        "UPDATE rules SET version = version + 1, value = ? "
+                        "WHERE id = 0 AND version = ?", (text, version))
+                return bool(cursor.rowcount)
+        return await self._run(write)
+
+    async def save_snapshot(self, key: str, text: str) -> None:
+        def write():
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO snapshots "
+                                 "VALUES (?, ?)", (key, text))
+        await self._run(write)
+
+    async def snapshots(self, keys: Iterable[str]) -> dict[str, str]:
+        keys = list(keys)
+
+        def read():
+            saved = {}
+            for key in keys:
+                row = self._db.execute(
+                    "SELECT value FROM snapshots WHERE key = ?",
+                    (key,)).fetchone()
+                if row is not None:
+                    saved[key] = row[0]
+            return saved
+        return await self._run(read)
+
+    async def close(self) -> None:
+        await self._run(self._db.close)
+
+
+# Взять или продлить аренду, если она свободна или уже наша
+_ACQUIRE = """
+local current = redis.call('GET', KEYS[1])
+if current == false or current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+# Записать правила, если их версия не изменилась с чтения
+_PUBLISH_RULES = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+if current ~= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'version', current + 1, 'value', ARGV[1])
+return 1
+"""
+
+
+class RedisStore(CoordinationStore):
+    '''
+    Хранилище координации в Redis (или совместимом сервере). Требует
+    пакет redis; аренды - ключи с TTL, воркеры - упорядоченное множество
+    со сроком heartbeat в качестве веса.
+    '''
+    def __init__(self, url: str, prefix: str = 'checker:'):
+        try:
+            from redis import asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("Для CLUSTER_STORE=redis://... нужен пакет "
+                               "redis") from e
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._acquire = self._redis.register_script(_ACQUIRE)
+        self._release = self._redis.register_script(_RELEASE)
+        self._publish_rules = self._redis.register_script(_PUBLISH_RULES)
+
+    async def heartbeat(self, worker_id: str, ttl: float) -> None:
+        now = time.time()
+        key = f"{self.prefix}workers"
+        await self._redis.zadd(key, {worker_id: now + ttl})
+        await self._redis.zremrangebyscore(key, '-inf', now)
+
+    async def workers(self) -> list[str]:
+        members = await self._redis.zrangebyscore(f"{self.prefix}workers",
+                                                  time.time(), '+inf')
+        return sorted(member.decode() for member in members)
+
+    async def acquire(self,
+                      keys: Iterable[str],
+                      owner: str,
+                      ttl: float) -> set[str]:
+        keys = list(keys)
+        results = await asyncio.gather(*(
+            self._acquire(keys=[f"{self.prefix}lease:{key}"],
+                          args=[owner, int(ttl * 1000)])
+            for key in keys
+        ))
+        return {key for key, result in zip(keys, results) if result}
+
+    async def release(self, keys: Iterable[str], owner: str) -> None:
+        await asyncio.gather(*(
+            self._release(keys=[f"{self.prefix}lease:{key}"], args=[owner])
+            for key in keys
+        ))
+
+    async def claim(self, fingerprint: str, ttl: float) -> bool:
+        return bool(await self._redis.set(
+            f"{self.prefix}sent:{fingerprint}", 1,
+            nx=True, px=int(ttl * 1000)
+        ))
+
+    async def rules(self) -> tuple[int, Optional[str]]:
+        version, value = await self._redis.hmget(f"{self.prefix}rules",
+                                                 'version', 'value')
+        return (int(version) if version is not None else 0,
+                value.decode() if value is not None else None)
+
+    async def publish_rules(self, text: str, version: int) -> bool:
+        return bool(await self._publish_rules(keys=[f"{self.prefix}rules"],
+                                              args=[text, version]))
+
+    async def save_snapshot(self, key: str, text: str) -> None:
+        await self._redis.hset(f"{self.prefix}snapshots", key, text)
+
+    async def snapshots(self, keys: Iterable[str]) -> dict[str, str]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = await self._redis.hmget(f"{self.prefix}snapshots", keys)
+        return {key: value.decode() for key, value in zip(keys, values)
+                if value is not None}
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def open_store(url: str) -> CoordinationStore:
+    '''
+    Хранилище по адресу: redis://... (rediss://...) или путь к файлу
+    SQLite (допускается префикс sqlite:///).
+    '''
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url)
+    return SqliteStore(url.removeprefix('sqlite:///'))
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardCoordinator:
+    '''
+    Распределение целей опроса между воркерами. Живые воркеры образуют
+    кольцо согласованного хеширования, каждый опрашивает только свои
+    цели и держит на них аренду с TTL. Аренды продлеваются фоновой
+    задачей каждые ttl/3 секунд; если воркер умирает, его heartbeat и
+    аренды истекают, и цели переходят к оставшимся воркерам. Ключ
+    LEADER_KEY выбирает единственного воркера, получающего обновления
+    Telegram. Отправленные уведомления отмечаются в хранилище, чтобы одно
+    изменение не рассылалось разными воркерами. Правила подписчиков тоже
+    общие: каждый шаг загружает их, если их изменил другой воркер
+    (on_rules), до пересчета кольца, поэтому цель нового правила
+    опрашивает тот воркер, которому она принадлежит. Владелец цели
+    записывает ее снимок предложений (save_snapshot); воркер, получивший
+    цель, загружает снимок (on_snapshots) до первого опроса и не
+    повторяет уведомления прежнего владельца.
+    '''
+    def __init__(self,
+                 store: CoordinationStore,
+                 worker_id: str,
+                 keys: Iterable[str] = (),
+                 ttl: float = 30,
+                 dedup_ttl: float = 60):
+        self.store = store
+        self.worker_id = worker_id
+        self.keys = set(keys)
+        self.ttl = ttl
+        self.dedup_ttl = dedup_ttl
+        self.owned: set[str] = set()
+        self.on_change: Optional[Callable[[set[str]], None]] = None
+        self.on_rules: Optional[Callable[[str], None]] = None
+        self.on_snapshots: Optional[
+            Callable[[dict[str, dict]], None]
+        ] = None
+        # Версия общих правил, которые применены на этом воркере
+        self.rules_version = 0
+        self.leader = asyncio.Event()
+        self.leadership_lost = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def owns(self, key: str) -> bool:
+        return key in self.owned
+
+    def set_keys(self, keys: Iterable[str]) -> None:
+        '''
+        Заменяет набор целей; распределение пересчитывается сразу.
+        '''
+        self.keys = set(keys)
+        self._wakeup.set()
+
+    async def step(self) -> None:
+        '''
+        Один шаг координации: heartbeat, загрузка изменившихся правил,
+        пересчет кольца, продление и получение аренд своих целей (со
+        снимками новых целей), освобождение чужих.
+        '''
+        await self.store.heartbeat(self.worker_id, self.ttl)
+        await self.sync_rules()
+        workers = set(await self.store.workers()) | {self.worker_id}
+        ring = ConsistentHashRing(workers)
+        wanted = {key for key in self.keys
+                  if ring.owner(key) == self.worker_id}
+        acquired = await self.store.acquire(sorted(wanted) + [LEADER_KEY],
+                                            self.worker_id, self.ttl)
+        if LEADER_KEY in acquired:
+            acquired.discard(LEADER_KEY)
+            self.leader.set()
+        elif self.leader.is_set():
+            logging.error("Воркер %s потерял роль получателя обновлений",
+                          self.worker_id)
+            self.leader.clear()
+            self.leadership_lost.set()
+        released = self.owned - wanted
+        if released:
+            await self.store.release(released, self.worker_id)
+        new = acquired - self.owned
+        if new and self.on_snapshots is not None:
+            saved = await self.store.snapshots(sorted(new))
+            self.on_snapshots({key: json.loads(text)
+                               for key, text in saved.items()})
+        if acquired != self.owned:
+            logging.info("Воркер %s (из %d) опрашивает %d целей из %d",
+                         self.worker_id, len(workers), len(acquired),
+                         len(self.keys))
+            self.owned = acquired
+            if self.on_change is not None:
+                self.on_change(set(acquired))
+
+    async def sync_rules(self) -> bool:
+        '''
+        Применяет общие правила (on_rules), если их версия отличается от
+        примененной. False, если в хранилище правил еще нет.
+        '''
+        version, text = await self.store.rules()
+        if version != self.rules_version and text is not None:
+            self.rules_version = version
+            if self.on_rules is not None:
+                self.on_rules(text)
+        return version > 0
+
+    async def publish_rules(self, text: str) -> bool:
+        '''
+        Записывает правила в хранилище поверх примененной версии и сразу
+        пересчитывает распределение целей. False, если другой воркер
+        изменил правила раньше: их нужно загрузить и повторить изменение.
+        '''
+        if not await self.store.publish_rules(text, self.rules_version):
+            return False
+        self.rules_version += 1
+        self._wakeup.set()
+        return True
+
+    async def save_snapshot(self, key: str, snapshot: dict) -> None:
+        '''
+        Записывает снимок своей цели для воркера, который получит ее
+        следующим. Ошибка хранилища только записывается в лог: в худшем
+        случае новый владелец повторит уведомления.
+        '''
+        if key not in self.owned:
+            return
+        try:
+            await self.store.save_snapshot(
+                key, json.dumps(snapshot, ensure_ascii=False)
+            )
+        except Exception:
+            metrics.counter('cluster_errors').inc()
+            logging.exception("Не удалось записать снимок цели %s", key)
+
+    async def start(self) -> None:
+        '''
+        Выполняет первый шаг и запускает фоновое продление аренд.
+        '''
+        await self.step()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.ttl / 3)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.step()
+            except Exception:
+                metrics.counter('cluster_errors').inc()
+                logging.exception("Ошибка координации воркеров")
+
+    async def claim(self, fingerprint: str) -> bool:
+        '''
+        True, если уведомление с этим отпечатком еще никто не отправлял.
+        При недоступности хранилища уведомление лучше отправить дважды,
+        чем потерять.
+        '''
+        try:
+            return await self.store.claim(fingerprint, self.dedup_ttl)
+        except Exception:
+            metrics.counter('cluster_errors').inc()
+            logging.exception("Ошибка проверки повторного уведомления")
+            return True
+
+    async def close(self) -> None:
+        '''
+        Останавливает продление и освобождает аренды, чтобы цели сразу
+        перешли к другим воркерам.
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        try:
+            await self.store.release(self.owned | {LEADER_KEY},
+                                     self.worker_id)
+            # Нулевой TTL: остальные воркеры сразу перестроят кольцо
+            await self.store.heartbeat(self.worker_id, 0)
+        finally:
+            await self.store.close()
@@ -1,4 +1,7 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from providers import ProviderConfig
+from watch_rules import WatchRule, load_rules
 
 class Settings(BaseSettings):
     token: str
@@ -6,4 +9,144 @@ class Settings(BaseSettings):
     url_sms_activate: str
     url_api_sms: str
 
-    model_config = SettingsConfigDict(env_file = ".env") 
\ No newline at end of file
+    # Адрес своего сервера Bot API (по умолчанию api.telegram.org)
+    telegram_api_url: Optional[str] = None
+
+    # Пул HTTP-соединений к API SMS Activate
+    http_limit: int = 100
+    http_limit_per_host: int = 10
+    http_dns_cache_ttl: int = 300
+    http_keepalive_timeout: float = 60
+    http_timeout: float = 10
+    http_connect_timeout: float = 5
+    http_chunk_size: int = 65536
+
+    # Устойчивость запросов к API SMS Activate: зеркала (JSON-список
+    # адресов серверов) для дублирующих запросов и повторов;
+    # предохранитель на каждое действие API размыкается после
+    # BREAKER_FAILURES ошибок подряд на BREAKER_RESET_TIMEOUT секунд;
+    # повторов не больше RETRY_ATTEMPTS на запрос и не больше доли
+    # RETRY_BUDGET_RATIO от всех запросов; HEDGE_REQUESTS включает
+    # дублирующий запрос после p95 задержки
+    api_mirrors: list[str] = []
+    breaker_failures: int = 5
+    breaker_reset_timeout: float = 30
+    retry_attempts: int = 2
+    retry_budget_ratio: float = 0.1
+    hedge_requests: bool = True
+    # Не больше API_RATE_LIMIT запросов в секунду к SMS Activate (0 - без
+    # ограничения) и не больше API_RATE_BURST подряд
+    api_rate_limit: float = 0
+    api_rate_burst: int = 1
+
+    # Дополнительные поставщики номеров (JSON-список): опрашиваются вместе
+    # с SMS Activate, /check показывает самое дешевое предложение среди
+    # всех. У каждого свои предохранители, ограничение частоты
+    # (rate_limit, burst) и состояние в /stats; для 5sim нужны названия
+    # стран (countries) и, если отличаются, сервисов (services)
+    providers: list[ProviderConfig] = []
+
+    # Правила отслеживания: JSON-список в WATCH_RULES и/или файл RULES_FILE
+    watch_rules: list[WatchRule] = []
+    rules_file: Optional[str] = None
+
+    # Опрос нескольких сервисов и аккаунтов: сервисы берутся из правил,
+    # дополнительные API-ключи - из API_KEYS (JSON-список)
+    api_keys: list[str] = []
+    poll_concurrency: int = 10
+
+    # Адаптивный интервал опроса (секунды)
+    poll_min_interval: float = 60
+    poll_max_interval: float = 1800
+    poll_initial_interval: float = 600
+    poll_jitter: float = 0.1
+    poll_max_backoff: float = 3600
+
+    # Уведомлять об изменении количества номеров не меньше чем на столько
+    notify_count_threshold: int = 10
+
+    # История опросов: пустой HISTORY_PATH отключает её
+    history_path: str = 'history.bin'
+    history_tail_size: int = 10000
+
+    # Скользящая статистика цены и количества номеров (окна в секундах;
+    # окна из условий правил добавляются сами), окно делится на
+    # STATS_BUCKETS корзин
+    stats_windows: list[float] = [3600, 86400]
+    stats_buckets: int = 60
+
+    # Подписчики (JSON-список chat_id), которым доступны /watch, /unwatch,
+    # /rules и /check; их правила хранятся в SUBSCRIPTIONS_PATH
+    subscribers: list[int] = []
+    subscriptions_path: str = 'subscriptions.json'
+
+    # Сколько секунд /check и /balance отвечают из кэша
+    cache_ttl: float = 30
+
+    # Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics
+    # (без METRICS_PORT сервер не запускается)
+    metrics_port: Optional[int] = None
+    metrics_host: str = '127.0.0.1'
+
+    # Лог пишет отдельный поток; ротация по LOG_ROTATE_WHEN ('midnight',
+    # 'H', ...) или, без него, по размеру LOG_MAX_BYTES. LOG_JSON - записи
+    # одной строкой JSON; LOG_DEBUG_SAMPLE - писать каждую N-ю
+    # повторяющуюся запись DEBUG
+    log_path: str = 'logs.log'
+    log_level: str = 'INFO'
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    log_rotate_when: Optional[str] = None
+    log_json: bool = False
+    log_debug_sample: int = 1
+
+    # Режим webhook вместо long polling: публичный адрес, на который
+    # Telegram отправляет обновления (путь берется из него же). Без
+    # WEBHOOK_SECRET секретный токен генерируется при каждом запуске.
+    # Сертификат и ключ включают TLS на самом сервере; сертификат также
+    # передается Telegram (для самоподписанных сертификатов).
+    webhook_url: Optional[str] = None
+    webhook_host: str = '0.0.0.0'
+    webhook_port: int = 8443
+    webhook_secret: Optional[str] = None
+    webhook_ssl_cert: Optional[str] = None
+    webhook_ssl_key: Optional[str] = None
+
+    # Автопокупка номеров по правилам с "auto_buy": true: не больше
+    # AUTO_BUY_MAX_PURCHASES покупок за AUTO_BUY_WINDOW секунд
+    auto_buy: bool = False
+    auto_buy_window: float = 3600
+    auto_buy_max_purchases: int = 1
+
+    # Несколько воркеров: цели распределяются по CLUSTER_STORE (путь к
+    # файлу SQLite или redis://...). Воркер с арендой LEADER получает
+    # обновления Telegram. Одинаковые уведомления разных воркеров за
+    # NOTIFY_DEDUP_TTL секунд отправляются один раз. WORKER_ID - имя
+    # воркера, уникальное в кластере (по умолчанию имя хоста и PID).
+    # Пример запуска - сервисы worker-1 и worker-2 в docker-compose.yaml.
+    cluster_store: Optional[str] = None
+    worker_id: Optional[str] = None
+    cluster_lease_ttl: float = 30
+    notify_dedup_ttl: float = 60
+
+    # Состояние между перезапусками (снимки, расписание, отпечатки
+    # уведомлений, FSM) в файле SQLite STATE_PATH, запись раз в
+    # STATE_CHECKPOINT_INTERVAL секунд; пустой STATE_PATH отключает его.
+    # У каждого воркера должен быть свой файл.
+    state_path: str = 'state.db'
+    state_checkpoint_interval: float = 5
+
+    # Запись ответов API с моментами получения в файл JSON Lines (.gz -
+    # со сжатием) для воспроизведения: python -m replay RECORD_PATH
+    record_path: Optional[str] = None
+
+    model_config = SettingsConfigDict(env_file = ".env")
+
+    def load_watch_rules(self) -> list[WatchRule]:
+        '''
+        Возвращает правила из WATCH_RULES вместе с правилами из RULES_FILE.
+        '''
+        rules = list(self.watch_rules)
+        if self.rules_file:
+            rules.extend(load_rules(self.rules_file))
+        return rules
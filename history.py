@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from typing import Iterable, NamedTuple, Optional
+from offers import DEFAULT_PROVIDER
+from watch_rules import provider_label
+
+
+# Запись фиксированного размера: время (unix), сервис, страна, количество,
+# цена, поставщик. Поля выровнены, поэтому файл можно читать и как массив
+# структур. Первая запись файла - заголовок HEADER.
+RECORD = struct.Struct('<d8siid16s')
+RECORD_SIZE = RECORD.size
+HEADER = b'SMSHIST2'.ljust(RECORD_SIZE, b'\0')
+# Записи прежнего формата, без поставщика и заголовка
+LEGACY_RECORD = struct.Struct('<d8siid')
+
+
+class HistoryRecord(NamedTuple):
+    timestamp: float
+    service: str
+    country: int
+    count: int
+    price: float
+    provider: str = DEFAULT_PROVIDER
+
+    def pack(self) -> bytes:
+        return RECORD.pack(self.timestamp,
+                           self.service.encode()[:8],
+                           self.country,
+                           self.count,
+                           self.price,
+                           self.provider.encode()[:16])
+
+    @classmethod
+    def unpack(cls, values: tuple) -> 'HistoryRecord':
+        timestamp, service, country, count, price, *provider = values
+        return cls(timestamp, service.rstrip(b'\0').decode(), country,
+                   count, price,
+                   provider[0].rstrip(b'\0').decode() if provider
+                   else DEFAULT_PROVIDER)
+
+
+def upgrade(path: str, batch_size: int = 1 << 16) -> bool:
+    '''
+    Переписывает файл истории прежнего формата (без поставщика) в
+    текущий; записи относятся к DEFAULT_PROVIDER. False, если файла нет
+    или он уже в текущем формате.
+    '''
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return False
+    with open(path, 'rb') as file:
+        if file.read(len(HEADER)) == HEADER:
+            return False
+        file.seek(0)
+        with open(f"{path}.tmp", 'wb') as upgraded:
+            upgraded.write(HEADER)
+            while True:
+                data = file.read(LEGACY_RECORD.size * batch_size)
+                # Недописанная при аварии запись отбрасывается
+                data = data[:len(data) - len(data) % LEGACY_RECORD.size]
+                if not data:
+                    break
+                upgraded.write(b''.join(
+                    RECORD.pack(*values, DEFAULT_PROVIDER.encode())
+                    for values in LEGACY_RECORD.iter_unpack(data)
+                ))
+    os.replace(f"{path}.tmp", path)
+    logging.info("Файл истории %s переведен в формат с поставщиком", path)
+    return True
+
+
+class HistoryStore:
+    '''
+    Хранилище истории цен и количества номеров: файл из записей
+    фиксированного размера, в который только дописывают. Запись ведет
+    отдельный поток, поэтому append не блокирует цикл событий. Последние
+    tail_size записей дополнительно хранятся в памяти. Записи упорядочены
+    по времени, поэтому диапазон находится бинарным поиском по файлу.
+    Файл прежнего формата переписывается при открытии.
+    '''
+    def __init__(self, path: str, tail_size: int = 10000):
+        self.path = path
+        upgrade(path)
+        self.tail: deque[HistoryRecord] = deque(maxlen=tail_size)
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_writer()
+
+    def _start_writer(self) -> None:
+        self._thread = threading.Thread(target=self._writer,
+                                        name='history-writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def append(self, records: Iterable[HistoryRecord]) -> None:
+        '''
+        Добавляет записи в хвост в памяти и ставит их в очередь на запись.
+        После close поток записи запускается снова.
+        '''
+        records = list(records)
+        if records:
+            self.tail.extend(records)
+            self._queue.put(records)
+            if not self._thread.is_alive():
+                self._start_writer()
+
+    def _writer(self) -> None:
+        with open(self.path, 'ab') as file:
+            # Недописанная при аварии запись отбрасывается
+            size = file.tell()
+            if size % RECORD_SIZE:
+                file.truncate(size - size % RECORD_SIZE)
+            if size < RECORD_SIZE:
+                file.write(HEADER)
+            while True:
+                batch = self._queue.get()
+                stop = batch is None
+                chunks = [] if stop else [batch]
+                while not self._queue.empty():
+                    more = self._queue.get()
+                    if more is None:
+                        stop = True
+                    else:
+                        chunks.append(more)
+                try:
+                    file.write(b''.join(record.pack()
+                                        for chunk in chunks
+                                        for record in chunk))
+                    file.flush()
+                except OSError:
+                    logging.exception("Не удалось записать историю")
+                if stop:
+                    return
+
+    async def close(self) -> None:
+        '''
+        Дописывает очередь и останавливает поток записи.
+        '''
+        self._queue.put(None)
+        await asyncio.to_thread(self._thread.join)
+
+    def query(self,
+              start: float,
+              end: Optional[float] = None,
+              service: Optional[str] = None,
+              country: Optional[int] = None) -> list[HistoryRecord]:
+        '''
+        Записи за интервал [start, end] с необязательным фильтром по
+        сервису и стране. Если интервал целиком в хвосте, файл не читается.
+        Чтение файла блокирующее: из асинхронного кода вызывается через
+        asyncio.to_thread.
+        '''
+        if end is None:
+            end = time.time()
+        # deque.copy выполняется атомарно, поэтому запрос можно делать из
+        # другого потока, пока цикл событий дописывает хвост
+        tail = self.tail.copy()
+        if tail and tail[0].timestamp <= start:
+            records: Iterable[HistoryRecord] = tail
+        else:
+            # Файл может отставать от хвоста на еще не записанные пакеты
+            boundary = tail[0].timestamp if tail else float('inf')
+            records = [record for record in self._read_range(start, end)
+                       if record.timestamp < boundary]
+            records.extend(tail)
+        return [record for record in records
+                if start <= record.timestamp <= end
+                and (service is None or record.service == service)
+                and (country is None or record.country == country)]
+
+    def _read_range(self, start: float, end: float) -> list[HistoryRecord]:
+        if not os.path.exists(self.path) \
+                or os.path.getsize(self.path) < 2 * RECORD_SIZE:
+            return []
+        with open(self.path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            total = len(data) // RECORD_SIZE
+            # Запись 0 - заголовок
+            first = self._bisect(data, total, start)
+            last = self._bisect(data, total, end, right=True)
+            return [HistoryRecord.unpack(values) for values in
+                    RECORD.iter_unpack(data[first * RECORD_SIZE:
+                                            last * RECORD_SIZE])]
+
+    @staticmethod
+    def _bisect(data: mmap.mmap,
+                total: int,
+                timestamp: float,
+                right: bool = False) -> int:
+        low, high = 1, total
+        while low < high:
+            middle = (low + high) // 2
+            value = struct.unpack_from('<d', data, middle * RECORD_SIZE)[0]
+            if value < timestamp or right and value == timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+def summarize(records: list[HistoryRecord]) -> str:
+    '''
+    Сводка по истории для команды /history: для каждой пары (сервис,
+    страна) у каждого поставщика число замеров, диапазон цен, последнее
+    состояние и число пополнений (переходов от нуля номеров к ненулевому
+    количеству).
+    '''
+    groups: dict[tuple[str, int, str], list[HistoryRecord]] = {}
+    for record in records:
+        groups.setdefault((record.service, record.country, record.provider),
+                          []).append(record)
+    if not groups:
+        return "Нет данных за этот период"
+    lines = []
+    for (service, country, provider), items in sorted(groups.items()):
+        prices = [item.price for item in items]
+        restocks = [current for previous, current in zip(items, items[1:])
+                    if previous.count == 0 and current.count > 0]
+        last = items[-1]
+        line = (f"{service}, страна {country}{provider_label(provider)}: "
+                f"замеров {len(items)}, "
+                f"цена {min(prices)}-{max(prices)}, сейчас {last.count} "
+                f"по {last.price}, пополнений {len(restocks)}")
+        if restocks:
+            moment = time.strftime('%d.%m %H:%M',
+                                   time.localtime(restocks[-1].timestamp))
+            line += f" (последнее {moment})"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+import aiohttp
+from aiohttp import ClientTimeout, TCPConnector, TraceConfig
+from metrics import metrics
+from offers import loads
+
+
+DEFAULT_HEADERS = {
+    'user-agent': (
+        'Mozilla/5.0 (iPad; CPU OS 16_3 like Mac OS X) '
+        'AppleWebKit/605.1.15 (KHTML, like Gecko) '
+        'GSA/289.0.577695730 Mobile/15E148 Safari/604.1'
+    )
+}
+
+
+def trace_config() -> TraceConfig:
+    '''
+    Трассировка запросов aiohttp: время установки соединения
+    (http_connect_seconds), время до получения заголовков ответа
+    (http_ttfb_seconds) и число ошибок запросов (http_errors).
+    '''
+    async def on_request_start(session, context, params) -> None:
+        context.started = time.perf_counter()
+
+    async def on_connection_create_start(session, context, params) -> None:
+        context.connect_started = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params) -> None:
+        metrics.histogram('http_connect_seconds').observe(
+            time.perf_counter() - context.connect_started
+        )
+
+    async def on_request_end(session, context, params) -> None:
+        metrics.histogram('http_ttfb_seconds').observe(
+            time.perf_counter() - context.started
+        )
+
+    async def on_request_exception(session, context, params) -> None:
+        metrics.counter('http_errors').inc()
+
+    config = TraceConfig()
+    config.on_request_start.append(on_request_start)
+    config.on_connection_create_start.append(on_connection_create_start)
+    config.on_connection_create_end.append(on_connection_create_end)
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    return config
+
+
+class HttpClient:
+    '''
+    Общий HTTP-клиент с пулом соединений.
+    Одна сессия aiohttp живет всё время работы бота: соединения
+    переиспользуются (keep-alive), DNS кэшируется, число соединений к одному
+    хосту ограничено, у каждого запроса есть явный таймаут. Время
+    соединения и ответа записывается в метрики (trace=False отключает).
+    '''
+    def __init__(self,
+                 limit: int = 100,
+                 limit_per_host: int = 10,
+                 ttl_dns_cache: int = 300,
+                 keepalive_timeout: float = 60,
+                 timeout_total: float = 10,
+                 timeout_connect: float = 5,
+                 headers: Optional[dict] = None,
+                 trace: bool = True):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = ClientTimeout(total=timeout_total,
+                                     connect=timeout_connect)
+        self.headers = DEFAULT_HEADERS if headers is None else headers
+        self.trace = trace
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        '''
+        Возвращает общую сессию, создавая её при первом обращении.
+        Сессия создается лениво, внутри работающего цикла событий.
+        '''
+        if self._session is None or self._session.closed:
+            async with self._lock:
+                if self._session is None or self._session.closed:
+                    connector = TCPConnector(
+                        limit=self.limit,
+                        limit_per_host=self.limit_per_host,
+                        ttl_dns_cache=self.ttl_dns_cache,
+                        keepalive_timeout=self.keepalive_timeout,
+                    )
+                    self._session = aiohttp.ClientSession(
+                        connector=connector,
+                        timeout=self.timeout,
+                        headers=self.headers,
+                        trace_configs=[trace_config()] if self.trace
+                        else None,
+                    )
+        return self._session
+
+    @asynccontextmanager
+    async def stream(self, url: str) -> AsyncIterator[aiohttp.ClientResponse]:
+        '''
+        Выполняет GET-запрос и отдает ответ для чтения тела по частям.
+        Если тело прочитано не до конца, соединение закрывается при выходе.
+        '''
+        session = await self.get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            yield response
+
+    async def get_bytes(self, url: str) -> bytes:
+        '''
+        Выполняет GET-запрос и возвращает тело ответа целиком.
+        При статусе ответа 4xx/5xx выбрасывает aiohttp.ClientResponseError.
+        '''
+        session = await self.get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def get_text(self, url: str) -> str:
+        '''
+        Выполняет GET-запрос и возвращает тело ответа как строку.
+        '''
+        return (await self.get_bytes(url)).decode('utf-8', errors='replace')
+
+    async def get_json(self, url: str) -> Any:
+        '''
+        Выполняет GET-запрос и декодирует тело ответа как JSON.
+        Тело декодируется один раз, независимо от заголовка Content-Type.
+        При некорректном JSON выбрасывает ValueError.
+        '''
+        return loads(await self.get_bytes(url))
+
+    async def close(self) -> None:
+        '''
+        Закрывает сессию и все соединения пула.
+        '''
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
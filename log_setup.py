@@ -0,0 +1,151 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from typing import Optional
+from metrics import metrics
+
+
+TEXT_FORMAT = ('%(levelname)s (%(asctime)s): %(message)s '
+               '(Line: %(lineno)d) [%(filename)s]')
+TEXT_DATEFMT = '%d/%m/%Y %I:%M:%S'
+
+# Атрибуты LogRecord; остальные (переданные через extra) попадают в JSON
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message',
+                                                          'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Запись лога одной строкой JSON: время, уровень, логгер, сообщение,
+    место вызова, поля из extra и текст исключения.
+    '''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S',
+                                  time.localtime(record.created))
+                    + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "file": record.filename,
+            "line": record.lineno,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Прореживание частых записей уровня level и ниже: из записей с одним
+    шаблоном сообщения пропускается каждая every-я (первая - всегда).
+    Записи выше level проходят все.
+    '''
+    def __init__(self, every: int, level: int = logging.DEBUG):
+        super().__init__()
+        self.every = max(1, every)
+        self.level = level
+        self._seen: dict[tuple[str, object], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or record.levelno > self.level:
+            return True
+        key = (record.name, record.msg)
+        seen = self._seen.get(key, 0)
+        if len(self._seen) > 10000:
+            # Шаблонов не бывает много; защита от сообщений без шаблона
+            self._seen.clear()
+        self._seen[key] = seen + 1
+        if seen % self.every:
+            metrics.counter('log_sampled_out').inc()
+            return False
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler, который при переполненной очереди отбрасывает запись
+    (счетчик log_dropped), а не ждет поток записи. Сообщение собирается
+    из аргументов сразу, текст исключения хранится отдельно (exc_text).
+    '''
+    _formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._formatter.formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.counter('log_dropped').inc()
+
+
+def file_handler(path: str,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 5,
+                 rotate_when: Optional[str] = None) -> logging.Handler:
+    '''
+    Файл лога с ротацией по времени (rotate_when: 'midnight', 'H', ...)
+    или, если оно не задано, по размеру max_bytes. Файл дописывается,
+    а не перезаписывается при перезапуске.
+    '''
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=rotate_when, backupCount=backup_count,
+            encoding='utf-8', delay=True
+        )
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count,
+        encoding='utf-8', delay=True
+    )
+
+
+def setup_logging(path: str = 'logs.log',
+                  level: int = logging.INFO,
+                  max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5,
+                  rotate_when: Optional[str] = None,
+                  json_format: bool = False,
+                  debug_sample: int = 1,
+                  queue_size: int = 10000
+                  ) -> logging.handlers.QueueListener:
+    '''
+    Настраивает корневой логгер: записи через очередь передаются потоку
+    записи (QueueListener), поэтому вызовы логирования в цикле событий не
+    ждут диска. Возвращает запущенный QueueListener; при завершении нужно
+    вызвать его stop, чтобы дописать очередь.
+    '''
+    handler = file_handler(path, max_bytes, backup_count, rotate_when)
+    handler.setFormatter(JsonFormatter() if json_format
+                         else logging.Formatter(TEXT_FORMAT, TEXT_DATEFMT))
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    if debug_sample > 1:
+        queue_handler.addFilter(SamplingFilter(debug_sample))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, handler,
+                                              respect_handler_level=True)
+    listener.start()
+    return listener
@@ -9,8 +9,15 @@
 
 Основные функции:
 - load_config: загружает конфигурацию из переменных окружения.
+- build_client: HTTP-клиент к API одного поставщика номеров.
+- build_checker: собирает проверщик номеров (без aiogram).
+- build_app: собирает Dispatcher и BotHandler по настройкам.
+- run_worker: запускает воркер в режиме нескольких воркеров.
+- setup_logging (log_setup): лог через очередь и поток записи с
+        ротацией файла.
 - main: основной асинхронный метод, который инициализирует бота и
-        запускает процесс опроса доступных номеров.
+        запускает процесс опроса доступных номеров (long polling или
+        webhook, если задан WEBHOOK_URL).
 
 Классы:
 - BotHandler: класс для обработки команд бота.
@@ -21,17 +28,48 @@
 - /start: запускает бота.
 - /check: проверяет доступные номера.
 - /balance: отображает баланс.
+- /history: показывает историю цен и количества номеров.
+- /report: отчет по истории: пополнения по часам, цены по странам,
+        длительность наличия номеров (NumPy).
+- /watch, /unwatch, /rules: управление правилами подписчика.
+- /stats: показывает метрики задержек и ошибок.
 - /stop: останавливает бота.
+
+Состояние (снимки, расписание опроса, отпечатки уведомлений и FSM)
+сохраняется в STATE_PATH и восстанавливается при запуске. С RECORD_PATH
+ответы API записываются для воспроизведения (python -m replay).
+
+Запуск: aiogram загружается в отдельном потоке, пока идет первый опрос
+целей; профиль запуска выводит python -m startup_profile.
 """
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
+from functools import partial
+from importlib import import_module
+from typing import TYPE_CHECKING, Callable, Iterable, Optional
 from sms_service import SmsService
 from number_checker import NumberChecker
-from bot_handler import BotHandler
 from config import Settings
+from http_client import HttpClient
+from offers import DEFAULT_PROVIDER
+from providers import RateLimiter, create_provider, provider_headers
+from resilience import ResilientClient, RetryBudget
+from scheduler import AdaptiveScheduler
+from snapshot import SnapshotStore
+from history import HistoryStore
+from rolling_stats import RollingStats
+from log_setup import setup_logging
+from metrics import MetricsServer, metrics
+from subscriptions import SubscriptionRegistry
+from warm_state import (SentNotifications, StateStore, dump_storage,
+                        restore_storage)
+
+# aiogram и модули, которые от него зависят, импортируются лениво: их
+# загрузка занимает большую часть запуска, и main выполняет ее в потоке
+# параллельно с первым опросом
+if TYPE_CHECKING:
+    from aiogram import Bot, Dispatcher
+    from bot_handler import BotHandler
 
 
 def load_config() -> Settings:
@@ -39,40 +77,314 @@ def load_config() -> Settings:
     return Settings() # type: ignore
 
 
-async def main() -> None:
-    """Запускает бота и начинает процесс опроса доступных номеров."""
-    settings = load_config()
+def build_client(settings: Settings,
+                 mirrors: Iterable[str] = (),
+                 headers: Optional[dict] = None) -> ResilientClient:
+    """
+    HTTP-клиент к API одного поставщика: свой пул соединений,
+    предохранители и бюджет повторов.
+    """
+    return ResilientClient(
+        HttpClient(limit=settings.http_limit,
+                   limit_per_host=settings.http_limit_per_host,
+                   ttl_dns_cache=settings.http_dns_cache_ttl,
+                   keepalive_timeout=settings.http_keepalive_timeout,
+                   timeout_total=settings.http_timeout,
+                   timeout_connect=settings.http_connect_timeout,
+                   headers=headers),
+        mirrors,
+        settings.breaker_failures,
+        settings.breaker_reset_timeout,
+        settings.retry_attempts,
+        budget=RetryBudget(settings.retry_budget_ratio),
+        hedge=settings.hedge_requests
+    )
+
+
+def build_checker(settings: Settings,
+                  client_factory: Optional[Callable[..., HttpClient]] = None
+                  ) -> tuple[NumberChecker, SubscriptionRegistry]:
+    """
+    Собирает то, что нужно для опроса API SMS Activate и дополнительных
+    поставщиков (PROVIDERS): HTTP-клиенты, правила подписчиков и
+    проверщик. aiogram для этого не нужен. client_factory(mirrors,
+    headers) заменяет HTTP-клиенты (например, ответами из записи при
+    воспроизведении); по умолчанию - build_client, с RECORD_PATH ответы
+    записываются.
+    """
     if not all([settings.token,
                 settings.admin_id,
                 settings.url_sms_activate,
                 settings.url_api_sms]):
         raise ValueError("Отсутствуют обязательные параметры конфигурации.")
+    subscriptions = SubscriptionRegistry(settings.admin_id,
+                                         settings.load_watch_rules(),
+                                         settings.subscriptions_path,
+                                         settings.subscribers)
+    engine = subscriptions.engine
+    if not engine.rules:
+        raise ValueError("Не заданы правила отслеживания (WATCH_RULES или "
+                         "RULES_FILE).")
+
+    names = [config.label for config in settings.providers]
+    if len(set(names)) != len(names) or DEFAULT_PROVIDER in names:
+        raise ValueError(f"Имена поставщиков в PROVIDERS должны быть "
+                         f"разными и не совпадать с {DEFAULT_PROVIDER}.")
+
+    if client_factory is None:
+        recorder = None
+        if settings.record_path:
+            from replay import Recorder, RecordingClient
+            recorder = Recorder(settings.record_path)
+
+        def client_factory(mirrors: Iterable[str] = (),
+                           headers: Optional[dict] = None) -> HttpClient:
+            client = build_client(settings, mirrors, headers)
+            if recorder is None:
+                return client
+            return RecordingClient(client, recorder)
 
-    bot = Bot(token=settings.token)
     sms_service = SmsService(settings.admin_id)
+    client = client_factory(settings.api_mirrors)
+    providers = [create_provider(config,
+                                 client_factory(
+                                     headers=provider_headers(config)),
+                                 settings.http_chunk_size)
+                 for config in settings.providers]
+    history = HistoryStore(settings.history_path,
+                           settings.history_tail_size) \
+        if settings.history_path else None
     number_checker = NumberChecker(sms_service,
                                    settings.url_sms_activate,
-                                   settings.url_api_sms)
-    handler = BotHandler(bot, settings.admin_id, sms_service, number_checker)
+                                   settings.url_api_sms,
+                                   engine,
+                                   client,
+                                   None,
+                                   settings.poll_concurrency,
+                                   SnapshotStore(
+                                       settings.notify_count_threshold),
+                                   settings.http_chunk_size,
+                                   history,
+                                   settings.cache_ttl,
+                                   settings.api_keys,
+                                   stats=RollingStats(settings.stats_windows,
+                                                      settings.stats_buckets),
+                                   providers=providers,
+                                   limiter=RateLimiter(
+                                       settings.api_rate_limit,
+                                       settings.api_rate_burst))
+    client.on_state_change = number_checker.breaker_changed
+    for provider in providers:
+        provider.client.on_state_change = partial(
+            number_checker.breaker_changed, provider=provider.name
+        )
+    return number_checker, subscriptions
+
+
+def build_app(settings: Settings,
+              bot: Optional['Bot'] = None,
+              checker: Optional[tuple[NumberChecker,
+                                      SubscriptionRegistry]] = None
+              ) -> tuple['Dispatcher', 'BotHandler']:
+    """
+    Собирает бота по настройкам: HTTP-клиент, правила, проверщик,
+    планировщик и Dispatcher с зарегистрированными командами.
+    Бот можно передать готовым (например, с другим адресом Bot API),
+    проверщик - собранным заранее build_checker.
+    """
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.filters import Command
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from bot_handler import BotHandler
 
-    dp = Dispatcher(storage=MemoryStorage())
+    number_checker, subscriptions = checker if checker is not None \
+        else build_checker(settings)
+    sms_service = number_checker.sms_service
+    client = number_checker.client
+    history = number_checker.history
+    if bot is None:
+        session = AiohttpSession(
+            api=TelegramAPIServer.from_base(settings.telegram_api_url)
+        ) if settings.telegram_api_url else None
+        bot = Bot(token=settings.token, session=session)
+    coordinator = None
+    if settings.cluster_store:
+        from cluster import ShardCoordinator, default_worker_id, open_store
+        if settings.webhook_url and not settings.webhook_secret:
+            raise ValueError("Для нескольких воркеров в режиме webhook "
+                             "нужен общий WEBHOOK_SECRET.")
+        coordinator = ShardCoordinator(open_store(settings.cluster_store),
+                                       settings.worker_id
+                                       or default_worker_id(),
+                                       number_checker.targets_by_key,
+                                       settings.cluster_lease_ttl,
+                                       settings.notify_dedup_ttl)
+        number_checker.dedup = coordinator.claim
+        number_checker.share_snapshot = coordinator.save_snapshot
+        coordinator.on_snapshots = number_checker.load_snapshots
+    # Воркер получает свои цели при первом шаге координации
+    scheduler = AdaptiveScheduler([] if coordinator is not None
+                                  else number_checker.targets_by_key,
+                                  settings.poll_min_interval,
+                                  settings.poll_max_interval,
+                                  settings.poll_initial_interval,
+                                  settings.poll_jitter,
+                                  max_backoff=settings.poll_max_backoff)
+    handler = BotHandler(bot, settings.admin_id, sms_service, number_checker,
+                         scheduler, subscriptions, coordinator)
+
+    storage = MemoryStorage()
+    state = StateStore(settings.state_path,
+                       settings.state_checkpoint_interval) \
+        if settings.state_path else None
+    if state is not None:
+        # Разделы восстанавливаются сразу, до первого опроса
+        state.register('snapshots', number_checker.snapshots.dump,
+                       number_checker.restore_snapshots)
+        state.register('scheduler', scheduler.dump, scheduler.restore)
+        state.register('fsm', lambda: dump_storage(storage),
+                       lambda saved: restore_storage(storage, saved))
+        state.register('bot', handler.dump_state, handler.restore_state)
+        if coordinator is None:
+            sent = SentNotifications(settings.notify_dedup_ttl)
+            state.register('sent', sent.dump, sent.restore)
+            number_checker.dedup = sent.claim
+
+    dp = Dispatcher(storage=storage)
     dp.message.register(handler.start_command,
                         Command(commands=['start']))
     dp.message.register(handler.check_command,
                         Command(commands=['check']))
     dp.message.register(handler.balance_command,
                         Command(commands=['balance']))
+    dp.message.register(handler.history_command,
+                        Command(commands=['history']))
+    dp.message.register(handler.report_command,
+                        Command(commands=['report']))
+    dp.message.register(handler.watch_command,
+                        Command(commands=['watch']))
+    dp.message.register(handler.unwatch_command,
+                        Command(commands=['unwatch']))
+    dp.message.register(handler.rules_command,
+                        Command(commands=['rules']))
+    dp.message.register(handler.stats_command,
+                        Command(commands=['stats']))
     dp.message.register(handler.stop_command,
                         Command(commands=['stop']))
+    dp.shutdown.register(handler.close)
+    if state is not None:
+        dp.startup.register(state.start)
+        dp.shutdown.register(state.close)
+    # Статистика из истории нужна до первой проверки правил
+    dp.startup.register(number_checker.load_stats)
+    dp.startup.register(handler.on_startup)
+    dp.shutdown.register(number_checker.close)
+    dp.shutdown.register(sms_service.close)
+    if history is not None:
+        dp.shutdown.register(history.close)
+    if settings.auto_buy:
+        from auto_buy import AutoBuyer
+
+        async def balance() -> float:
+            return (await number_checker.fetch_balance())[0]
+
+        number_checker.buyer = AutoBuyer(client,
+                                         settings.url_api_sms,
+                                         balance,
+                                         settings.auto_buy_window,
+                                         settings.auto_buy_max_purchases)
+        dp.startup.register(number_checker.buyer.warm)
+    if settings.metrics_port is not None:
+        metrics_server = MetricsServer(metrics,
+                                       settings.metrics_host,
+                                       settings.metrics_port)
+        dp.startup.register(metrics_server.start)
+        dp.shutdown.register(metrics_server.close)
+    return dp, handler
+
+
+async def run_worker(dp: 'Dispatcher',
+                     handler: 'BotHandler',
+                     settings: Settings) -> None:
+    """
+    Работа воркера в режиме нескольких воркеров (CLUSTER_STORE): опрос
+    своей доли целей сразу после запуска. В режиме webhook обновления
+    принимает каждый воркер; в режиме long polling - только воркер с
+    арендой LEADER, остальные ждут, пока она освободится. Хуки startup и
+    shutdown выполняются один раз за время работы воркера: получив
+    аренду, воркер только начинает получать обновления. Потеряв аренду,
+    воркер останавливается, чтобы не получать обновления вдвоем.
+    """
+    from webhook import run_webhook
+    bot = handler.bot
+    coordinator = handler.coordinator
+    await coordinator.start()
+    try:
+        if settings.webhook_url:
+            await run_webhook(dp, bot, settings)
+            return
+        emit_startup, emit_shutdown = dp.emit_startup, dp.emit_shutdown
 
-    await dp.start_polling(handler.bot)
+        async def started(*args, **kwargs) -> None:
+            pass
+
+        # start_polling сам вызывает хуки; они уже выполнены при запуске
+        # воркера, и повтор перезапустил бы цикл проверки, состояние и
+        # клиенты
+        dp.emit_startup = dp.emit_shutdown = started
+        await emit_startup(bot=bot, dispatcher=dp)
+        try:
+            await coordinator.leader.wait()
+            await bot.delete_webhook()
+            polling = asyncio.create_task(
+                dp.start_polling(bot, close_bot_session=False)
+            )
+            lost = asyncio.create_task(coordinator.leadership_lost.wait())
+            await asyncio.wait((polling, lost),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if lost.done():
+                await dp.stop_polling()
+            lost.cancel()
+            await polling
+        finally:
+            await emit_shutdown(bot=bot, dispatcher=dp)
+            await bot.session.close()
+    finally:
+        await coordinator.close()
+
+
+async def main(settings: Optional[Settings] = None) -> None:
+    """Запускает бота и начинает процесс опроса доступных номеров."""
+    if settings is None:
+        settings = load_config()
+    checker = build_checker(settings)
+    if not settings.cluster_store:
+        # Воркер кластера узнает свои цели только после запуска
+        checker[0].prefetch()
+    await asyncio.to_thread(import_module, 'aiogram')
+    dp, handler = build_app(settings, checker=checker)
+    if handler.coordinator is not None:
+        await run_worker(dp, handler, settings)
+    elif settings.webhook_url:
+        from webhook import run_webhook
+        await run_webhook(dp, handler.bot, settings)
+    else:
+        # Webhook, оставшийся от запуска в режиме webhook, мешает getUpdates
+        await handler.bot.delete_webhook()
+        await dp.start_polling(handler.bot)
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO,
-                        filename='logs.log',
-                        format='%(levelname)s (%(asctime)s): %(message)s '
-                        '(Line: %(lineno)d) [%(filename)s]',
-                        datefmt='%d/%m/%Y %I:%M:%S',
-                        encoding='utf-8',
-                        filemode='w')
-    asyncio.run(main())
+    settings = load_config()
+    listener = setup_logging(settings.log_path,
+                             logging.getLevelName(settings.log_level.upper()),
+                             settings.log_max_bytes,
+                             settings.log_backup_count,
+                             settings.log_rotate_when,
+                             settings.log_json,
+                             settings.log_debug_sample)
+    try:
+        asyncio.run(main(settings))
+    finally:
+        listener.stop()
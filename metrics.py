@@ -0,0 +1,208 @@
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+# Границы корзин по умолчанию (секунды): от 0,1 мс до 1 часа
+DEFAULT_BOUNDS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600,
+)
+
+
+class Histogram:
+    '''
+    Гистограмма с фиксированными границами корзин. Запись значения - поиск
+    корзины бинарным поиском и пара прибавлений, без выделения памяти.
+    '''
+    __slots__ = ('name', 'bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, name: str, bounds: Iterable[float] = DEFAULT_BOUNDS):
+        self.name = name
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        '''
+        Оценка квантиля: верхняя граница корзины, в которую он попадает.
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= rank and bucket:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                return self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+    def time(self) -> 'Timer':
+        '''
+        Контекстный менеджер, записывающий длительность блока.
+        '''
+        return Timer(self)
+
+
+class Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self) -> 'Timer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Counter:
+    '''
+    Монотонный счетчик событий.
+    '''
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class MetricsRegistry:
+    '''
+    Реестр метрик процесса. Метрики создаются при первом обращении.
+    '''
+    def __init__(self):
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, Counter] = {}
+
+    def histogram(self,
+                  name: str,
+                  bounds: Optional[Iterable[float]] = None) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = Histogram(name, bounds or DEFAULT_BOUNDS)
+            self.histograms[name] = histogram
+        return histogram
+
+    def counter(self, name: str) -> Counter:
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = Counter(name)
+        return counter
+
+    def snapshot(self) -> dict:
+        return {
+            "histograms": {name: histogram.snapshot()
+                           for name, histogram in self.histograms.items()},
+            "counters": {name: counter.value
+                         for name, counter in self.counters.items()},
+        }
+
+    def timer(self, name: str) -> Timer:
+        return Timer(self.histogram(name))
+
+    def render_prometheus(self) -> str:
+        '''
+        Метрики в текстовом формате Prometheus: гистограммы с
+        накопительными корзинами, счетчики с суффиксом _total.
+        '''
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            seen = 0
+            for bound, bucket in zip(histogram.bounds, histogram.counts):
+                seen += bucket
+                lines.append(f'{name}_bucket{{le="{bound}"}} {seen}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum {histogram.sum}")
+            lines.append(f"{name}_count {histogram.count}")
+        for name, counter in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name}_total counter")
+            lines.append(f"{name}_total {counter.value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_stats(snapshot: dict) -> str:
+    '''
+    Текст сводки метрик для команды /stats: перцентили в миллисекундах и
+    значения счетчиков.
+    '''
+    lines = []
+    for name, values in sorted(snapshot["histograms"].items()):
+        if values["count"]:
+            lines.append(
+                f"{name}: n={values['count']}, "
+                f"p50={values['p50'] * 1000:.1f}, "
+                f"p95={values['p95'] * 1000:.1f}, "
+                f"p99={values['p99'] * 1000:.1f}, "
+                f"max={values['max'] * 1000:.1f} мс"
+            )
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"{name}: {value}")
+    return "\n".join(lines) if lines else "Метрик пока нет"
+
+
+class MetricsServer:
+    '''
+    Локальный HTTP-сервер с метриками в формате Prometheus (/metrics).
+    '''
+    def __init__(self,
+                 registry: MetricsRegistry,
+                 host: str = '127.0.0.1',
+                 port: int = 9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional['web.AppRunner'] = None
+
+    async def handle(self, request: 'web.Request') -> 'web.Response':
+        from aiohttp import web
+        return web.Response(text=self.registry.render_prometheus(),
+                            content_type='text/plain',
+                            charset='utf-8')
+
+    async def start(self) -> None:
+        # aiohttp.web нужен только с METRICS_PORT
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = MetricsRegistry()
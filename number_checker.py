@@ -1,98 +1,606 @@
 import aiohttp
 import asyncio
-import json
-from aiogram import Bot
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Awaitable, Callable, Iterable, Optional
 from sms_service import SmsService
-from aiohttp import ClientTimeout
+from history import HistoryRecord, HistoryStore
+from http_client import HttpClient
+from metrics import metrics
+from offers import DEFAULT_PROVIDER
+from providers import Provider, RateLimiter, SmsActivateProvider
+from resilience import CLOSED, OPEN, CircuitOpenError, endpoint_of
+from rolling_stats import RollingStats
+from single_flight import SingleFlight
+from snapshot import OfferChange, SnapshotStore, format_changes
+from subscriptions import fan_out
+from targets import PollResult, WatchTarget
+from watch_rules import (Match, WatchEngine, format_matches,
+                         service_from_url)
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+    from auto_buy import AutoBuyer
+
+
+def describe_error(error: BaseException) -> str:
+    '''
+    Текст сообщения администратору для ошибки запроса к API.
+    '''
+    if isinstance(error, CircuitOpenError):
+        return (f"API временно недоступно, повтор через "
+                f"{error.retry_after:.0f} с")
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return "Нет соединения с API"
+    if isinstance(error, asyncio.TimeoutError):
+        return "Время ожидания истекло"
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f"Ошибка запроса: {error}"
+    if isinstance(error, ValueError):
+        return f"Ошибка обработки данных: {error}"
+    return f"Неожиданная ошибка: {error}"
+
+
+def format_age(seconds: float) -> str:
+    '''
+    Пометка о возрасте данных для ответа на команду.
+    '''
+    if seconds < 1:
+        return ""
+    return f"\n(данные получены {seconds:.0f} с назад)"
 
 
 class NumberChecker:
     def __init__(self,
                  sms_service: SmsService,
                  url_sms_activate: str,
-                 url_api_sms: str):
+                 url_api_sms: str,
+                 engine: WatchEngine,
+                 client: Optional[HttpClient] = None,
+                 targets: Optional[list[WatchTarget]] = None,
+                 concurrency: int = 10,
+                 snapshots: Optional[SnapshotStore] = None,
+                 chunk_size: int = 65536,
+                 history: Optional[HistoryStore] = None,
+                 cache_ttl: float = 30,
+                 api_keys: Iterable[str] = (),
+                 buyer: Optional['AutoBuyer'] = None,
+                 dedup: Optional[Callable[[str], Awaitable[bool]]] = None,
+                 share_snapshot: Optional[
+                     Callable[[str, dict[str, list]], Awaitable[None]]
+                 ] = None,
+                 stats: Optional[RollingStats] = None,
+                 providers: Iterable[Provider] = (),
+                 limiter: Optional[RateLimiter] = None,
+                 clock: Callable[[], float] = time.time):
         self.sms_service = sms_service
         self.url_sms_activate = url_sms_activate
         self.url_api_sms = url_api_sms
+        self.engine = engine
+        self.api_keys = list(api_keys)
+        self.client = client if client is not None else HttpClient()
+        self.chunk_size = chunk_size
+        # SMS Activate опрашивается всегда, providers - дополнительные
+        # поставщики; ключ - имя поставщика в целях и предложениях
+        primary = SmsActivateProvider(DEFAULT_PROVIDER, self.client,
+                                      url_sms_activate, url_api_sms,
+                                      self.api_keys, chunk_size, limiter)
+        self.providers: dict[str, Provider] = {primary.name: primary}
+        for provider in providers:
+            self.providers[provider.name] = provider
+        if targets is None:
+            targets = self._build_targets(engine)
+        self.targets = targets
+        self.targets_by_key = {target.key: target for target in targets}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._previous: dict[str, object] = {}
+        self.snapshots = snapshots if snapshots is not None \
+            else SnapshotStore()
+        self.history = history
+        self.cache_ttl = cache_ttl
+        self.flights = SingleFlight()
+        # Часы для отметок времени истории и скользящей статистики
+        self.clock = clock
+        self._processed_at: dict[str, float] = {}
+        # Чаты, у которых есть снимок подходящих предложений по цели
+        self._chats: dict[str, set[int]] = {}
+        self.buyer = buyer
+        self.dedup = dedup
+        # Передача снимков целей другим воркерам; последние переданные
+        self.share_snapshot = share_snapshot
+        self._shared: dict[str, dict[str, list]] = {}
+        # Скользящая статистика по результатам опросов для условий правил
+        self.stats = stats if stats is not None else RollingStats()
+        self.stats.add_windows(engine.windows)
+        self._stats_loaded = False
+        # Сообщения администратору о смене состояния предохранителей API
+        self._notices: list[str] = []
+        self._breakers: dict[tuple[str, str], str] = {}
+        self._prefetch: Optional[asyncio.Future] = None
+        self._prefetched_at: Optional[float] = None
+
+    def _build_targets(self, engine: WatchEngine) -> list[WatchTarget]:
+        services = engine.services \
+            or [service_from_url(self.url_sms_activate)]
+        return [target for provider in self.providers.values()
+                for target in provider.targets(services)]
+
+    def set_engine(self, engine: WatchEngine) -> None:
+        '''
+        Заменяет правила (после изменения подписок). Цели опроса
+        перестраиваются по сервисам новых правил, кэш ответов сбрасывается:
+        в нем есть только записи стран, нужных прежним правилам. Из снимков
+        убираются предложения, на которые больше нет правил.
+        '''
+        self.engine = engine
+        self.stats.add_windows(engine.windows)
+        self.targets = self._build_targets(engine)
+        self.targets_by_key = {target.key: target for target in self.targets}
+        for target in self.targets:
+            self.flights.invalidate(f"target:{target.key}")
+        self._prune(self._chats)
+
+    def _prune(self, keys: Iterable[str]) -> None:
+        '''
+        Убирает из снимков целей keys предложения, на которые нет правил.
+        '''
+        admin_id = self.sms_service.admin_id
+        covered = {(admin_id if rule.chat_id is None else rule.chat_id,
+                    rule.service, rule.country) for rule in self.engine.rules}
+        for key in keys:
+            for chat_id in self._chats.get(key, ()):
+                self.snapshots.prune(
+                    f"{key}>{chat_id}",
+                    lambda offer: (chat_id, *offer) in covered
+                )
+
+    def breaker_changed(self,
+                        endpoint: str,
+                        state: str,
+                        provider: str = DEFAULT_PROVIDER) -> None:
+        '''
+        Запоминает размыкание и восстановление предохранителя действия
+        API поставщика provider; администратор узнает о них при следующей
+        проверке одним сообщением вместо сообщения о каждой ошибке.
+        '''
+        previous = self._breakers.get((provider, endpoint), CLOSED)
+        name = endpoint if provider == DEFAULT_PROVIDER \
+            else f"{provider} {endpoint}"
+        if state == OPEN and previous != OPEN:
+            self._notices.append(f"API {name} недоступно, запросы "
+                                 f"приостановлены")
+        elif state == CLOSED and previous == OPEN:
+            self._notices.append(f"API {name} снова доступно")
+        if state in (OPEN, CLOSED):
+            self._breakers[(provider, endpoint)] = state
+
+    def _paused(self, result: PollResult) -> bool:
+        '''
+        Ошибка опроса при разомкнутом предохранителе его действия API.
+        '''
+        target = result.target
+        return isinstance(result.error, CircuitOpenError) \
+            or self._breakers.get((target.provider,
+                                   endpoint_of(target.url))) == OPEN
+
+    def restore_snapshots(self, saved: dict[str, list]) -> None:
+        '''
+        Восстанавливает снимки, сохраненные SnapshotStore.dump, вместе со
+        списком чатов каждой цели: первый опрос после перезапуска не
+        повторяет уже отправленные уведомления.
+        '''
+        self.snapshots.restore(saved)
+        for key in saved:
+            target_key, _, chat_id = key.rpartition('>')
+            self._chats.setdefault(target_key, set()).add(int(chat_id))
+
+    def target_snapshot(self, key: str) -> dict[str, list]:
+        '''
+        Снимки цели key по всем чатам в виде SnapshotStore.dump.
+        '''
+        return self.snapshots.dump(f"{key}>{chat_id}"
+                                   for chat_id in self._chats.get(key, ()))
+
+    def load_snapshots(self, saved: dict[str, dict[str, list]]) -> None:
+        '''
+        Заменяет снимки целей снимками другого воркера (цель - снимки в
+        виде target_snapshot): новый владелец цели не рассылает заново
+        уведомления о предложениях, о которых уже сообщил прежний.
+        '''
+        for key, snapshot in saved.items():
+            for chat_id in self._chats.pop(key, ()):
+                self.snapshots.discard(f"{key}>{chat_id}")
+            self.restore_snapshots(snapshot)
+            self._shared[key] = snapshot
+        self._prune(saved)
+
+    async def share_snapshots(self, results: list[PollResult]) -> None:
+        '''
+        Передает share_snapshot снимки успешно опрошенных целей, которые
+        изменились с прошлой передачи.
+        '''
+        changed = {}
+        for result in results:
+            if not result.ok:
+                continue
+            key = result.target.key
+            snapshot = self.target_snapshot(key)
+            if snapshot != self._shared.get(key):
+                changed[key] = self._shared[key] = snapshot
+        await asyncio.gather(*(self.share_snapshot(key, snapshot)
+                               for key, snapshot in changed.items()))
+
+    async def load_stats(self) -> None:
+        '''
+        Заполняет скользящую статистику записями истории за самое длинное
+        окно, чтобы условия правил работали сразу после перезапуска.
+        Вызывается при запуске бота один раз.
+        '''
+        if self._stats_loaded or self.history is None \
+                or not self.stats.windows:
+            return
+        self._stats_loaded = True
+        start = self.clock() - max(self.stats.windows)
+        with metrics.timer('stats_load_seconds'):
+            records = await asyncio.to_thread(self.history.query, start)
+            self.stats.seed(records)
+
+    async def close(self) -> None:
+        '''
+        Закрывает HTTP-клиенты проверщика и поставщиков. Вызывается при
+        остановке бота.
+        '''
+        await asyncio.gather(*(provider.close()
+                               for provider in self.providers.values()))
+
+    def describe_providers(self) -> str:
+        '''
+        Состояние каждого поставщика для команды /stats.
+        '''
+        return "\n".join(provider.health.describe()
+                         for provider in self.providers.values())
+
+    async def fetch_target(self, target: WatchTarget) -> PollResult:
+        '''
+        Запрашивает у поставщика цели список номеров по странам, для
+        которых есть правила. Запрос ждет разрешения ограничителя частоты
+        поставщика, не занимая места в семафоре: число одновременных
+        запросов ко всем поставщикам ограничено семафором, медленный
+        поставщик не задерживает остальных. Ошибки возвращаются в
+        PollResult.
+        '''
+        provider = self.providers[target.provider]
+        try:
+            await provider.limiter.acquire()
+            async with self._semaphore:
+                offers = await provider.fetch_offers(
+                    target, self.engine.countries(target.service)
+                )
+            result = PollResult(target, offers)
+        except Exception as e:
+            metrics.counter('fetch_errors').inc()
+            result = PollResult(target, error=e)
+        result.fetched_at = self.flights.clock()
+        return result
+
+    async def fetch_shared(self,
+                           target: WatchTarget,
+                           max_age: float = 0.0) -> PollResult:
+        '''
+        fetch_target с объединением одновременных запросов одной цели
+        (например, /check во время опроса в check_loop) и кэшем успешных
+        ответов не старше max_age секунд.
+        '''
+        result, _ = await self.flights.run(
+            f"target:{target.key}",
+            lambda: self.fetch_target(target),
+            max_age,
+            cacheable=lambda result: result.ok
+        )
+        return result
 
-    async def get_numbers(self, bot: Bot) -> bool:
-        '''
-        Отправляет GET-запрос к API SMS Activate для получения списка доступных
-        телефонных номеров. Функция фильтрует результаты, чтобы включать только
-        номера из страны 22 с ценой менее или равной 4.
-        Если номера найдены, функция отправляет сообщение администратору с
-        количеством и ценой номеров.
-        '''
-        async with aiohttp.ClientSession() as session:
-            try:
-                response = await session.get(self.url_sms_activate)
-                response.raise_for_status()
-                try:
-                    json_data = await response.json()
-                except aiohttp.ContentTypeError:
-                    text_data = await response.text()
-                    try:
-                        json_data = json.loads(text_data)
-                    except ValueError:
-                        await self.sms_service.send_message(
-                            bot,
-                            f"Невозможно обработать ответ: {text_data}"
-                            )
-                        return False
-
-                for value in json_data.values():
-                    if value.get("country") == 137 and value.get('price') <= 9:
-                        count_numbers = value.get("count")
-                        if count_numbers != 0:
-                            message = (
-                                f"Доступно {count_numbers} номеров по "
-                                f"цене {value.get('price')}"
-                            )
-                            await self.sms_service.send_message(bot, message)
-                            return True
-
-            except aiohttp.ClientConnectionError:
-                await self.sms_service.send_message(bot,
-                                                    "Нет соединения с API")
-            except asyncio.TimeoutError:
-                await self.sms_service.send_message(bot,
-                                                    "Время ожидания истекло")
-            except aiohttp.ClientResponseError as e:
-                await self.sms_service.send_message(bot,
-                                                    f"Ошибка запроса: {e}")
-            except ValueError as e:
-                await self.sms_service.send_message(bot, f"Ошибка обработки "
-                                                         f"данных: {e}")
-            except Exception as e:
-                await self.sms_service.send_message(bot,
-                                                    f"Неожиданная ошибка: {e}")
-
-        await self.sms_service.send_message(bot, "Нет доступных номеров")
-        return False
-
-    async def get_balance(self, bot: Bot) -> None:
+    def prefetch(self) -> None:
+        '''
+        Запускает опрос всех целей в фоне, пока бот еще запускается
+        (импорт aiogram занимает большую часть запуска). Первый цикл
+        проверки с max_age=prefetch_age() использует эти ответы или
+        присоединяется к еще идущим запросам.
+        '''
+        self._prefetched_at = self.flights.clock()
+        self._prefetch = asyncio.gather(
+            *(self.fetch_shared(target) for target in self.targets)
+        )
+
+    def prefetch_age(self) -> float:
+        '''
+        Возраст предварительного опроса для первого цикла проверки; при
+        следующих вызовах 0.
+        '''
+        if self._prefetched_at is None:
+            return 0.0
+        age = self.flights.age(self._prefetched_at)
+        self._prefetched_at = None
+        return age
+
+    async def poll(self,
+                   targets: Optional[list[WatchTarget]] = None,
+                   max_age: float = 0.0) -> list[PollResult]:
+        '''
+        Опрашивает все цели конкурентно. Время опроса определяется самым
+        медленным запросом, а не суммой всех запросов. У успешных
+        результатов отмечается, изменился ли ответ с прошлого опроса.
+        Ответы, уже учтенные раньше (из кэша или общего запроса), повторно
+        в историю и скользящую статистику не попадают.
+        '''
+        if targets is None:
+            targets = self.targets
+        results = list(await asyncio.gather(
+            *(self.fetch_shared(target, max_age) for target in targets)
+        ))
+        fresh = []
+        for result in results:
+            key = result.target.key
+            if not result.ok \
+                    or result.fetched_at <= self._processed_at.get(key, -1.0):
+                continue
+            self._processed_at[key] = result.fetched_at
+            result.changed = (key in self._previous
+                              and self._previous[key] != result.payload)
+            self._previous[key] = result.payload
+            fresh.append(result)
+        now = self.clock()
+        for result in fresh:
+            self.stats.update(result.payload, now)
+        if self.history is not None:
+            self.record_history(fresh)
+        return results
+
+    def record_history(self, results: list[PollResult]) -> None:
+        '''
+        Сохраняет цену и количество номеров по всем разобранным
+        предложениям с пометкой поставщика. Аккаунты одного поставщика
+        видят один и тот же рынок, поэтому за опрос каждое предложение
+        записывается один раз.
+        '''
+        now = self.clock()
+        offers = {(offer.provider, offer.service, offer.country): offer
+                  for result in results if result.ok
+                  for offer in result.payload}
+        self.history.append(
+            HistoryRecord(now, offer.service, offer.country, offer.count,
+                          offer.price, offer.provider)
+            for offer in offers.values()
+        )
+
+    def evaluate(self, results: list[PollResult]) -> list[Match]:
+        '''
+        Проверяет правилами ответы всех успешно опрошенных целей за один
+        проход.
+        '''
+        matches: list[Match] = []
+        with metrics.timer('evaluate_seconds'):
+            for result in results:
+                if result.ok:
+                    result.matches = self.engine.evaluate_offers(
+                        result.payload, self.stats
+                    )
+                    matches.extend(result.matches)
+        return matches
+
+    def diff(self,
+             results: list[PollResult]) -> dict[int, list[OfferChange]]:
+        '''
+        Обновляет снимки успешно опрошенных целей отдельно для каждого
+        подписчика и возвращает изменения подходящих под его правила
+        предложений по чатам. Проверяются только чаты со срабатываниями
+        сейчас или в прошлом снимке цели.
+        '''
+        admin_id = self.sms_service.admin_id
+        changes: dict[int, list[OfferChange]] = defaultdict(list)
+        for result in results:
+            if not result.ok:
+                continue
+            key = result.target.key
+            chats = fan_out(result.matches, admin_id)
+            for chat_id in self._chats.get(key, set()) | chats.keys():
+                changes[chat_id].extend(self.snapshots.update(
+                    f"{key}>{chat_id}", chats.get(chat_id, ()),
+                    result.target.provider
+                ))
+            self._chats[key] = set(chats)
+        return {chat_id: items for chat_id, items in changes.items()
+                if items}
+
+    async def check_targets(self,
+                            bot: 'Bot',
+                            targets: Optional[list[WatchTarget]] = None,
+                            report_all: bool = False,
+                            max_age: float = 0.0,
+                            chat_id: Optional[int] = None
+                            ) -> list[PollResult]:
+        '''
+        Опрашивает указанные цели (по умолчанию все), проверяет ответы
+        правилами всех подписчиков за один проход и уведомляет каждого
+        подписчика только об изменениях по его правилам. С report_all=True
+        отправляет в чат chat_id (по умолчанию администратору) полную
+        сводку по его правилам (для команды /check) с пометкой о возрасте
+        данных, а снимки и автопокупку оставляет плановому опросу.
+        Возвращает результаты по каждой цели для планировщика.
+        '''
+        results = await self.poll(targets, max_age)
+        report_chat = chat_id if report_all else None
+        # Пока предохранитель разомкнут, о недоступности API уже сообщено
+        lines = [f"{result.target.key}: {describe_error(result.error)}"
+                 for result in results if not result.ok
+                 and (report_all or not self._paused(result))]
+        if self._notices:
+            notices, self._notices = self._notices, []
+            await self.sms_service.send_message(bot, "\n".join(notices))
+        if lines:
+            await self.sms_service.send_message(bot, "\n".join(lines),
+                                                chat_id=report_chat)
+
+        matches = self.evaluate(results)
+        if report_all:
+            # Снимки не обновляются: иначе изменения, найденные по
+            # команде одного чата, не дошли бы до остальных подписчиков
+            # (и до автопокупки) при следующем плановом опросе
+            admin_id = self.sms_service.admin_id
+            own = fan_out(matches, admin_id).get(
+                admin_id if chat_id is None else chat_id, []
+            )
+            oldest = min((result.fetched_at for result in results
+                          if result.ok), default=self.flights.clock())
+            text = format_matches(own) if own else "Нет доступных номеров"
+            await self.sms_service.send_message(
+                bot,
+                text + format_age(self.flights.age(oldest)),
+                urgent=bool(own),
+                chat_id=chat_id
+            )
+        else:
+            changes = self.diff(results)
+            if self.share_snapshot is not None:
+                await self.share_snapshots(results)
+            if self.buyer is not None:
+                await self.auto_buy(bot, results, changes)
+            for chat, items in changes.items():
+                if self.dedup is not None:
+                    items = await self.deduplicate(chat, items)
+                    if not items:
+                        continue
+                await self.sms_service.send_message(
+                    bot,
+                    format_changes(items),
+                    urgent=any(change.urgent for change in items),
+                    chat_id=chat
+                )
+        return results
+
+    async def deduplicate(self,
+                          chat_id: int,
+                          changes: list[OfferChange]) -> list[OfferChange]:
+        '''
+        Оставляет изменения, о которых чату еще не сообщил ни один воркер
+        (например, то же изменение, увиденное через другой аккаунт того же
+        поставщика).
+        '''
+        claimed = await asyncio.gather(*(
+            self.dedup(f"{chat_id}:{change.provider}:{change.kind}:"
+                       f"{change.service}:{change.country}:{change.price}:"
+                       f"{change.count}")
+            for change in changes
+        ))
+        return [change for change, fresh in zip(changes, claimed) if fresh]
+
+    async def auto_buy(self,
+                       bot: 'Bot',
+                       results: list[PollResult],
+                       changes: dict[int, list[OfferChange]]) -> None:
+        '''
+        Покупает номера по правилам администратора с auto_buy, если
+        предложение только что появилось или подешевело, и сообщает о
+        покупках администратору. Покупка (getNumber) есть только у SMS
+        Activate, предложения других поставщиков не покупаются.
+        '''
+        admin_id = self.sms_service.admin_id
+        offers = {(change.service, change.country)
+                  for change in changes.get(admin_id, ())
+                  if change.urgent and change.provider == DEFAULT_PROVIDER}
+        if not offers:
+            return
+        purchases = await self.buyer.buy(
+            (match, result.fetched_at)
+            for result in results for match in result.matches
+            if match.rule.auto_buy
+            and match.provider == DEFAULT_PROVIDER
+            and match.rule.chat_id in (None, admin_id)
+            and (match.service, match.country) in offers
+        )
+        if purchases:
+            self.flights.invalidate('balance')
+            await self.sms_service.send_message(
+                bot,
+                "\n".join(purchase.describe() for purchase in purchases),
+                urgent=True
+            )
+
+    async def fetch_balance(self,
+                            provider: str = DEFAULT_PROVIDER
+                            ) -> tuple[float, float]:
+        '''
+        Баланс счета у поставщика provider и момент его получения.
+        Одновременные запросы объединяются, ответ не старше cache_ttl
+        секунд берется из кэша.
+        '''
+        source = self.providers[provider]
+
+        async def fetch() -> float:
+            await source.limiter.acquire()
+            return await source.balance()
+
+        return await self.flights.run(
+            'balance' if provider == DEFAULT_PROVIDER
+            else f"balance:{provider}",
+            fetch,
+            self.cache_ttl
+        )
+
+    async def get_numbers(self,
+                          bot: 'Bot',
+                          chat_id: Optional[int] = None) -> bool:
+        '''
+        Опрашивает API SMS Activate по всем целям (сервисам и аккаунтам) и
+        проверяет ответы всеми правилами WatchEngine.
+        Функция отправляет в чат chat_id (по умолчанию администратору) одно
+        сообщение со всеми найденными по его правилам номерами, их
+        количеством и ценой, либо сообщение об их отсутствии. Ответы не
+        старше cache_ttl секунд берутся из кэша.
+        '''
+        with metrics.timer('check_command_seconds'):
+            results = await self.check_targets(bot, report_all=True,
+                                               max_age=self.cache_ttl,
+                                               chat_id=chat_id)
+        return any(result.matches for result in results)
+
+    async def get_balance(self, bot: 'Bot') -> None:
         '''
         Отправляет GET-запрос к API SMS Activate для получения баланса счета.
         Функция отправляет сообщение администратору с полученным балансом.
+        Если поставщиков несколько, балансы запрашиваются у всех
+        одновременно и выводятся по строке на поставщика.
         '''
-        async with aiohttp.ClientSession() as session:
-            try:
-                response = await session.get(self.url_api_sms,
-                                             timeout=ClientTimeout(total=10))
-                response.raise_for_status()
-                text = await response.text()
-                balance = text.split('ACCESS_BALANCE:')[-1]
-                await self.sms_service.send_message(bot,
-                                                    f"Баланс: {balance}")
-            except aiohttp.ClientConnectionError:
-                await self.sms_service.send_message(bot,
-                                                    "Нет соединения с API")
-            except asyncio.TimeoutError:
-                await self.sms_service.send_message(bot,
-                                                    "Время ожидания истекло")
-            except aiohttp.ClientResponseError as e:
-                await self.sms_service.send_message(bot,
-                                                    f"Ошибка запроса: {e}")
-            except Exception as e:
-                await self.sms_service.send_message(bot,
-                                                    f"Неожиданная ошибка: {e}")
+        if len(self.providers) > 1:
+            await self.get_balances(bot)
+            return
+        try:
+            with metrics.timer('balance_seconds'):
+                balance, fetched_at = await self.fetch_balance()
+            await self.sms_service.send_message(
+                bot,
+                f"Баланс: {balance}"
+                + format_age(self.flights.age(fetched_at))
+            )
+        except Exception as e:
+            metrics.counter('balance_errors').inc()
+            await self.sms_service.send_message(bot, describe_error(e))
+
+    async def get_balances(self, bot: 'Bot') -> None:
+        with metrics.timer('balance_seconds'):
+            balances = await asyncio.gather(
+                *(self.fetch_balance(name) for name in self.providers),
+                return_exceptions=True
+            )
+        lines = []
+        fetched = []
+        for name, balance in zip(self.providers, balances):
+            if isinstance(balance, Exception):
+                metrics.counter('balance_errors').inc()
+                lines.append(f"{name}: {describe_error(balance)}")
+            else:
+                lines.append(f"{name}: {balance[0]}")
+                fetched.append(balance[1])
+        age = self.flights.age(min(fetched)) if fetched else 0.0
+        await self.sms_service.send_message(
+            bot, "Баланс:\n" + "\n".join(lines) + format_age(age)
+        )
@@ -0,0 +1,102 @@
+import json
+import math
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Декодер JSON: orjson, если пакет установлен, иначе стандартный json.
+# Оба принимают bytes и выбрасывают ValueError при некорректном JSON.
+loads: Callable[[Any], Any] = orjson.loads if orjson is not None \
+    else json.loads
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+# Поставщик номеров, для которого написан бот; у его предложений и целей
+# опроса пометка поставщика не выводится
+DEFAULT_PROVIDER = 'sms-activate'
+
+
+class Offer:
+    '''
+    Предложение поставщика provider: count номеров сервиса service в
+    стране country по цене price. Ответы всех поставщиков приводятся к
+    этой модели; поля проверены при декодировании (parse_offer), дальше
+    их типы не проверяются.
+    '''
+    __slots__ = ('service', 'country', 'price', 'count', 'provider')
+
+    def __init__(self,
+                 service: str,
+                 country: int,
+                 price: float,
+                 count: int,
+                 provider: str = DEFAULT_PROVIDER):
+        self.service = service
+        self.country = country
+        self.price = price
+        self.count = count
+        self.provider = provider
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Offer):
+            return NotImplemented
+        return (self.service == other.service
+                and self.country == other.country
+                and self.price == other.price
+                and self.count == other.count
+                and self.provider == other.provider)
+
+    def __hash__(self) -> int:
+        return hash((self.service, self.country, self.price, self.count,
+                     self.provider))
+
+    def __repr__(self) -> str:
+        return (f"Offer(service={self.service!r}, country={self.country}, "
+                f"price={self.price}, count={self.count}, "
+                f"provider={self.provider!r})")
+
+
+def _number(value: Any) -> Optional[float]:
+    '''
+    Неотрицательное конечное число из числа или строки с числом.
+    '''
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+    elif type(value) not in (int, float):
+        # bool, None и контейнеры ценой или количеством не являются
+        return None
+    if not math.isfinite(value) or value < 0:
+        return None
+    return value
+
+
+def parse_offer(service: str,
+                entry: Any,
+                provider: str = DEFAULT_PROVIDER) -> Optional[Offer]:
+    '''
+    Проверяет запись о стране (словарь с полями country, price и count,
+    как в ответе getTopCountriesByService) и возвращает Offer. Записи без
+    целого кода страны, с отсутствующей (None) или некорректной ценой или
+    количеством отбрасываются (None).
+    '''
+    if not isinstance(entry, dict):
+        return None
+    country = entry.get('country')
+    price = entry.get('price')
+    count = entry.get('count')
+    if type(country) is not int:
+        return None
+    # Обычный случай: цена - число, количество - целое
+    if type(price) is int or type(price) is float and math.isfinite(price):
+        if type(count) is int and price >= 0 and count >= 0:
+            return Offer(service, country, price, count, provider)
+    price = _number(price)
+    count = _number(count)
+    if price is None or count is None or count != int(count):
+        return None
+    return Offer(service, country, price, int(count), provider)
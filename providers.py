@@ -0,0 +1,415 @@
+import asyncio
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Iterable, Literal, Optional
+from pydantic import BaseModel
+from http_client import DEFAULT_HEADERS, HttpClient
+from metrics import metrics
+from offers import Offer, parse_offer
+from resilience import CircuitOpenError
+from stream_parser import PayloadScanner
+from targets import WatchTarget, build_targets, with_query
+
+
+class RateLimiter:
+    '''
+    Ограничение частоты запросов к поставщику (маркерная корзина): в
+    среднем не больше rate запросов в секунду и не больше burst подряд.
+    acquire занимает маркер сразу, даже если его еще нет, и ждет, пока
+    он накопится, поэтому ожидающие запросы выстраиваются в очередь.
+    rate=0 - без ограничения.
+    '''
+    def __init__(self,
+                 rate: float = 0,
+                 burst: int = 1,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Any] = asyncio.sleep):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(self.burst)
+        self.updated: Optional[float] = None
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        now = self.clock()
+        if self.updated is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            metrics.counter('provider_rate_limited').inc()
+            await self.sleep(-self.tokens / self.rate)
+
+
+class ProviderHealth:
+    '''
+    Состояние поставщика по его запросам: ошибки подряд, число успешных
+    и всех запросов, сглаженная задержка и момент последнего успешного
+    ответа. После failure_threshold ошибок подряд поставщик считается
+    недоступным. Задержка и ошибки пишутся в метрики
+    provider_<имя>_seconds и provider_<имя>_errors.
+    '''
+    def __init__(self,
+                 name: str,
+                 failure_threshold: int = 3,
+                 alpha: float = 0.2,
+                 clock: Callable[[], float] = time.time):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.alpha = alpha
+        self.clock = clock
+        self.failures = 0
+        self.successes = 0
+        self.requests = 0
+        self.latency: Optional[float] = None
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[BaseException] = None
+        self._metric = 'provider_' + re.sub(r'\W', '_', name)
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures < self.failure_threshold
+
+    def record_success(self, seconds: float) -> None:
+        self.requests += 1
+        self.successes += 1
+        self.failures = 0
+        self.last_success = self.clock()
+        self.latency = seconds if self.latency is None \
+            else self.latency + self.alpha * (seconds - self.latency)
+        metrics.histogram(f"{self._metric}_seconds").observe(seconds)
+
+    def record_failure(self, error: BaseException) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.last_error = error
+        metrics.counter(f"{self._metric}_errors").inc()
+
+    def describe(self) -> str:
+        state = "доступен" if self.healthy else \
+            f"недоступен ({self.failures} ошибок подряд)"
+        text = f"{self.name}: {state}, успешно {self.successes} из " \
+               f"{self.requests}"
+        if self.latency is not None:
+            text += f", задержка {self.latency * 1000:.0f} мс"
+        if self.last_success is not None:
+            text += (f", последний ответ "
+                     f"{self.clock() - self.last_success:.0f} с назад")
+        return text
+
+
+class Provider(ABC):
+    '''
+    Поставщик номеров: строит цели опроса по сервисам, приводит ответы
+    своего API к Offer и получает баланс. У каждого поставщика свой
+    HTTP-клиент (со своими предохранителями), ограничение частоты
+    запросов и учет состояния.
+    '''
+    def __init__(self,
+                 name: str,
+                 client: HttpClient,
+                 limiter: Optional[RateLimiter] = None):
+        self.name = name
+        self.client = client
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.health = ProviderHealth(name)
+
+    @abstractmethod
+    def targets(self, services: Iterable[str]) -> list[WatchTarget]:
+        ...
+
+    @abstractmethod
+    async def offers(self,
+                     target: WatchTarget,
+                     countries: Optional[set[int]]) -> list[Offer]:
+        '''
+        Предложения цели по странам countries (None - по всем).
+        '''
+
+    @abstractmethod
+    async def balance(self) -> float:
+        ...
+
+    async def fetch_offers(self,
+                           target: WatchTarget,
+                           countries: Optional[set[int]]) -> list[Offer]:
+        '''
+        offers с учетом успехов, ошибок и задержки в состоянии
+        поставщика. Отказ разомкнутого предохранителя запросом не
+        считается.
+        '''
+        started = time.perf_counter()
+        try:
+            offers = await self.offers(target, countries)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            self.health.record_failure(e)
+            raise
+        self.health.record_success(time.perf_counter() - started)
+        return offers
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+def text_balance(text: str) -> float:
+    '''
+    Баланс из ответа getBalance вида ACCESS_BALANCE:<сумма>.
+    '''
+    _, found, balance = text.partition('ACCESS_BALANCE:')
+    if not found:
+        raise ValueError(f"Неожиданный ответ: {text[:100]}")
+    return float(balance)
+
+
+def cheapest(service: str,
+             country: int,
+             prices: Iterable[tuple[Any, Any]],
+             provider: str) -> Optional[Offer]:
+    '''
+    Самое дешевое предложение страны с номерами в наличии из пар
+    (цена, количество); некорректные пары отбрасываются.
+    '''
+    best = None
+    for price, count in prices:
+        offer = parse_offer(service,
+                            {"country": country, "price": price,
+                             "count": count},
+                            provider)
+        if offer is None:
+            metrics.counter('invalid_offers').inc()
+        elif offer.count and (best is None or offer.price < best.price):
+            best = offer
+    return best
+
+
+class SmsActivateProvider(Provider):
+    '''
+    SMS Activate и API с тем же протоколом: предложения из
+    getTopCountriesByService (ответ разбирается потоково: декодируются
+    только записи нужных стран, чтение прекращается, как только все они
+    встречены), баланс из ответа getBalance.
+    '''
+    def __init__(self,
+                 name: str,
+                 client: HttpClient,
+                 url_template: str,
+                 balance_url: str,
+                 api_keys: Iterable[str] = (),
+                 chunk_size: int = 65536,
+                 limiter: Optional[RateLimiter] = None):
+        super().__init__(name, client, limiter)
+        self.url_template = url_template
+        self.balance_url = balance_url
+        self.api_keys = list(api_keys)
+        self.chunk_size = chunk_size
+
+    def targets(self, services: Iterable[str]) -> list[WatchTarget]:
+        return build_targets(self.url_template, services, self.api_keys,
+                             self.name)
+
+    async def offers(self,
+                     target: WatchTarget,
+                     countries: Optional[set[int]]) -> list[Offer]:
+        scanner = PayloadScanner(
+            target.service,
+            None if countries is None else {target.service: countries},
+            self.name
+        )
+        async with self.client.stream(target.url) as response:
+            body_started = time.perf_counter()
+            parsing = 0.0
+            async for chunk in response.content.iter_chunked(
+                    self.chunk_size):
+                started = time.perf_counter()
+                scanner.feed(chunk)
+                parsing += time.perf_counter() - started
+                if scanner.done:
+                    break
+            metrics.histogram('http_body_seconds').observe(
+                time.perf_counter() - body_started - parsing
+            )
+            metrics.histogram('parse_seconds').observe(parsing)
+        offers = scanner.close()
+        if scanner.rejected:
+            metrics.counter('invalid_offers').inc(scanner.rejected)
+        return offers
+
+    async def balance(self) -> float:
+        return text_balance(await self.client.get_text(self.balance_url))
+
+
+class SmsHubProvider(SmsActivateProvider):
+    '''
+    SMSHub: протокол handler_api.php, но предложения из getPrices с
+    ответом {страна: {сервис: {цена: количество}}}. Для каждой страны
+    берется самая низкая цена, по которой есть номера.
+    '''
+    async def offers(self,
+                     target: WatchTarget,
+                     countries: Optional[set[int]]) -> list[Offer]:
+        started = time.perf_counter()
+        data = await self.client.get_json(target.url)
+        if not isinstance(data, dict):
+            raise ValueError(f"Невозможно обработать ответ: "
+                             f"{str(data)[:100]}")
+        offers = []
+        for key, services in data.items():
+            try:
+                country = int(key)
+            except ValueError:
+                continue
+            if countries is not None and country not in countries \
+                    or not isinstance(services, dict):
+                continue
+            prices = services.get(target.service)
+            if isinstance(prices, dict):
+                offer = cheapest(target.service, country, prices.items(),
+                                 self.name)
+                if offer is not None:
+                    offers.append(offer)
+        metrics.histogram('parse_seconds').observe(
+            time.perf_counter() - started
+        )
+        return offers
+
+
+class FiveSimProvider(Provider):
+    '''
+    5sim: цены всех стран сервиса без авторизации
+    (/v1/guest/prices?product=...) с ответом {сервис: {страна:
+    {оператор: {"cost": цена, "count": количество}}}}. Страны 5sim
+    названы словами и переводятся в коды SMS Activate по словарю
+    countries (страны без кода пропускаются), сервисы - по словарю
+    services (код SMS Activate -> название 5sim). Для каждой страны
+    берется самый дешевый оператор с номерами. Баланс - поле balance
+    профиля (/v1/user/profile, ключ API в заголовке Authorization
+    HTTP-клиента).
+    '''
+    def __init__(self,
+                 name: str,
+                 client: HttpClient,
+                 url: str,
+                 countries: dict[str, int],
+                 services: Optional[dict[str, str]] = None,
+                 limiter: Optional[RateLimiter] = None):
+        super().__init__(name, client, limiter)
+        self.url = url.rstrip('/')
+        self.countries = countries
+        self.services = services or {}
+
+    def targets(self, services: Iterable[str]) -> list[WatchTarget]:
+        return [
+            WatchTarget(service, self.name,
+                        with_query(f"{self.url}/v1/guest/prices",
+                                   product=self.services.get(service,
+                                                             service)),
+                        self.name)
+            for service in dict.fromkeys(services)
+        ]
+
+    async def offers(self,
+                     target: WatchTarget,
+                     countries: Optional[set[int]]) -> list[Offer]:
+        started = time.perf_counter()
+        data = await self.client.get_json(target.url)
+        product = self.services.get(target.service, target.service)
+        if not isinstance(data, dict):
+            raise ValueError(f"Невозможно обработать ответ: "
+                             f"{str(data)[:100]}")
+        offers = []
+        by_country = data.get(product)
+        for name, operators in (by_country.items()
+                                if isinstance(by_country, dict) else ()):
+            country = self.countries.get(name)
+            if country is None or countries is not None \
+                    and country not in countries \
+                    or not isinstance(operators, dict):
+                continue
+            offer = cheapest(
+                target.service, country,
+                ((operator.get('cost'), operator.get('count'))
+                 for operator in operators.values()
+                 if isinstance(operator, dict)),
+                self.name
+            )
+            if offer is not None:
+                offers.append(offer)
+        metrics.histogram('parse_seconds').observe(
+            time.perf_counter() - started
+        )
+        return offers
+
+    async def balance(self) -> float:
+        data = await self.client.get_json(f"{self.url}/v1/user/profile")
+        balance = data.get('balance') if isinstance(data, dict) else None
+        if type(balance) not in (int, float):
+            raise ValueError(f"Неожиданный ответ: {str(data)[:100]}")
+        return float(balance)
+
+
+class ProviderConfig(BaseModel):
+    '''
+    Дополнительный поставщик из настройки PROVIDERS: тип API, имя в
+    уведомлениях (по умолчанию тип), адрес API и ключ. rate_limit -
+    запросов в секунду (0 - без ограничения), burst - сколько запросов
+    можно отправить подряд. countries и services - названия стран и
+    сервисов поставщика для кодов SMS Activate (нужны для 5sim).
+    '''
+    type: Literal['sms-activate', 'smshub', '5sim']
+    name: Optional[str] = None
+    url: str
+    api_key: str = ''
+    rate_limit: float = 0
+    burst: int = 1
+    countries: dict[str, int] = {}
+    services: dict[str, str] = {}
+
+    @property
+    def label(self) -> str:
+        return self.name or self.type
+
+
+def provider_headers(config: ProviderConfig) -> Optional[dict]:
+    '''
+    Заголовки HTTP-клиента поставщика: 5sim принимает ключ API только в
+    заголовке Authorization.
+    '''
+    if config.type == '5sim' and config.api_key:
+        return {**DEFAULT_HEADERS,
+                'authorization': f"Bearer {config.api_key}",
+                'accept': 'application/json'}
+    return None
+
+
+def create_provider(config: ProviderConfig,
+                    client: HttpClient,
+                    chunk_size: int = 65536) -> Provider:
+    '''
+    Поставщик по настройке. Для API с протоколом handler_api.php адреса
+    запросов строятся из url с параметрами api_key и action.
+    '''
+    limiter = RateLimiter(config.rate_limit, config.burst)
+    if config.type == '5sim':
+        return FiveSimProvider(config.label, client, config.url,
+                               config.countries, config.services, limiter)
+    params = {'api_key': config.api_key} if config.api_key else {}
+    balance_url = with_query(config.url, action='getBalance', **params)
+    if config.type == 'smshub':
+        return SmsHubProvider(config.label, client,
+                              with_query(config.url, action='getPrices',
+                                         **params),
+                              balance_url, limiter=limiter)
+    return SmsActivateProvider(config.label, client,
+                               with_query(config.url,
+                                          action='getTopCountriesByService',
+                                          **params),
+                               balance_url, chunk_size=chunk_size,
+                               limiter=limiter)
+
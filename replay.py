@@ -0,0 +1,490 @@
+'''
+Запись ответов внешних API и воспроизведение работы бота по записи на
+виртуальных часах.
+
+Запись включается настройкой RECORD_PATH: каждый ответ API поставщиков
+(или ошибка запроса) дописывается в файл JSON Lines (.gz - со сжатием)
+с моментом получения и задержкой; тело пишется, только если оно
+изменилось с прошлого ответа по тому же адресу. API-ключи в адресах
+заменяются коротким обозначением аккаунта.
+
+Воспроизведение запускает цикл проверки BotHandler и NumberChecker с
+настройками из окружения и .env против записи: в момент t (по
+виртуальным часам) запрос получает последний записанный до t ответ.
+Виртуальные часы идут, только пока бот ждет, поэтому неделя записи
+проигрывается за секунды. Интервалы опроса и правила можно
+переопределить, чтобы подобрать их по записанному рынку.
+
+    python -m replay RECORDING [--rules rules.json] [--min-interval 60]
+        [--max-interval 1800] [--initial-interval 600] [--jitter 0.1]
+        [--seed 1] [--messages]
+'''
+import argparse
+import asyncio
+import bisect
+import gzip
+import json
+import random
+import selectors
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import IO, Any, AsyncIterator, Callable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+from http_client import HttpClient
+from offers import loads
+from resilience import CircuitOpenError
+from targets import account_label
+
+
+def record_key(url: str) -> str:
+    '''
+    Адрес запроса в записи: API-ключ заменен обозначением аккаунта,
+    параметры отсортированы.
+    '''
+    parts = urlsplit(url)
+    query = sorted(
+        (name, account_label(value) if name == 'api_key' else value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+    )
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class Recorder:
+    '''
+    Запись ответов в файл JSON Lines, по строке на ответ:
+    {"t": момент, "url": адрес, "ms": задержка, "body": тело} или с
+    "status" (ответ 4xx/5xx) либо "error" ("timeout", "connection")
+    вместо тела. Тело, не изменившееся с прошлого ответа по адресу, не
+    пишется. Файл дописывается, каждая строка сразу сбрасывается на диск.
+    '''
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        self.records = 0
+        self._file: Optional[IO[str]] = _open(path, 'a')
+        self._last: dict[str, str] = {}
+
+    def record(self,
+               url: str,
+               seconds: float,
+               body: Optional[bytes] = None,
+               error: Optional[BaseException] = None) -> None:
+        if self._file is None:
+            return
+        key = record_key(url)
+        entry: dict[str, Any] = {"t": round(self.clock(), 3), "url": key,
+                                 "ms": round(seconds * 1000, 1)}
+        if isinstance(error, aiohttp.ClientResponseError):
+            entry["status"] = error.status
+        elif isinstance(error, asyncio.TimeoutError):
+            entry["error"] = "timeout"
+        elif error is not None:
+            entry["error"] = "connection"
+        else:
+            text = body.decode('utf-8', errors='replace')
+            if self._last.get(key) != text:
+                entry["body"] = self._last[key] = text
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.records += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _Content:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, size: int) -> AsyncIterator[bytes]:
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+
+class BufferedResponse:
+    '''
+    Ответ, тело которого уже прочитано, с интерфейсом ответа aiohttp для
+    потокового чтения (content.iter_chunked).
+    '''
+    status = 200
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.content = _Content(body)
+
+    async def read(self) -> bytes:
+        return self.body
+
+    def release(self) -> None:
+        pass
+
+
+class RecordingClient:
+    '''
+    Обертка над HTTP-клиентом (HttpClient или ResilientClient) с тем же
+    интерфейсом, которая записывает каждый ответ в Recorder. stream
+    читает тело целиком: в запись нужен весь ответ. Запросы, не
+    отправленные из-за разомкнутого предохранителя, не записываются.
+    '''
+    def __init__(self, client: HttpClient, recorder: Recorder):
+        self.client = client
+        self.recorder = recorder
+
+    @property
+    def on_state_change(self) -> Optional[Callable[[str, str], None]]:
+        return getattr(self.client, 'on_state_change', None)
+
+    @on_state_change.setter
+    def on_state_change(self,
+                        callback: Optional[Callable[[str, str], None]]
+                        ) -> None:
+        self.client.on_state_change = callback
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        return await self.client.get_session()
+
+    async def get_bytes(self, url: str) -> bytes:
+        started = time.perf_counter()
+        try:
+            body = await self.client.get_bytes(url)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            self.recorder.record(url, time.perf_counter() - started,
+                                 error=e)
+            raise
+        self.recorder.record(url, time.perf_counter() - started, body)
+        return body
+
+    @asynccontextmanager
+    async def stream(self, url: str) -> AsyncIterator[BufferedResponse]:
+        yield BufferedResponse(await self.get_bytes(url))
+
+    async def get_text(self, url: str) -> str:
+        return (await self.get_bytes(url)).decode('utf-8', errors='replace')
+
+    async def get_json(self, url: str) -> Any:
+        return loads(await self.get_bytes(url))
+
+    async def close(self) -> None:
+        await self.client.close()
+        self.recorder.close()
+
+
+class RecordedResponse:
+    '''
+    Ответ из записи: момент, задержка и тело либо статус или ошибка.
+    '''
+    __slots__ = ('at', 'seconds', 'body', 'status', 'error')
+
+    def __init__(self,
+                 at: float,
+                 seconds: float,
+                 body: Optional[bytes],
+                 status: int = 200,
+                 error: Optional[str] = None):
+        self.at = at
+        self.seconds = seconds
+        self.body = body
+        self.status = status
+        self.error = error
+
+
+class Recording:
+    '''
+    Запись, загруженная для воспроизведения: ответы по каждому адресу в
+    порядке времени. response(url, at) - последний ответ до момента at
+    (или первый, если at раньше записи).
+    '''
+    def __init__(self, path: str):
+        self.timeline: dict[str, tuple[list[float],
+                                       list[RecordedResponse]]] = {}
+        last: dict[str, bytes] = {}
+        self.records = 0
+        with _open(path, 'r') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                key = entry["url"]
+                if "body" in entry:
+                    last[key] = entry["body"].encode()
+                response = RecordedResponse(
+                    entry["t"], entry.get("ms", 0) / 1000, last.get(key),
+                    entry.get("status", 200), entry.get("error")
+                )
+                moments, responses = self.timeline.setdefault(key,
+                                                              ([], []))
+                # Строки пишутся по мере получения ответов, поэтому почти
+                # упорядочены по времени
+                index = bisect.bisect_right(moments, response.at)
+                moments.insert(index, response.at)
+                responses.insert(index, response)
+                self.records += 1
+        if not self.records:
+            raise ValueError(f"Запись {path} пуста")
+        self.start = min(moments[0] for moments, _ in
+                         self.timeline.values())
+        self.end = max(moments[-1] for moments, _ in
+                       self.timeline.values())
+
+    def response(self, url: str, at: float) -> Optional[RecordedResponse]:
+        found = self.timeline.get(record_key(url))
+        if found is None:
+            return None
+        moments, responses = found
+        return responses[max(0, bisect.bisect_right(moments, at) - 1)]
+
+
+class ReplayClient:
+    '''
+    HTTP-клиент с интерфейсом HttpClient, отвечающий из записи по часам
+    clock (по умолчанию - часы цикла событий) после записанной задержки.
+    Записанные ошибки выбрасываются теми же исключениями, что и при
+    опросе; на адрес без записи - ошибка соединения.
+    '''
+    def __init__(self,
+                 recording: Recording,
+                 clock: Optional[Callable[[], float]] = None):
+        self.recording = recording
+        self.clock = clock
+        self.requests: Counter[str] = Counter()
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        raise RuntimeError("При воспроизведении сессии aiohttp нет")
+
+    async def get_bytes(self, url: str) -> bytes:
+        clock = self.clock or asyncio.get_running_loop().time
+        key = record_key(url)
+        self.requests[key] += 1
+        response = self.recording.response(url, clock())
+        if response is None:
+            raise aiohttp.ClientConnectionError(f"Нет записи для {key}")
+        if response.seconds:
+            await asyncio.sleep(response.seconds)
+        if response.error == 'timeout':
+            raise asyncio.TimeoutError()
+        if response.error is not None or response.body is None:
+            raise aiohttp.ClientConnectionError(f"Записана ошибка {key}")
+        if response.status >= 400:
+            request = aiohttp.RequestInfo(
+                URL(url), 'GET', CIMultiDictProxy(CIMultiDict()), URL(url)
+            )
+            raise aiohttp.ClientResponseError(request, (),
+                                              status=response.status,
+                                              message="Recorded")
+        return response.body
+
+    @asynccontextmanager
+    async def stream(self, url: str) -> AsyncIterator[BufferedResponse]:
+        yield BufferedResponse(await self.get_bytes(url))
+
+    async def get_text(self, url: str) -> str:
+        return (await self.get_bytes(url)).decode('utf-8', errors='replace')
+
+    async def get_json(self, url: str) -> Any:
+        return loads(await self.get_bytes(url))
+
+    async def close(self) -> None:
+        pass
+
+
+class _VirtualSelector:
+    '''
+    Селектор цикла с виртуальным временем: готовые события ввода-вывода
+    отдаются сразу, а вместо ожидания таймера часы цикла переводятся на
+    срок таймера.
+    '''
+    def __init__(self, loop: 'VirtualClockLoop'):
+        self.loop = loop
+        self.selector = selectors.DefaultSelector()
+
+    def select(self, timeout: Optional[float] = None) -> list:
+        events = self.selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # Таймеров нет: ждем ввода-вывода (например, потока)
+            return self.selector.select(None)
+        self.loop.advance(timeout)
+        return []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.selector, name)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    '''
+    Цикл событий, время которого (loop.time) начинается с start и
+    продвигается только тогда, когда все задачи ждут таймеров:
+    asyncio.sleep и таймауты срабатывают сразу, в порядке сроков.
+    '''
+    def __init__(self, start: float = 0.0):
+        self._now = start
+        super().__init__(_VirtualSelector(self))
+        # Время порядка 1.7e9 хранится с шагом ~2.4e-7 с: меньший остаток
+        # до срока таймера не сдвигает часы, и таймер не срабатывал бы
+        self._clock_resolution = 1e-6
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float) -> None:
+        self._now += max(0.0, seconds)
+
+
+class ReplayBot:
+    '''
+    Бот, который запоминает отправленные сообщения с моментом отправки
+    по часам clock.
+    '''
+    def __init__(self, clock: Callable[[], float]):
+        self.clock = clock
+        self.messages: list[tuple[float, int, str]] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        self.messages.append((self.clock(), chat_id, text))
+
+    async def set_my_commands(self, commands: list) -> None:
+        pass
+
+
+def _iso(moment: float) -> str:
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(moment))
+
+
+async def replay(settings: Any,
+                 recording: Recording,
+                 seed: int = 1) -> tuple[dict, list[tuple[float, int, str]]]:
+    '''
+    Проигрывает запись циклом проверки бота с настройками settings на
+    часах текущего цикла событий (VirtualClockLoop). Возвращает сводку и
+    отправленные сообщения.
+    '''
+    from bot_handler import BotHandler
+    from main import build_checker
+    from metrics import metrics
+    from scheduler import AdaptiveScheduler
+    from sms_service import SmsService
+
+    loop = asyncio.get_running_loop()
+    clock = loop.time
+    client = ReplayClient(recording, clock)
+    checker, subscriptions = build_checker(
+        settings, lambda mirrors=(), headers=None: client
+    )
+    checker.clock = checker.stats.clock = checker.flights.clock = clock
+    checker.sms_service = SmsService(settings.admin_id, clock=clock)
+    scheduler = AdaptiveScheduler(checker.targets_by_key,
+                                  settings.poll_min_interval,
+                                  settings.poll_max_interval,
+                                  settings.poll_initial_interval,
+                                  settings.poll_jitter,
+                                  max_backoff=settings.poll_max_backoff,
+                                  clock=clock,
+                                  rng=random.Random(seed).random)
+    bot = ReplayBot(clock)
+    handler = BotHandler(bot, settings.admin_id, checker.sms_service,
+                         checker, scheduler, subscriptions)
+    started = time.perf_counter()
+    handler.start_check_loop()
+    await asyncio.sleep(max(0.0, recording.end - clock()))
+    await handler.close()
+    await checker.sms_service.close()
+    await checker.close()
+    elapsed = time.perf_counter() - started
+
+    virtual = recording.end - recording.start
+    detection = metrics.histogram('change_detection_max_seconds').snapshot()
+    summary = {
+        "recording": {"records": recording.records,
+                      "urls": len(recording.timeline),
+                      "from": _iso(recording.start),
+                      "to": _iso(recording.end),
+                      "hours": round(virtual / 3600, 2)},
+        "real_seconds": round(elapsed, 2),
+        "speedup": round(virtual / elapsed) if elapsed else None,
+        "upstream_requests": sum(client.requests.values()),
+        "requests_per_hour": round(sum(client.requests.values())
+                                   / max(virtual / 3600, 1e-9), 1),
+        "notifications": len(bot.messages),
+        "notifications_by_chat": dict(Counter(chat_id for _, chat_id, _
+                                              in bot.messages)),
+        "change_detection_max_s": {
+            key: round(detection[key], 1)
+            for key in ('count', 'p50', 'p95', 'max') if key in detection
+        },
+        "intervals_s": {key: round(state.interval)
+                        for key, state in scheduler.states.items()},
+    }
+    return summary, bot.messages
+
+
+def run(settings: Any,
+        recording: Recording,
+        seed: int = 1) -> tuple[dict, list[tuple[float, int, str]]]:
+    '''
+    replay в новом цикле с виртуальными часами, начинающимися с начала
+    записи.
+    '''
+    loop = VirtualClockLoop(recording.start)
+    try:
+        return loop.run_until_complete(replay(settings, recording, seed))
+    finally:
+        loop.close()
+
+
+def main() -> None:
+    from pydantic import ValidationError
+    from main import load_config
+    from watch_rules import load_rules
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('recording')
+    parser.add_argument('--rules', help="JSON-файл правил вместо правил "
+                                        "из настроек")
+    parser.add_argument('--min-interval', type=float)
+    parser.add_argument('--max-interval', type=float)
+    parser.add_argument('--initial-interval', type=float)
+    parser.add_argument('--jitter', type=float)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--messages', action='store_true',
+                        help="вывести отправленные сообщения")
+    args = parser.parse_args()
+
+    try:
+        settings = load_config()
+    except ValidationError as e:
+        raise SystemExit(f"Настройки не загружены: {e}")
+    # Воспроизведение не пишет историю, состояние и новую запись
+    update: dict[str, Any] = {'history_path': '', 'state_path': '',
+                              'record_path': None}
+    if args.rules:
+        update.update(watch_rules=load_rules(args.rules), rules_file=None)
+    for name in ('min_interval', 'max_interval', 'initial_interval',
+                 'jitter'):
+        if getattr(args, name) is not None:
+            update[f"poll_{name}"] = getattr(args, name)
+    settings = settings.model_copy(update=update)
+
+    summary, messages = run(settings, Recording(args.recording), args.seed)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if args.messages:
+        for moment, chat_id, text in messages:
+            print(f"\n[{_iso(moment)}] {chat_id}:\n{text}")
+
+
+if __name__ == '__main__':
+    main()
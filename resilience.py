@@ -0,0 +1,406 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Iterable, Optional
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+import aiohttp
+from http_client import HttpClient
+from metrics import metrics
+from offers import loads
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Действия API, которые нельзя повторять и дублировать: каждый запрос
+# покупает номер или меняет статус активации
+NON_IDEMPOTENT = frozenset({'getNumber', 'getNumberV2', 'setStatus'})
+
+
+class CircuitOpenError(Exception):
+    '''
+    Запрос не отправлен: предохранитель действия API разомкнут.
+    retry_after - через сколько секунд запрос будет разрешен.
+    '''
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"{endpoint}: API временно недоступно, повтор "
+                         f"через {retry_after:.0f} с")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    '''
+    Предохранитель: после failure_threshold ошибок подряд размыкается, и
+    запросы не отправляются reset_timeout секунд. Затем пропускается один
+    пробный запрос (полуоткрытое состояние): успех замыкает
+    предохранитель, ошибка снова размыкает.
+    '''
+    def __init__(self,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30,
+                 half_open_delay: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_delay = half_open_delay
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.on_change: Optional[Callable[[str], None]] = None
+        self._probing = False
+
+    def _set(self, state: str) -> None:
+        self.state = state
+        if self.on_change is not None:
+            self.on_change(state)
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self._set(HALF_OPEN)
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def retry_in(self) -> float:
+        '''
+        Секунды до следующего разрешенного запроса.
+        '''
+        if self.state == OPEN:
+            return max(0.0, self.opened_at + self.reset_timeout
+                       - self.clock())
+        if self.state == HALF_OPEN:
+            return self.half_open_delay
+        return 0.0
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        if self.state != CLOSED:
+            self._set(CLOSED)
+
+    def record_failure(self) -> None:
+        self._probing = False
+        self.failures += 1
+        if self.state == HALF_OPEN \
+                or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+            if self.state != OPEN:
+                metrics.counter('breaker_open').inc()
+                self._set(OPEN)
+
+    def release(self) -> None:
+        '''
+        Пробный запрос отменен, не дойдя до результата.
+        '''
+        self._probing = False
+
+
+class RetryBudget:
+    '''
+    Бюджет повторов: каждый запрос добавляет ratio токена (не больше
+    capacity), повтор или дублирующий запрос тратит один токен. Поэтому
+    при массовых ошибках повторов не больше доли ratio от запросов, а не
+    в несколько раз больше.
+    '''
+    def __init__(self,
+                 ratio: float = 0.1,
+                 reserve: float = 3,
+                 capacity: float = 10):
+        self.ratio = ratio
+        self.capacity = max(capacity, reserve)
+        self.tokens = float(reserve)
+
+    def deposit(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            metrics.counter('retry_budget_exhausted').inc()
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LatencyTracker:
+    '''
+    Задержки последних size ответов и их квантиль quantile (по умолчанию
+    p95) - порог для дублирующего запроса. Пока ответов меньше
+    min_samples, порога нет.
+    '''
+    def __init__(self,
+                 size: int = 200,
+                 quantile: float = 0.95,
+                 min_samples: int = 20):
+        self.samples: deque[float] = deque(maxlen=size)
+        self.quantile = quantile
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def threshold(self) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1,
+                           int(len(ordered) * self.quantile))]
+
+
+def endpoint_of(url: str) -> str:
+    '''
+    Действие API (параметр action) или путь запроса.
+    '''
+    parts = urlsplit(url)
+    return dict(parse_qsl(parts.query)).get('action') or parts.path
+
+
+def with_base(url: str, base: str) -> str:
+    '''
+    URL с адресом сервера (и путем, если он задан) из base.
+    '''
+    parts = urlsplit(url)
+    mirror = urlsplit(base)
+    path = mirror.path if mirror.path.strip('/') else parts.path
+    return urlunsplit(parts._replace(scheme=mirror.scheme,
+                                     netloc=mirror.netloc,
+                                     path=path))
+
+
+def _retryable(error: BaseException) -> bool:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def _failure(error: BaseException) -> bool:
+    '''
+    Ошибка, которая говорит о недоступности API (а не о неверном
+    запросе) и учитывается предохранителем.
+    '''
+    return _retryable(error) or (
+        isinstance(error, aiohttp.ClientResponseError) and error.status == 429
+    )
+
+
+class ResilientClient:
+    '''
+    Обертка над HttpClient с тем же интерфейсом для запросов к API
+    поставщика номеров (SMS Activate и другие):
+    - предохранитель на каждое действие API (CircuitBreaker): пока он
+      разомкнут, запросы сразу завершаются CircuitOpenError;
+    - дублирующий запрос (к следующему зеркалу, если они заданы), если
+      ответ не пришел за p95 задержки этого действия; используется
+      первый успешный ответ;
+    - повтор при ошибке соединения, таймауте и ответе 5xx с
+      экспоненциальной задержкой со случайным разбросом, не больше
+      max_retries раз и в пределах RetryBudget.
+    Действия из NON_IDEMPOTENT не повторяются и не дублируются. Для
+    потокового чтения (stream) дублирование касается ожидания заголовков
+    ответа.
+    '''
+    def __init__(self,
+                 client: HttpClient,
+                 mirrors: Iterable[str] = (),
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30,
+                 max_retries: int = 2,
+                 retry_base_delay: float = 0.2,
+                 budget: Optional[RetryBudget] = None,
+                 hedge: bool = True,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Any] = asyncio.sleep,
+                 rng: Callable[[], float] = random.random):
+        self.client = client
+        self.mirrors = list(mirrors)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.budget = budget if budget is not None else RetryBudget()
+        self.hedge = hedge
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        self.breakers: dict[str, CircuitBreaker] = {}
+        # Номер адреса (0 - исходный, далее зеркала), ответившего последним
+        self.active = 0
+        self.latency: dict[str, LatencyTracker] = {}
+        # Вызывается при смене состояния предохранителя: (действие,
+        # состояние)
+        self.on_state_change: Optional[Callable[[str, str], None]] = None
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout, clock=self.clock
+            )
+            breaker.on_change = \
+                lambda state: self._state_changed(endpoint, state)
+        return breaker
+
+    def _state_changed(self, endpoint: str, state: str) -> None:
+        logging.warning("Предохранитель %s: %s", endpoint, state)
+        if self.on_state_change is not None:
+            self.on_state_change(endpoint, state)
+
+    def _tracker(self, endpoint: str) -> LatencyTracker:
+        tracker = self.latency.get(endpoint)
+        if tracker is None:
+            tracker = self.latency[endpoint] = LatencyTracker()
+        return tracker
+
+    def _urls(self, url: str) -> list[tuple[int, str]]:
+        '''
+        Адреса запроса с номерами, начиная с ответившего последним.
+        '''
+        urls = list(enumerate(
+            [url] + [with_base(url, mirror) for mirror in self.mirrors]
+        ))
+        return urls[self.active:] + urls[:self.active]
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        return await self.client.get_session()
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def _open(self, url: str, endpoint: str, read: bool) -> Any:
+        '''
+        Один запрос: тело ответа (read=True) или ответ для потокового
+        чтения.
+        '''
+        session = await self.client.get_session()
+        started = self.clock()
+        response = await session.get(url)
+        try:
+            response.raise_for_status()
+            if read:
+                body = await response.read()
+        except BaseException:
+            response.release()
+            raise
+        if read:
+            response.release()
+        self._tracker(endpoint).observe(self.clock() - started)
+        return body if read else response
+
+    async def _attempt(self,
+                       urls: list[tuple[int, str]],
+                       attempt: int,
+                       endpoint: str,
+                       read: bool,
+                       hedge: bool) -> Any:
+        '''
+        Запрос к urls[attempt] и, если ответ опаздывает больше порога
+        задержки, дублирующий запрос к следующему адресу.
+        '''
+        targets = [urls[attempt % len(urls)]]
+        tasks = [asyncio.ensure_future(
+            self._open(targets[0][1], endpoint, read)
+        )]
+        winner: Optional[asyncio.Future] = None
+        threshold = self._tracker(endpoint).threshold() if hedge else None
+        try:
+            if threshold is not None:
+                done, _ = await asyncio.wait(tasks, timeout=threshold)
+                if not done and self.budget.withdraw():
+                    metrics.counter('http_hedged').inc()
+                    targets.append(urls[(attempt + 1) % len(urls)])
+                    tasks.append(asyncio.ensure_future(self._open(
+                        targets[1][1], endpoint, read
+                    )))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task, (index, _) in zip(tasks, targets):
+                    if task in done and task.exception() is None:
+                        winner = task
+                        if task is not tasks[0]:
+                            metrics.counter('http_hedge_wins').inc()
+                        if index != self.active:
+                            logging.warning("Запросы к API переключены на "
+                                            "адрес %d", index)
+                            self.active = index
+                        return task.result()
+            # Все запросы завершились ошибкой: ошибка основного запроса
+            raise tasks[0].exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if not read:
+                # Ответ проигравшего запроса закрывается
+                for task in tasks:
+                    if task is not winner and not task.cancelled() \
+                            and task.exception() is None:
+                        task.result().release()
+
+    async def _request(self, url: str, read: bool) -> Any:
+        endpoint = endpoint_of(url)
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            metrics.counter('breaker_rejected').inc()
+            raise CircuitOpenError(endpoint, breaker.retry_in())
+        safe = endpoint not in NON_IDEMPOTENT
+        urls = self._urls(url)
+        self.budget.deposit()
+        attempt = 0
+        try:
+            while True:
+                # Пробный запрос полуоткрытого предохранителя - один
+                probe = breaker.state != CLOSED
+                try:
+                    result = await self._attempt(urls, attempt, endpoint,
+                                                 read,
+                                                 safe and self.hedge
+                                                 and not probe)
+                except Exception as e:
+                    if safe and not probe and _retryable(e) \
+                            and attempt < self.max_retries \
+                            and self.budget.withdraw():
+                        attempt += 1
+                        metrics.counter('http_retries').inc()
+                        await self.sleep(self.rng() * self.retry_base_delay
+                                         * 2 ** (attempt - 1))
+                        continue
+                    if _failure(e):
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    raise
+                breaker.record_success()
+                return result
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+
+    @asynccontextmanager
+    async def stream(self, url: str) -> AsyncIterator[aiohttp.ClientResponse]:
+        response = await self._request(url, read=False)
+        try:
+            yield response
+        finally:
+            response.release()
+
+    async def get_bytes(self, url: str) -> bytes:
+        return await self._request(url, read=True)
+
+    async def get_text(self, url: str) -> str:
+        return (await self.get_bytes(url)).decode('utf-8', errors='replace')
+
+    async def get_json(self, url: str) -> Any:
+        return loads(await self.get_bytes(url))
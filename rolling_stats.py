@@ -0,0 +1,277 @@
+import math
+import time
+from typing import Callable, Iterable, Optional
+from history import HistoryRecord
+from offers import Offer
+
+
+FIELDS = ('price', 'count')
+# Ключ гистограммы для нуля (логарифмические корзины его не содержат)
+_ZERO = -(1 << 31)
+
+
+class _Bucket:
+    '''
+    Замеры одной корзины окна: их число, сумма, минимум, максимум, первое
+    и последнее значения по времени и гистограмма для квантилей.
+    '''
+    __slots__ = ('n', 'total', 'low', 'high', 'first_at', 'first',
+                 'last_at', 'last', 'bins')
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.low = math.inf
+        self.high = -math.inf
+        self.first_at = math.inf
+        self.first = 0.0
+        self.last_at = -math.inf
+        self.last = 0.0
+        self.bins: dict[int, int] = {}
+
+
+class RollingWindow:
+    '''
+    Статистика одного ряда значений (цены или количества) за последние
+    window секунд. Окно разбито на buckets корзин по window / buckets
+    секунд: добавление замера - O(1), вышедшие из окна корзины
+    вычитаются из итогов окна целиком, память не зависит от числа
+    замеров. Квантили приближенные: значения хранятся в логарифмических
+    корзинах с относительной погрешностью accuracy. Граница окна
+    сдвигается шагами по одной корзине.
+    '''
+    def __init__(self,
+                 window: float,
+                 buckets: int = 60,
+                 accuracy: float = 0.01):
+        self.window = window
+        self.width = window / buckets
+        self.slots: list[Optional[_Bucket]] = [None] * buckets
+        self.head: Optional[int] = None
+        self.n = 0
+        self.total = 0.0
+        self.bins: dict[int, int] = {}
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def _key(self, value: float) -> int:
+        if value <= 0:
+            return _ZERO
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _estimate(self, key: int) -> float:
+        if key == _ZERO:
+            return 0.0
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def _advance(self, index: int) -> None:
+        '''
+        Сдвигает окно так, чтобы корзина index была последней; корзины,
+        вышедшие из окна, вычитаются из итогов.
+        '''
+        if self.head is not None and index <= self.head:
+            return
+        size = len(self.slots)
+        start = index - size + 1 if self.head is None \
+            else max(self.head + 1, index - size + 1)
+        for stale in range(start, index + 1):
+            bucket = self.slots[stale % size]
+            if bucket is None:
+                continue
+            self.slots[stale % size] = None
+            self.n -= bucket.n
+            self.total -= bucket.total
+            for key, count in bucket.bins.items():
+                left = self.bins[key] - count
+                if left:
+                    self.bins[key] = left
+                else:
+                    del self.bins[key]
+        if not self.n:
+            self.total = 0.0
+        self.head = index
+
+    def add(self, timestamp: float, value: float) -> None:
+        '''
+        Добавляет замер. Замеры старше окна отбрасываются, замеры не по
+        порядку внутри окна учитываются.
+        '''
+        index = int(timestamp // self.width)
+        self._advance(index)
+        size = len(self.slots)
+        if index <= self.head - size:
+            return
+        bucket = self.slots[index % size]
+        if bucket is None:
+            bucket = self.slots[index % size] = _Bucket()
+        key = self._key(value)
+        bucket.n += 1
+        bucket.total += value
+        if value < bucket.low:
+            bucket.low = value
+        if value > bucket.high:
+            bucket.high = value
+        if timestamp < bucket.first_at:
+            bucket.first_at, bucket.first = timestamp, value
+        if timestamp >= bucket.last_at:
+            bucket.last_at, bucket.last = timestamp, value
+        bucket.bins[key] = bucket.bins.get(key, 0) + 1
+        self.n += 1
+        self.total += value
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+    def refresh(self, now: float) -> None:
+        '''
+        Убирает из окна корзины старше now - window.
+        '''
+        self._advance(int(now // self.width))
+
+    def _buckets(self) -> list[_Bucket]:
+        return [bucket for bucket in self.slots if bucket is not None]
+
+    def min(self) -> Optional[float]:
+        return min((bucket.low for bucket in self._buckets()), default=None)
+
+    def max(self) -> Optional[float]:
+        return max((bucket.high for bucket in self._buckets()),
+                   default=None)
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.n if self.n else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.n:
+            return None
+        rank = q * (self.n - 1)
+        seen = 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return self._estimate(key)
+        return self._estimate(max(self.bins))
+
+    def _ends(self) -> Optional[tuple[_Bucket, _Bucket]]:
+        buckets = self._buckets()
+        if not buckets:
+            return None
+        return (min(buckets, key=lambda bucket: bucket.first_at),
+                max(buckets, key=lambda bucket: bucket.last_at))
+
+    def change(self) -> Optional[float]:
+        '''
+        Относительное изменение от первого замера в окне до последнего.
+        '''
+        ends = self._ends()
+        if ends is None or not ends[0].first:
+            return None
+        return ends[1].last / ends[0].first - 1
+
+    def rate(self) -> Optional[float]:
+        '''
+        Скорость изменения от первого замера в окне до последнего, в час.
+        '''
+        ends = self._ends()
+        if ends is None or ends[1].last_at <= ends[0].first_at:
+            return None
+        return (ends[1].last - ends[0].first) * 3600 \
+            / (ends[1].last_at - ends[0].first_at)
+
+    def stat(self, name: str) -> Optional[float]:
+        '''
+        Статистика по имени: min, max, mean, change, rate или квантиль
+        pNN (p50 - медиана).
+        '''
+        if name.startswith('p'):
+            return self.quantile(int(name[1:]) / 100)
+        return getattr(self, name)()
+
+
+class RollingStats:
+    '''
+    Скользящая статистика цены и количества номеров по каждой паре
+    (сервис, страна) за окна windows (секунды). Обновляется каждым
+    опросом; на пару хранится по RollingWindow на поле и окно.
+    '''
+    def __init__(self,
+                 windows: Iterable[float] = (3600, 86400),
+                 buckets: int = 60,
+                 accuracy: float = 0.01,
+                 clock: Callable[[], float] = time.time):
+        self.windows: set[float] = set(windows)
+        self.buckets = buckets
+        self.accuracy = accuracy
+        self.clock = clock
+        self._series: dict[tuple[str, int],
+                           dict[tuple[str, float], RollingWindow]] = {}
+
+    def add_windows(self, windows: Iterable[float]) -> None:
+        '''
+        Добавляет окна (например, из условий новых правил). Новые окна
+        заполняются со следующего замера.
+        '''
+        self.windows.update(windows)
+
+    def _add(self,
+             service: str,
+             country: int,
+             timestamp: float,
+             price: float,
+             count: int) -> None:
+        series = self._series.get((service, country))
+        if series is None:
+            series = self._series[(service, country)] = {}
+        for window in self.windows:
+            for field, value in (('price', price), ('count', count)):
+                rolling = series.get((field, window))
+                if rolling is None:
+                    rolling = series[(field, window)] = RollingWindow(
+                        window, self.buckets, self.accuracy
+                    )
+                rolling.add(timestamp, value)
+
+    def update(self,
+               offers: Iterable[Offer],
+               timestamp: Optional[float] = None) -> None:
+        '''
+        Учитывает предложения одного опроса.
+        '''
+        if timestamp is None:
+            timestamp = self.clock()
+        for offer in offers:
+            self._add(offer.service, offer.country, timestamp, offer.price,
+                      offer.count)
+
+    def seed(self, records: Iterable[HistoryRecord]) -> None:
+        '''
+        Заполняет окна записями истории (после перезапуска).
+        '''
+        for record in records:
+            self._add(record.service, record.country, record.timestamp,
+                      record.price, record.count)
+
+    def window(self,
+               service: str,
+               country: int,
+               field: str,
+               window: float) -> Optional[RollingWindow]:
+        series = self._series.get((service, country))
+        return None if series is None else series.get((field, window))
+
+    def value(self,
+              service: str,
+              country: int,
+              field: str,
+              stat: str,
+              window: float,
+              min_samples: int = 1) -> Optional[float]:
+        '''
+        Статистика stat поля field пары (сервис, страна) за окно window
+        или None, если замеров в окне меньше min_samples.
+        '''
+        rolling = self.window(service, country, field, window)
+        if rolling is None:
+            return None
+        rolling.refresh(self.clock())
+        if rolling.n < max(min_samples, 1):
+            return None
+        return rolling.stat(stat)
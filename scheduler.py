@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+import aiohttp
+from metrics import metrics
+from resilience import CircuitOpenError
+
+
+class TargetState:
+    '''
+    Состояние расписания одной цели опроса.
+    '''
+    __slots__ = ('key', 'interval', 'next_due', 'last_poll', 'errors')
+
+    def __init__(self, key: str, interval: float, next_due: float):
+        self.key = key
+        self.interval = interval
+        self.next_due = next_due
+        self.last_poll: Optional[float] = None
+        self.errors = 0
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    '''
+    Возвращает задержку из заголовка Retry-After ответа 429, если она есть.
+    '''
+    if isinstance(error, aiohttp.ClientResponseError) and error.status == 429:
+        value = (error.headers or {}).get('Retry-After')
+        try:
+            return float(value) if value is not None else 0.0
+        except ValueError:
+            return 0.0
+    return None
+
+
+class AdaptiveScheduler:
+    '''
+    Планировщик опроса с отдельным интервалом для каждой цели.
+    Если рынок по цели изменился, интервал уменьшается вдвое, если нет -
+    плавно растет; интервал всегда в пределах [min_interval, max_interval].
+    При ошибках и ответе 429 цель откладывается с экспоненциальной
+    задержкой (и не раньше, чем просит Retry-After). Время берется из
+    монотонных часов, к каждому сроку добавляется случайный разброс.
+    '''
+    def __init__(self,
+                 keys: Iterable[str],
+                 min_interval: float = 60,
+                 max_interval: float = 1800,
+                 initial_interval: float = 600,
+                 jitter: float = 0.1,
+                 speedup: float = 0.5,
+                 slowdown: float = 1.25,
+                 max_backoff: float = 3600,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Awaitable] = asyncio.sleep,
+                 rng: Callable[[], float] = random.random):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.jitter = jitter
+        self.speedup = speedup
+        self.slowdown = slowdown
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        now = clock()
+        self.states = {key: TargetState(key, initial_interval, now)
+                       for key in keys}
+        self._changed = asyncio.Event()
+        # Сохраненное состояние целей, которых еще нет в расписании
+        self._saved: dict[str, dict] = {}
+
+    def sync(self, keys: Iterable[str]) -> None:
+        '''
+        Приводит набор целей к keys: новые цели опрашиваются сразу,
+        состояние оставшихся сохраняется. Прерывает текущее ожидание wait.
+        '''
+        keys = list(keys)
+        now = self.clock()
+        self.states = {key: self.states.get(key)
+                       or self._restored(key)
+                       or TargetState(key, self.initial_interval, now)
+                       for key in keys}
+        self._changed.set()
+
+    def dump(self) -> dict[str, dict]:
+        '''
+        Состояние целей для сохранения между перезапусками. Монотонные
+        часы не переживают перезапуск, поэтому сроки хранятся в
+        unix-времени.
+        '''
+        offset = time.time() - self.clock()
+        saved = dict(self._saved)
+        for key, state in self.states.items():
+            saved[key] = {
+                "interval": state.interval,
+                "errors": state.errors,
+                "next_due": state.next_due + offset,
+                "last_poll": None if state.last_poll is None
+                else state.last_poll + offset,
+            }
+        return saved
+
+    def restore(self, saved: dict[str, dict]) -> None:
+        '''
+        Восстанавливает интервалы, задержки после ошибок и сроки опроса.
+        Состояние целей, которых нет в расписании, применяется, когда они
+        появятся в sync.
+        '''
+        self._saved.update(saved)
+        for key in list(self.states):
+            state = self._restored(key)
+            if state is not None:
+                self.states[key] = state
+        self._changed.set()
+
+    def _restored(self, key: str) -> Optional[TargetState]:
+        saved = self._saved.pop(key, None)
+        if saved is None:
+            return None
+        offset = self.clock() - time.time()
+        state = TargetState(key, self._clamp(saved["interval"]),
+                            saved["next_due"] + offset)
+        state.errors = saved["errors"]
+        if saved["last_poll"] is not None:
+            state.last_poll = saved["last_poll"] + offset
+        return state
+
+    def _clamp(self, interval: float) -> float:
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def _jittered(self, delay: float) -> float:
+        return delay * (1 + self.jitter * (2 * self.rng() - 1))
+
+    def due(self) -> list[str]:
+        '''
+        Ключи целей, срок опроса которых наступил. Опоздание опроса
+        относительно срока записывается в метрику loop_drift_seconds.
+        '''
+        now = self.clock()
+        due = [state for state in self.states.values()
+               if state.next_due <= now]
+        drift = metrics.histogram('loop_drift_seconds')
+        for state in due:
+            drift.observe(now - state.next_due)
+        return [state.key for state in due]
+
+    def next_delay(self) -> float:
+        '''
+        Секунды до ближайшего срока опроса.
+        '''
+        if not self.states:
+            return self.max_interval
+        earliest = min(state.next_due for state in self.states.values())
+        return max(0.0, earliest - self.clock())
+
+    async def wait(self) -> None:
+        '''
+        Ждет наступления ближайшего срока опроса или изменения набора
+        целей.
+        '''
+        self._changed.clear()
+        sleeper = asyncio.ensure_future(self.sleep(self.next_delay()))
+        changed = asyncio.ensure_future(self._changed.wait())
+        try:
+            await asyncio.wait((sleeper, changed),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sleeper.cancel()
+            changed.cancel()
+
+    def record_success(self, key: str, changed: bool) -> None:
+        '''
+        Учитывает успешный опрос цели и планирует следующий.
+        '''
+        state = self.states[key]
+        now = self.clock()
+        if changed and state.last_poll is not None:
+            # Изменение произошло где-то между прошлым и текущим опросом
+            window = now - state.last_poll
+            metrics.histogram('change_detection_max_seconds').observe(window)
+            metrics.histogram('change_detection_seconds').observe(window / 2)
+            logging.info("Изменение по %s обнаружено за <= %.1f с",
+                         key, window)
+        factor = self.speedup if changed else self.slowdown
+        state.interval = self._clamp(state.interval * factor)
+        state.errors = 0
+        state.last_poll = now
+        state.next_due = now + self._jittered(state.interval)
+
+    def record_error(self, key: str, error: BaseException) -> None:
+        '''
+        Учитывает ошибку опроса цели: экспоненциальная задержка, для
+        ответа 429 - не меньше значения Retry-After. Пока предохранитель
+        API разомкнут, цель просто откладывается до его проверки.
+        '''
+        state = self.states[key]
+        now = self.clock()
+        if isinstance(error, CircuitOpenError):
+            # Запрос не отправлялся: цель ждет, пока предохранитель не
+            # пропустит запрос, без роста задержки
+            metrics.counter('poll_paused').inc()
+            state.next_due = now + error.retry_after
+            return
+        state.errors += 1
+        delay = min(self.max_backoff,
+                    self.min_interval * 2 ** min(state.errors, 16))
+        delay = self._jittered(delay)
+        throttled = retry_after(error)
+        if throttled is not None:
+            metrics.counter('poll_throttled').inc()
+            delay = max(delay, throttled)
+        metrics.counter('poll_errors').inc()
+        state.next_due = now + delay
@@ -0,0 +1,60 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    '''
+    Объединение одновременных запросов с кэшем результатов.
+    Все, кто запрашивает один ключ, пока запрос выполняется, получают
+    результат этого же запроса. Успешный результат хранится в кэше и
+    отдается без запроса, пока он не старше max_age секунд.
+    '''
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._cache: dict[str, tuple[Any, float]] = {}
+
+    async def run(self,
+                  key: str,
+                  fetch: Callable[[], Awaitable[Any]],
+                  max_age: float = 0.0,
+                  cacheable: Callable[[Any], bool] = lambda value: True
+                  ) -> tuple[Any, float]:
+        '''
+        Возвращает пару (результат, момент его получения по self.clock).
+        Отмена ожидающего не отменяет общий запрос.
+        '''
+        cached = self._cache.get(key)
+        if cached is not None and self.clock() - cached[1] <= max_age:
+            return cached
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(fetch))
+            self._inflight[key] = future
+            future.add_done_callback(
+                lambda done: self._finish(key, done, cacheable)
+            )
+        return await asyncio.shield(future)
+
+    def age(self, fetched_at: float) -> float:
+        return max(0.0, self.clock() - fetched_at)
+
+    def invalidate(self, key: str) -> None:
+        self._cache.pop(key, None)
+
+    async def _fetch(self,
+                     fetch: Callable[[], Awaitable[Any]]) -> tuple[Any, float]:
+        value = await fetch()
+        return value, self.clock()
+
+    def _finish(self,
+                key: str,
+                future: asyncio.Future,
+                cacheable: Callable[[Any], bool]) -> None:
+        self._inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if cacheable(result[0]):
+            self._cache[key] = result
@@ -1,12 +1,223 @@
-from aiogram import Bot
+import asyncio
+import itertools
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+
+# Ограничения Telegram Bot API: около 30 сообщений в секунду всего и
+# не больше одного сообщения в секунду в один чат
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+MESSAGE_LIMIT = 4096
+
+URGENT = 0
+NORMAL = 1
+
+
+class TokenBucket:
+    '''
+    Ведро токенов: rate токенов в секунду, не больше capacity сразу.
+    '''
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'clock')
+
+    def __init__(self,
+                 rate: float,
+                 capacity: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def wait_time(self) -> float:
+        '''
+        Секунды до появления свободного токена.
+        '''
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+
+def split_message(text: str,
+                  limit: int = MESSAGE_LIMIT) -> tuple[str, str]:
+    '''
+    Делит текст на начало не длиннее limit и остаток, по возможности по
+    границе строки.
+    '''
+    cut = text.rfind('\n', 0, limit + 1)
+    if cut <= 0:
+        return text[:limit], text[limit:]
+    return text[:cut], text[cut + 1:]
 
 
 class SmsService:
-    def __init__(self, admin_id: int):
+    '''
+    Отправка сообщений через очередь с одним фоновым отправителем.
+    send_message только ставит сообщение в очередь и сразу возвращает
+    управление. Отправитель соблюдает общий лимит и лимит на чат Telegram,
+    выжидает retry_after при флуд-контроле, склеивает накопившиеся
+    сообщения в один чат и отправляет срочные уведомления раньше обычных.
+    Время ожидания в очереди и отправки записывается в метрики.
+    '''
+    def __init__(self,
+                 admin_id: int,
+                 global_rate: float = GLOBAL_RATE,
+                 chat_rate: float = CHAT_RATE,
+                 clock: Callable[[], float] = time.monotonic):
         self.admin_id = admin_id
+        self.chat_rate = chat_rate
+        self.clock = clock
+        self._global = TokenBucket(global_rate, global_rate, clock)
+        self._chats: dict[int, TokenBucket] = {}
+        self._pending: dict[int,
+                            list[tuple[int, int, 'Bot', str, float]]] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker: Optional[asyncio.Task] = None
 
-    async def send_message(self, bot: Bot, message: str) -> None:
+    async def send_message(self,
+                           bot: 'Bot',
+                           message: str,
+                           urgent: bool = False,
+                           chat_id: Optional[int] = None) -> None:
         '''
-        Отправляет сообщение администратору с указанным текстом.
+        Ставит в очередь сообщение с указанным текстом администратору
+        (или в чат chat_id).
         '''
-        await bot.send_message(self.admin_id, message)
+        if chat_id is None:
+            chat_id = self.admin_id
+        priority = URGENT if urgent else NORMAL
+        self._pending.setdefault(chat_id, []).append(
+            (priority, next(self._seq), bot, message, self.clock())
+        )
+        self._idle.clear()
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        '''
+        Ждет, пока все сообщения из очереди будут отправлены.
+        '''
+        await self._idle.wait()
+
+    async def close(self, timeout: float = 5) -> None:
+        '''
+        Отправляет оставшиеся сообщения (не дольше timeout секунд) и
+        останавливает отправителя.
+        '''
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Не отправлено сообщений при остановке: %d",
+                            sum(map(len, self._pending.values())))
+        self._worker.cancel()
+        self._worker = None
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, 1, self.clock)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _next_chat(self) -> tuple[Optional[int], float]:
+        '''
+        Среди чатов, лимит которых позволяет отправку, выбирает чат с самым
+        приоритетным и самым давним ожидающим сообщением. Если таких нет,
+        возвращает время ожидания ближайшего чата.
+        '''
+        best = None
+        wait = float('inf')
+        for chat_id, entries in self._pending.items():
+            delay = self._chat_bucket(chat_id).wait_time()
+            if delay > 0:
+                wait = min(wait, delay)
+                continue
+            head = min(entries)[:2]
+            if best is None or head < best[0]:
+                best = (head, chat_id)
+        if best is None:
+            return None, wait
+        return best[1], 0.0
+
+    def _take(self, chat_id: int) -> tuple['Bot', str, int, float]:
+        '''
+        Забирает из очереди чата сообщения, склеенные в одно в порядке
+        приоритета, в пределах лимита длины сообщения Telegram. Сообщение
+        длиннее лимита забирается по частям. Возвращает также момент
+        постановки в очередь самого давнего из них.
+        '''
+        entries = sorted(self._pending.pop(chat_id))
+        priority, _, bot, text, enqueued = entries[0]
+        if len(text) > MESSAGE_LIMIT:
+            # Длинное сообщение уходит частями, остаток - первым в очереди
+            text, rest = split_message(text)
+            entries[0] = (priority, -next(self._seq), bot, rest, enqueued)
+            self._pending[chat_id] = entries
+            return bot, text, priority, enqueued
+        taken = 1
+        for entry in entries[1:]:
+            if len(text) + 2 + len(entry[3]) > MESSAGE_LIMIT:
+                break
+            text = f"{text}\n\n{entry[3]}"
+            enqueued = min(enqueued, entry[4])
+            taken += 1
+        if taken < len(entries):
+            self._pending[chat_id] = entries[taken:]
+        return bot, text, priority, enqueued
+
+    async def _run(self) -> None:
+        # aiogram импортируется лениво: к первой отправке он уже загружен
+        from aiogram.exceptions import TelegramRetryAfter
+        while True:
+            if not self._pending:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            chat_id, delay = self._next_chat()
+            delay = max(delay, self._global.wait_time())
+            if chat_id is None or delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            bucket = self._chat_bucket(chat_id)
+            bot, text, priority, enqueued = self._take(chat_id)
+            self._global.consume()
+            bucket.consume()
+            started = self.clock()
+            metrics.histogram('notify_queue_seconds').observe(
+                started - enqueued
+            )
+            try:
+                await bot.send_message(chat_id, text)
+                metrics.histogram('telegram_send_seconds').observe(
+                    self.clock() - started
+                )
+            except TelegramRetryAfter as e:
+                metrics.counter('telegram_retry_after').inc()
+                logging.warning("Флуд-контроль Telegram, повтор через %s с",
+                                e.retry_after)
+                self._pending.setdefault(chat_id, []).insert(
+                    0, (priority, -next(self._seq), bot, text, enqueued)
+                )
+                await asyncio.sleep(e.retry_after)
+            except Exception:
+                metrics.counter('telegram_errors').inc()
+                logging.exception("Не удалось отправить сообщение в чат %s",
+                                  chat_id)
@@ -0,0 +1,153 @@
+from typing import Callable, Iterable, Optional
+from offers import DEFAULT_PROVIDER
+from watch_rules import Match, provider_label
+
+
+NEW = 'new'
+GONE = 'gone'
+PRICE_DROP = 'price_drop'
+COUNT = 'count'
+
+
+class OfferChange:
+    '''
+    Изменение предложения (сервис, страна) поставщика provider между
+    двумя опросами.
+    '''
+    __slots__ = ('kind', 'service', 'country', 'price', 'count',
+                 'old_price', 'old_count', 'provider')
+
+    def __init__(self,
+                 kind: str,
+                 service: str,
+                 country: int,
+                 price: float = 0,
+                 count: int = 0,
+                 old_price: float = 0,
+                 old_count: int = 0,
+                 provider: str = DEFAULT_PROVIDER):
+        self.kind = kind
+        self.service = service
+        self.country = country
+        self.price = price
+        self.count = count
+        self.old_price = old_price
+        self.old_count = old_count
+        self.provider = provider
+
+    def __repr__(self) -> str:
+        return (f"OfferChange({self.kind!r}, {self.service!r}, "
+                f"{self.country}, price={self.price}, count={self.count})")
+
+    @property
+    def urgent(self) -> bool:
+        '''
+        Появление номеров и снижение цены - срочные уведомления.
+        '''
+        return self.kind in (NEW, PRICE_DROP)
+
+    def describe(self) -> str:
+        prefix = (f"{self.service}, страна {self.country}"
+                  f"{provider_label(self.provider)}")
+        if self.kind == NEW:
+            return (f"{prefix}: доступно {self.count} номеров по цене "
+                    f"{self.price}")
+        if self.kind == GONE:
+            return f"{prefix}: номера по цене {self.old_price} закончились"
+        if self.kind == PRICE_DROP:
+            return (f"{prefix}: цена снизилась {self.old_price} -> "
+                    f"{self.price}, доступно {self.count} номеров")
+        return (f"{prefix}: количество {self.old_count} -> {self.count} "
+                f"по цене {self.price}")
+
+
+class SnapshotStore:
+    '''
+    Последний снимок подходящих под правила предложений по каждой цели.
+    update сравнивает новый снимок с предыдущим и возвращает только
+    изменения: новые и исчезнувшие предложения, снижение цены и изменение
+    количества не меньше чем на count_threshold. Сравниваются только
+    сработавшие записи, поэтому стоимость пропорциональна числу
+    срабатываний, а не размеру ответа API.
+    '''
+    def __init__(self, count_threshold: int = 10):
+        self.count_threshold = count_threshold
+        self.snapshots: dict[str, dict[tuple[str, int],
+                                       tuple[float, int]]] = {}
+
+    def update(self,
+               target_key: str,
+               matches: Iterable[Match],
+               provider: str = DEFAULT_PROVIDER) -> list[OfferChange]:
+        '''
+        Запоминает новый снимок цели target_key поставщика provider и
+        возвращает изменения по сравнению с прошлым.
+        '''
+        current = {(match.service, match.country): (match.price, match.count)
+                   for match in matches}
+        previous = self.snapshots.get(target_key, {})
+        self.snapshots[target_key] = current
+        changes = []
+        for key, (price, count) in current.items():
+            old = previous.get(key)
+            if old is None:
+                changes.append(OfferChange(NEW, *key, price, count,
+                                           provider=provider))
+                continue
+            old_price, old_count = old
+            if price < old_price:
+                changes.append(OfferChange(PRICE_DROP, *key, price, count,
+                                           old_price, old_count, provider))
+            elif abs(count - old_count) >= self.count_threshold:
+                changes.append(OfferChange(COUNT, *key, price, count,
+                                           old_price, old_count, provider))
+        for key, (old_price, old_count) in previous.items():
+            if key not in current:
+                changes.append(OfferChange(GONE, *key,
+                                           old_price=old_price,
+                                           old_count=old_count,
+                                           provider=provider))
+        return changes
+
+    def prune(self,
+              target_key: str,
+              keep: Callable[[tuple[str, int]], bool]) -> None:
+        '''
+        Удаляет из снимка предложения, для которых keep ложно (например,
+        после удаления правила), чтобы не сообщать об их исчезновении.
+        '''
+        snapshot = self.snapshots.get(target_key, {})
+        for offer in [offer for offer in snapshot if not keep(offer)]:
+            del snapshot[offer]
+
+    def dump(self, keys: Optional[Iterable[str]] = None) -> dict[str, list]:
+        '''
+        Снимки (все или с ключами keys) в виде, пригодном для JSON: ключ
+        снимка - список [сервис, страна, цена, количество].
+        '''
+        snapshots = self.snapshots if keys is None \
+            else {key: self.snapshots.get(key) for key in keys}
+        return {key: [[*offer, *state] for offer, state in snapshot.items()]
+                for key, snapshot in snapshots.items() if snapshot}
+
+    def discard(self, key: str) -> None:
+        self.snapshots.pop(key, None)
+
+    def restore(self, saved: dict[str, list]) -> None:
+        for key, offers in saved.items():
+            self.snapshots[key] = {(service, country): (price, count)
+                                   for service, country, price, count
+                                   in offers}
+
+
+def format_changes(changes: Iterable[OfferChange]) -> str:
+    '''
+    Формирует текст уведомления об изменениях. Одинаковые изменения от
+    разных аккаунтов одного поставщика выводятся один раз.
+    '''
+    lines = {}
+    for change in changes:
+        lines.setdefault((change.kind, change.service, change.country,
+                          change.provider),
+                         change.describe())
+    return "\n".join(lines.values())
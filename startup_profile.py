@@ -0,0 +1,113 @@
+'''
+Профиль запуска бота: время импорта модулей main (python -X importtime,
+с группировкой по пакетам верхнего уровня) и время этапов инициализации
+из main.main: load_config, build_checker, импорт aiogram и build_app.
+Сеть не используется: опрос и Telegram не запускаются. Если настройки из
+окружения и .env не загружаются, используются тестовые.
+
+    python -m startup_profile [--top 15]
+'''
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from importlib import import_module
+from typing import Callable
+
+
+def import_profile(module: str) -> list[tuple[str, int, int]]:
+    '''
+    Импорты module в новом интерпретаторе: (модуль, собственное время,
+    время вместе с вложенными импортами) в микросекундах, в порядке
+    завершения импорта.
+    '''
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import {module}'],
+                            capture_output=True, text=True,
+                            check=True).stderr
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(own), int(cumulative)))
+    return rows
+
+
+def by_package(rows: list[tuple[str, int, int]]) -> dict[str, int]:
+    '''
+    Собственное время импорта, просуммированное по пакетам верхнего
+    уровня.
+    '''
+    packages: dict[str, int] = {}
+    for name, own, _ in rows:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + own
+    return dict(sorted(packages.items(), key=lambda item: -item[1]))
+
+
+def init_profile() -> list[tuple[str, float]]:
+    '''
+    Время этапов запуска main в секундах (в этом процессе).
+    '''
+    stages = []
+
+    def stage(name: str, function: Callable):
+        started = time.perf_counter()
+        result = function()
+        stages.append((name, time.perf_counter() - started))
+        return result
+
+    main = stage('import main', lambda: import_module('main'))
+    from pydantic import ValidationError
+    from config import Settings
+    try:
+        settings = stage('load_config', main.load_config)
+    except ValidationError:
+        print("Настройки не загружены, используются тестовые\n")
+        url = "http://localhost/stubs/handler_api.php?api_key=profile"
+        settings = Settings(
+            _env_file=None,
+            token='123456:profile',
+            admin_id=1,
+            url_sms_activate=f"{url}&action=getTopCountriesByService"
+                             "&service=ig",
+            url_api_sms=f"{url}&action=getBalance",
+            watch_rules=[{"service": "ig", "country": 137, "max_price": 9}],
+            history_path='',
+            state_path='',
+            subscriptions_path='',
+        )
+    checker = stage('build_checker', lambda: main.build_checker(settings))
+    stage('import aiogram', lambda: import_module('aiogram'))
+    stage('build_app', lambda: main.build_app(settings, checker=checker))
+    number_checker = checker[0]
+    if number_checker.history is not None:
+        asyncio.run(number_checker.history.close())
+    return stages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    rows = import_profile('main')
+    total = max((cumulative for _, _, cumulative in rows), default=0)
+    print(f"Импорт main: {total / 1000:.1f} мс\n")
+    print("Пакеты (собственное время импорта, мс):")
+    for package, own in list(by_package(rows).items())[:args.top]:
+        print(f"  {package:<28} {own / 1000:8.1f}")
+    print("\nМодули (с вложенными импортами, мс):")
+    for name, _, cumulative in sorted(rows, key=lambda row: -row[2])[
+            :args.top]:
+        print(f"  {name:<40} {cumulative / 1000:8.1f}")
+
+    print("\nЭтапы запуска (мс):")
+    for name, seconds in init_profile():
+        print(f"  {name:<28} {seconds * 1000:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import re
+from typing import Any, Optional
+from offers import DEFAULT_PROVIDER, Offer, loads, parse_offer
+
+
+# Регулярные выражения используют захватывающие (possessive) кванторы:
+# без возвратов они проходят мегабайты ответа со скоростью, сравнимой с
+# json.loads.
+_STRING = rb'"[^"\\]*+(?:\\.[^"\\]*+)*+"'
+# Плоский объект без вложенных контейнеров - запись о стране
+_LEAF_BODY = rb'\{[^{}\[\]"]*+(?:' + _STRING + rb'[^{}\[\]"]*+)*+'
+_LEAF = _LEAF_BODY + rb'\}'
+# Лексемы: серия подряд идущих записей (вместе с ключами и запятыми),
+# строка (в том числе недописанная в конце буфера) и скобка. Числа и
+# прочие лексемы на структуру не влияют и пропускаются. Серия записей -
+# одна лексема, поэтому цикл на Python не проходит по каждой записи.
+_TOKEN = re.compile(
+    rb'(?P<leaves>(?:[\s,]*+(?:' + _STRING + rb'\s*+:\s*+)?+' + _LEAF
+    + rb')++)'
+    rb'|"[^"\\]*+(?:\\.[^"\\]*+)*+(?:"|\\?\Z)|[{}\[\]]'
+)
+_LEAF_PREFIX = re.compile(_LEAF_BODY)
+_LEAF_RE = re.compile(_LEAF)
+_ITEM = re.compile(rb'[\s,]*+(?:' + _STRING + rb'\s*+:\s*+)?+(' + _LEAF
+                   + rb')')
+
+
+def _candidates(countries: set[int]) -> re.Pattern:
+    '''
+    Регулярное выражение для поля country с одной из стран countries.
+    '''
+    alternatives = b'|'.join(str(country).encode()
+                             for country in sorted(countries))
+    return re.compile(rb'"country"\s*+:\s*+(?:' + alternatives
+                      + rb')(?![\d.])')
+
+
+class PayloadScanner:
+    '''
+    Потоковый разбор ответа getTopCountriesByService по частям.
+    Полностью декодируются только «листовые» объекты (записи о стране), и
+    только если страна записи есть среди wanted для её сервиса; записи
+    проверяются при декодировании и становятся Offer, некорректные
+    считаются в rejected. Когда все
+    нужные страны всех сервисов встречены, done становится True и чтение
+    ответа можно прекратить: в ответе каждая страна сервиса встречается
+    один раз.
+
+    service - сервис, к которому относится ответ по одному сервису; в
+    ответе по всем сервисам сервис записи берется из ключа верхнего уровня.
+    wanted=None - декодировать все записи без раннего выхода. provider -
+    поставщик, которым помечаются предложения.
+    '''
+    def __init__(self,
+                 service: str,
+                 wanted: Optional[dict[str, set[int]]] = None,
+                 provider: str = DEFAULT_PROVIDER):
+        self.service = service
+        self.wanted = wanted
+        self.provider = provider
+        self.remaining = None if wanted is None else \
+            {key: set(value) for key, value in wanted.items() if value}
+        self.entries: list[Offer] = []
+        self.rejected = 0
+        # Недоразобранный хвост: недописанная строка или запись
+        self._buffer = b''
+        # Для каждого открытого контейнера: ключ, под которым он лежит
+        self._stack: list[Optional[bytes]] = []
+        self._last_string: Optional[bytes] = None
+        self._seen_structure = False
+        self._head = b''
+        self._patterns: dict[str, re.Pattern] = {}
+
+    @property
+    def done(self) -> bool:
+        return self.remaining is not None and not self.remaining
+
+    def feed(self, chunk: bytes) -> None:
+        '''
+        Обрабатывает очередную часть ответа.
+        '''
+        if len(self._head) < 200:
+            self._head += chunk[:200 - len(self._head)]
+        buffer = self._buffer + chunk
+        resume = len(buffer)
+        for token in _TOKEN.finditer(buffer):
+            if token.lastgroup == 'leaves':
+                self._seen_structure = True
+                self._last_string = None
+                if self._stack:
+                    self._on_leaves(buffer, token.start(), token.end())
+                    if self.done:
+                        self._buffer = b''
+                        return
+                continue
+            value = token.group()
+            first = value[:1]
+            if first == b'"':
+                if len(value) == 1 or not value.endswith(b'"') \
+                        or _escaped_quote(value):
+                    resume = token.start()
+                    break
+                self._last_string = value
+                continue
+            if first == b'{':
+                # Префикс записи останавливается на вложенной скобке, на
+                # конце буфера или на недописанной строке
+                stop = _LEAF_PREFIX.match(buffer, token.start()).end()
+                if stop == len(buffer) or buffer[stop:stop + 1] == b'"':
+                    # Запись о стране еще не дочитана
+                    resume = token.start()
+                    break
+            self._seen_structure = True
+            if first in b'{[':
+                self._stack.append(self._last_string if self._stack
+                                   else None)
+            elif self._stack:
+                self._stack.pop()
+            self._last_string = None
+        self._buffer = buffer[resume:]
+
+    def close(self) -> list[Offer]:
+        '''
+        Завершает разбор и возвращает предложения.
+        Если ответ не является JSON-объектом или списком, выбрасывает
+        ValueError.
+        '''
+        if not self._seen_structure:
+            text = self._head.decode('utf-8', errors='replace')
+            raise ValueError(f"Невозможно обработать ответ: {text}")
+        if self._stack and not self.done:
+            raise ValueError("Ответ API обрывается на середине")
+        return self.entries
+
+    def _entry_service(self) -> Optional[str]:
+        # Вложенность записей: [корень, (сервис,)..., запись]
+        if len(self._stack) >= 2 and self._stack[1] is not None:
+            return self._stack[1][1:-1].decode('utf-8', errors='replace')
+        return self.service
+
+    def _on_leaves(self, buffer: bytes, start: int, end: int) -> None:
+        '''
+        Обрабатывает серию записей buffer[start:end]. Если заданы нужные
+        страны, серия сначала целиком проверяется регулярным выражением
+        по полю country, и декодируются только записи вокруг совпадений.
+        '''
+        service = self._entry_service()
+        if self.wanted is None:
+            for item in _ITEM.finditer(buffer, start, end):
+                self._add(service, loads(item.group(1)))
+            return
+        countries = self.wanted.get(service)
+        if not countries:
+            return
+        pattern = self._patterns.get(service)
+        if pattern is None:
+            pattern = self._patterns[service] = _candidates(countries)
+        try:
+            entries = [loads(self._leaf_around(buffer, start, hit))
+                       for hit in pattern.finditer(buffer, start, end)]
+        except ValueError:
+            # Фигурная скобка внутри строки: точный, но медленный путь
+            entries = [loads(item.group(1))
+                       for item in _ITEM.finditer(buffer, start, end)
+                       if pattern.search(item.group(1))]
+        for entry in entries:
+            self._add(service, entry, countries)
+            if self.done:
+                return
+
+    @staticmethod
+    def _leaf_around(buffer: bytes, start: int, hit: re.Match) -> bytes:
+        '''
+        Запись, содержащая совпадение hit. Если запись определить не
+        удалось, выбрасывает ValueError.
+        '''
+        leaf_start = buffer.rfind(b'{', start, hit.start())
+        leaf = _LEAF_RE.match(buffer, leaf_start) if leaf_start >= 0 \
+            else None
+        if leaf is None or leaf.end() < hit.end():
+            raise ValueError("Запись не найдена")
+        return leaf.group()
+
+    def _add(self,
+             service: str,
+             entry: Any,
+             countries: Optional[set[int]] = None) -> None:
+        if not isinstance(entry, dict) or 'country' not in entry:
+            return
+        country = entry['country']
+        if countries is not None \
+                and (type(country) is not int or country not in countries):
+            return
+        offer = parse_offer(service, entry, self.provider)
+        if offer is None:
+            self.rejected += 1
+        else:
+            self.entries.append(offer)
+        # Запись страны встречена, даже если она некорректна
+        if self.remaining is not None:
+            remaining = self.remaining.get(service)
+            if remaining is not None:
+                remaining.discard(country)
+                if not remaining:
+                    del self.remaining[service]
+
+
+def _escaped_quote(value: bytes) -> bool:
+    '''
+    Заканчивается ли строка экранированной кавычкой (строка не дописана).
+    '''
+    backslashes = len(value) - 1 - len(value[:-1].rstrip(b'\\'))
+    return backslashes % 2 == 1
@@ -0,0 +1,118 @@
+import json
+import os
+from collections import defaultdict
+from typing import Iterable, Optional
+from watch_rules import Match, WatchEngine, WatchRule, parse_rules
+
+
+class SubscriptionRegistry:
+    '''
+    Подписчики и их правила отслеживания. Все правила собираются в один
+    WatchEngine (индекс сервис -> страна -> правила), поэтому ответ API
+    проверяется один раз на всех, а каждое срабатывание по rule.chat_id
+    попадает только к владельцу правила. Правила из настроек (без
+    chat_id) принадлежат администратору и командами не меняются; правила,
+    добавленные командами, сохраняются в файл path.
+    '''
+    def __init__(self,
+                 admin_id: int,
+                 rules: Iterable[WatchRule] = (),
+                 path: Optional[str] = None,
+                 allowed: Iterable[int] = ()):
+        self.admin_id = admin_id
+        self.path = path
+        self.allowed = {admin_id, *allowed}
+        self.base_rules = [rule.model_copy(update={'chat_id': admin_id})
+                           if rule.chat_id is None else rule
+                           for rule in rules]
+        self.rules: list[WatchRule] = []
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                self.rules = parse_rules(file.read())
+        self._engine: Optional[WatchEngine] = None
+
+    @property
+    def engine(self) -> WatchEngine:
+        '''
+        Общий индекс правил всех подписчиков; перестраивается только после
+        изменения правил.
+        '''
+        if self._engine is None:
+            self._engine = WatchEngine(self.base_rules + self.rules)
+        return self._engine
+
+    def is_allowed(self, chat_id: int) -> bool:
+        return chat_id in self.allowed
+
+    def rules_of(self, chat_id: int) -> list[WatchRule]:
+        '''
+        Все правила подписчика: из настроек и добавленные командами.
+        '''
+        return [rule for rule in self.base_rules + self.rules
+                if rule.chat_id == chat_id]
+
+    def add(self, rule: WatchRule) -> None:
+        '''
+        Добавляет правило подписчика rule.chat_id. Правило для той же пары
+        (сервис, страна) заменяет прежнее.
+        '''
+        self.rules = [old for old in self.rules
+                      if (old.chat_id, old.service, old.country)
+                      != (rule.chat_id, rule.service, rule.country)]
+        self.rules.append(rule)
+        self._changed()
+
+    def remove(self,
+               chat_id: int,
+               service: str,
+               country: Optional[int] = None) -> int:
+        '''
+        Удаляет правила подписчика по сервису (и стране, если указана).
+        Возвращает число удаленных правил.
+        '''
+        kept = [rule for rule in self.rules
+                if rule.chat_id != chat_id or rule.service != service
+                or country is not None and rule.country != country]
+        removed = len(self.rules) - len(kept)
+        if removed:
+            self.rules = kept
+            self._changed()
+        return removed
+
+    def dump(self) -> str:
+        '''
+        Правила, добавленные командами, JSON-списком (как в файле path).
+        '''
+        return json.dumps([rule.model_dump() for rule in self.rules],
+                          ensure_ascii=False, indent=1)
+
+    def load(self, text: str) -> None:
+        '''
+        Заменяет правила, добавленные командами, правилами из JSON-списка
+        text (например, общими правилами воркеров).
+        '''
+        self.rules = parse_rules(text)
+        self._changed()
+
+    def _changed(self) -> None:
+        self._engine = None
+        if self.path:
+            # Запись через временный файл: при сбое старый файл не теряется
+            temp = f"{self.path}.tmp"
+            with open(temp, 'w', encoding='utf-8') as file:
+                file.write(self.dump())
+            os.replace(temp, self.path)
+
+
+def fan_out(matches: Iterable[Match],
+            default_chat: Optional[int] = None) -> dict[Optional[int],
+                                                       list[Match]]:
+    '''
+    Группирует срабатывания по чатам владельцев правил. Стоимость
+    пропорциональна числу срабатываний, а не числу подписчиков.
+    '''
+    chats: dict[Optional[int], list[Match]] = defaultdict(list)
+    for match in matches:
+        chat_id = match.rule.chat_id
+        chats[default_chat if chat_id is None else chat_id].append(match)
+    return chats
@@ -0,0 +1,102 @@
+import hashlib
+from typing import Any, Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from offers import DEFAULT_PROVIDER
+
+
+class WatchTarget:
+    '''
+    Цель опроса: запрос списка предложений одного сервиса у поставщика
+    provider от имени одного аккаунта (API-ключа).
+    '''
+    __slots__ = ('service', 'account', 'url', 'provider')
+
+    def __init__(self,
+                 service: str,
+                 account: str,
+                 url: str,
+                 provider: str = DEFAULT_PROVIDER):
+        self.service = service
+        self.account = account
+        self.url = url
+        self.provider = provider
+
+    @property
+    def key(self) -> str:
+        return f"{self.account}:{self.service}"
+
+    def __repr__(self) -> str:
+        return f"WatchTarget({self.key!r})"
+
+
+class PollResult:
+    '''
+    Результат опроса одной цели: предложения ответа, нужные правилам
+    (список Offer), либо исключение, срабатывания правил и признак
+    изменения этих записей с прошлого опроса. fetched_at - момент
+    получения ответа по монотонным часам.
+    '''
+    __slots__ = ('target', 'payload', 'error', 'matches', 'changed',
+                 'fetched_at')
+
+    def __init__(self,
+                 target: WatchTarget,
+                 payload: Any = None,
+                 error: Optional[BaseException] = None):
+        self.target = target
+        self.payload = payload
+        self.error = error
+        self.matches: list = []
+        self.changed = False
+        self.fetched_at = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def with_query(url: str, **params: str) -> str:
+    '''
+    Возвращает URL с заменёнными параметрами запроса.
+    '''
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query.update(params)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def account_label(api_key: str) -> str:
+    '''
+    Короткое обозначение аккаунта без раскрытия API-ключа: начало хеша
+    всего ключа, поэтому ключи с одинаковым окончанием не совпадают.
+    '''
+    if not api_key:
+        return "default"
+    return "#" + hashlib.sha256(api_key.encode()).hexdigest()[:8]
+
+
+def build_targets(url_template: str,
+                  services: Iterable[str],
+                  api_keys: Iterable[str] = (),
+                  provider: str = DEFAULT_PROVIDER) -> list[WatchTarget]:
+    '''
+    Строит цели опроса для каждой пары (аккаунт, сервис) на основе
+    URL_SMS_ACTIVATE. Если дополнительные API-ключи не заданы, используется
+    ключ из самого URL. Аккаунты других поставщиков обозначаются с
+    именем поставщика, ключи целей SMS Activate не меняются.
+    '''
+    prefix = '' if provider == DEFAULT_PROVIDER else f"{provider}/"
+    keys = list(api_keys) or [
+        dict(parse_qsl(urlsplit(url_template).query)).get('api_key', '')
+    ]
+    targets = []
+    for api_key in keys:
+        for service in dict.fromkeys(services):
+            params = {'service': service}
+            if api_key:
+                params['api_key'] = api_key
+            targets.append(WatchTarget(service,
+                                       prefix + account_label(api_key),
+                                       with_query(url_template, **params),
+                                       provider))
+    return targets
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from dataclasses import astuple
+from typing import TYPE_CHECKING, Any, Callable, Optional
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':'))
+
+
+class StateStore:
+    '''
+    Состояние бота между перезапусками в файле SQLite: разделы (снимки,
+    расписание, отпечатки уведомлений, FSM) из пар ключ - значение JSON.
+    Компоненты регистрируют функции dump и restore; checkpoint сравнивает
+    текущее состояние с записанным и пишет только изменившиеся ключи
+    одной транзакцией, поэтому сбой во время записи оставляет предыдущую
+    контрольную точку целой. Запись выполняется в отдельном потоке.
+    '''
+    def __init__(self, path: str, interval: float = 5):
+        self.path = path
+        self.interval = interval
+        self._db: Optional[sqlite3.Connection] = None
+        self._sections: dict[str, Callable[[], dict[str, Any]]] = {}
+        # Последнее записанное значение каждого ключа по разделам
+        self._written: dict[str, dict[str, str]] = {}
+        for section, key, value in self._connect().execute(
+                "SELECT section, key, value FROM state"):
+            self._written.setdefault(section, {})[key] = value
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        '''
+        Открывает файл; после close он открывается снова при следующей
+        записи (Dispatcher может запускаться повторно).
+        '''
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS state ("
+                             "section TEXT NOT NULL, key TEXT NOT NULL, "
+                             "value TEXT NOT NULL, "
+                             "PRIMARY KEY (section, key)) WITHOUT ROWID")
+        return self._db
+
+    def register(self,
+                 section: str,
+                 dump: Callable[[], dict[str, Any]],
+                 restore: Callable[[dict[str, Any]], None]) -> None:
+        '''
+        Подключает раздел и сразу восстанавливает его из файла.
+        '''
+        self._sections[section] = dump
+        saved = self._written.get(section)
+        if not saved:
+            return
+        try:
+            restore({key: json.loads(value) for key, value in saved.items()})
+        except (ValueError, TypeError, KeyError):
+            logging.exception("Не удалось восстановить раздел %s", section)
+
+    def _collect(self) -> dict[str, dict[str, Optional[str]]]:
+        '''
+        Изменения с прошлой контрольной точки: новое значение или None
+        для удаленного ключа.
+        '''
+        changes: dict[str, dict[str, Optional[str]]] = {}
+        for section, dump in self._sections.items():
+            written = self._written.get(section, {})
+            current = {}
+            for key, value in dump().items():
+                try:
+                    current[key] = _encode(value)
+                except (TypeError, ValueError):
+                    logging.warning("Состояние %s/%s не сохраняется: "
+                                    "значение не сериализуется в JSON",
+                                    section, key)
+            changed: dict[str, Optional[str]] = {
+                key: value for key, value in current.items()
+                if written.get(key) != value
+            }
+            changed.update((key, None) for key in written
+                           if key not in current)
+            if changed:
+                changes[section] = changed
+        return changes
+
+    def _write(self, changes: dict[str, dict[str, Optional[str]]]) -> None:
+        db = self._connect()
+        # В режиме autocommit транзакцию нужно открыть явно, иначе каждая
+        # строка фиксируется отдельно
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for section, items in changes.items():
+                db.executemany(
+                    "INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+                    [(section, key, value) for key, value in items.items()
+                     if value is not None])
+                db.executemany(
+                    "DELETE FROM state WHERE section = ? AND key = ?",
+                    [(section, key) for key, value in items.items()
+                     if value is None])
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    async def checkpoint(self) -> int:
+        '''
+        Записывает изменения состояния. Возвращает число записанных
+        ключей.
+        '''
+        async with self._lock:
+            changes = self._collect()
+            if not changes:
+                return 0
+            with metrics.timer('checkpoint_seconds'):
+                write = asyncio.ensure_future(
+                    asyncio.to_thread(self._write, changes))
+                try:
+                    await asyncio.shield(write)
+                except asyncio.CancelledError:
+                    # Поток записи не прерывается: соединение нельзя
+                    # отдавать следующей записи или close, пока он пишет
+                    await write
+                    raise
+            for section, items in changes.items():
+                written = self._written.setdefault(section, {})
+                for key, value in items.items():
+                    if value is None:
+                        written.pop(key, None)
+                    else:
+                        written[key] = value
+            return sum(len(items) for items in changes.values())
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.checkpoint()
+            except sqlite3.Error:
+                metrics.counter('checkpoint_errors').inc()
+                logging.exception("Не удалось сохранить состояние")
+
+    async def close(self) -> None:
+        '''
+        Останавливает периодическую запись, сохраняет последнюю
+        контрольную точку и закрывает файл.
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        try:
+            await self.checkpoint()
+        finally:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SentNotifications:
+    '''
+    Отпечатки отправленных уведомлений со сроком хранения ttl секунд
+    (unix-время, чтобы срок переживал перезапуск). claim подходит для
+    NumberChecker.dedup в режиме одного воркера.
+    '''
+    def __init__(self,
+                 ttl: float = 60,
+                 clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.expires: dict[str, float] = {}
+
+    async def claim(self, fingerprint: str) -> bool:
+        now = self.clock()
+        if self.expires.get(fingerprint, 0) > now:
+            return False
+        self.expires[fingerprint] = now + self.ttl
+        return True
+
+    def dump(self) -> dict[str, float]:
+        now = self.clock()
+        self.expires = {fingerprint: expires for fingerprint, expires
+                        in self.expires.items() if expires > now}
+        return dict(self.expires)
+
+    def restore(self, saved: dict[str, float]) -> None:
+        self.expires.update(saved)
+
+
+def dump_storage(storage: 'MemoryStorage') -> dict[str, dict]:
+    '''
+    Непустые записи FSM: ключ - JSON-список полей StorageKey.
+    '''
+    return {_encode(astuple(key)): {"state": record.state,
+                                     "data": record.data}
+            for key, record in storage.storage.items()
+            if record.state is not None or record.data}
+
+
+def restore_storage(storage: 'MemoryStorage',
+                    saved: dict[str, dict]) -> None:
+    from aiogram.fsm.storage.base import StorageKey
+    for key, record in saved.items():
+        entry = storage.storage[StorageKey(*json.loads(key))]
+        entry.state = record.get("state")
+        entry.data = record.get("data") or {}
@@ -0,0 +1,284 @@
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Literal, Optional
+from urllib.parse import parse_qs, urlsplit
+from pydantic import BaseModel, Field, TypeAdapter
+from offers import DEFAULT_PROVIDER, Offer, parse_offer
+
+if TYPE_CHECKING:
+    from rolling_stats import RollingStats
+
+
+class StatCondition(BaseModel):
+    '''
+    Условие по скользящей статистике пары (сервис, страна) за window
+    секунд. Для min, max, mean и квантилей pNN (p50 - медиана) поле field
+    предложения сравнивается (op) со статистикой, умноженной на value:
+    {"stat": "p50", "value": 0.7} - цена на 30% ниже медианы за сутки. Для
+    change (относительное изменение за окно) и rate (изменение в час) с
+    value сравнивается сама статистика. Пока в окне меньше min_samples
+    замеров, условие не выполняется.
+    '''
+    stat: str = Field(pattern=r'^(min|max|mean|change|rate|p\d{1,2})$')
+    field: Literal['price', 'count'] = 'price'
+    window: float = 86400
+    op: Literal['<=', '>='] = '<='
+    value: float = 1.0
+    min_samples: int = 10
+
+    def holds(self, offer: Offer, stats: 'RollingStats') -> bool:
+        current = stats.value(offer.service, offer.country, self.field,
+                              self.stat, self.window, self.min_samples)
+        if current is None:
+            return False
+        if self.stat in ('change', 'rate'):
+            left, right = current, self.value
+        else:
+            left, right = getattr(offer, self.field), self.value * current
+        return left <= right if self.op == '<=' else left >= right
+
+    def describe(self) -> str:
+        if self.stat in ('change', 'rate'):
+            return (f"{self.stat} {self.field} за {self.window:g} с "
+                    f"{self.op} {self.value:g}")
+        return (f"{self.field} {self.op} {self.value:g} × {self.stat} за "
+                f"{self.window:g} с")
+
+
+class WatchRule(BaseModel):
+    '''
+    Правило отслеживания: номера сервиса service в стране country по цене
+    не выше max_price в количестве не меньше min_count. chat_id - чат
+    подписчика, которому приходят срабатывания (None - администратор).
+    auto_buy - покупать номер сразу при появлении предложения (только для
+    правил администратора), max_spend - предел трат по правилу за окно
+    автопокупки. conditions - условия по скользящей статистике (все
+    должны выполняться вместе с max_price и min_count).
+    '''
+    service: str
+    country: int
+    max_price: float
+    min_count: int = 1
+    chat_id: Optional[int] = None
+    auto_buy: bool = False
+    max_spend: Optional[float] = None
+    conditions: list[StatCondition] = []
+
+
+class Match:
+    '''
+    Срабатывание правила на конкретной записи ответа API поставщика
+    provider.
+    '''
+    __slots__ = ('rule', 'service', 'country', 'price', 'count', 'provider')
+
+    def __init__(self,
+                 rule: WatchRule,
+                 service: str,
+                 country: int,
+                 price: float,
+                 count: int,
+                 provider: str = DEFAULT_PROVIDER):
+        self.rule = rule
+        self.service = service
+        self.country = country
+        self.price = price
+        self.count = count
+        self.provider = provider
+
+    def __repr__(self) -> str:
+        return (f"Match(service={self.service!r}, country={self.country}, "
+                f"price={self.price}, count={self.count}, "
+                f"provider={self.provider!r})")
+
+
+_rules_adapter = TypeAdapter(list[WatchRule])
+
+
+def parse_rules(raw: str) -> list[WatchRule]:
+    '''
+    Разбирает список правил из JSON-строки.
+    '''
+    return _rules_adapter.validate_json(raw)
+
+
+def load_rules(path: str) -> list[WatchRule]:
+    '''
+    Загружает список правил из JSON-файла.
+    '''
+    with open(path, encoding='utf-8') as file:
+        return parse_rules(file.read())
+
+
+def service_from_url(url: str) -> str:
+    '''
+    Возвращает код сервиса из параметра service URL запроса к API.
+    '''
+    return parse_qs(urlsplit(url).query).get('service', [''])[0]
+
+
+def iter_entries(payload: Any,
+                 service: str) -> Iterator[tuple[str, dict]]:
+    '''
+    Перебирает записи ответа getTopCountriesByService как пары
+    (сервис, запись). Поддерживает ответ по одному сервису (словарь или
+    список записей) и ответ по всем сервисам, где записи сгруппированы по
+    коду сервиса.
+    '''
+    items = payload.items() if isinstance(payload, dict) \
+        else enumerate(payload)
+    for key, value in items:
+        if isinstance(value, dict) and 'country' in value:
+            yield service, value
+        elif isinstance(value, (dict, list)):
+            for entry in (value.values() if isinstance(value, dict)
+                          else value):
+                if isinstance(entry, dict):
+                    yield str(key), entry
+
+
+class WatchEngine:
+    '''
+    Набор правил, скомпилированный в индекс сервис -> страна -> правила.
+    Правила одной пары (сервис, страна) отсортированы по убыванию
+    max_price, поэтому за один проход по ответу API находятся все
+    срабатывания за O(размер ответа + число срабатываний).
+    '''
+    def __init__(self, rules: Iterable[WatchRule]):
+        self.rules = list(rules)
+        self._index: dict[str, dict[int, list[WatchRule]]] = {}
+        for rule in self.rules:
+            self._index.setdefault(rule.service, {}) \
+                .setdefault(rule.country, []).append(rule)
+        for countries in self._index.values():
+            for bucket in countries.values():
+                bucket.sort(key=lambda rule: rule.max_price, reverse=True)
+
+    @property
+    def services(self) -> list[str]:
+        '''
+        Сервисы, для которых есть хотя бы одно правило.
+        '''
+        return list(self._index)
+
+    @property
+    def windows(self) -> set[float]:
+        '''
+        Окна скользящей статистики, на которые ссылаются условия правил.
+        '''
+        return {condition.window for rule in self.rules
+                for condition in rule.conditions}
+
+    def countries(self, service: str) -> set[int]:
+        '''
+        Страны, для которых есть правила сервиса.
+        '''
+        return set(self._index.get(service, ()))
+
+    def rules_for(self,
+                  service: str,
+                  country: int) -> list[WatchRule]:
+        '''
+        Правила для пары (сервис, страна), по убыванию max_price.
+        '''
+        return self._index.get(service, {}).get(country, [])
+
+    def match_offer(self,
+                    offer: Offer,
+                    countries: Optional[dict[int, list[WatchRule]]] = None,
+                    stats: Optional['RollingStats'] = None) -> list[Match]:
+        '''
+        Проверяет одно предложение против правил его сервиса и страны.
+        Правила с условиями по статистике без stats не срабатывают.
+        '''
+        if countries is None:
+            countries = self._index.get(offer.service)
+            if not countries:
+                return []
+        bucket = countries.get(offer.country)
+        if not bucket:
+            return []
+        price = offer.price
+        count = offer.count
+        matches = []
+        for rule in bucket:
+            if rule.max_price < price:
+                break
+            if count < rule.min_count:
+                continue
+            if rule.conditions and (stats is None or not all(
+                    condition.holds(offer, stats)
+                    for condition in rule.conditions)):
+                continue
+            matches.append(Match(rule, offer.service, offer.country,
+                                 price, count, offer.provider))
+        return matches
+
+    def offers(self, payload: Any, service: str = '') -> Iterator[Offer]:
+        '''
+        Проверенные предложения ответа getTopCountriesByService только для
+        пар (сервис, страна), на которые есть правила: остальные записи не
+        проверяются и не превращаются в Offer.
+        '''
+        index = self._index
+        for entry_service, entry in iter_entries(payload, service):
+            countries = index.get(entry_service)
+            if not countries:
+                continue
+            country = entry.get('country')
+            if type(country) is int and country in countries:
+                offer = parse_offer(entry_service, entry)
+                if offer is not None:
+                    yield offer
+
+    def evaluate(self,
+                 payload: Any,
+                 service: str = '',
+                 stats: Optional['RollingStats'] = None) -> list[Match]:
+        '''
+        Находит все срабатывания правил в ответе getTopCountriesByService.
+        service - сервис, к которому относится ответ по одному сервису.
+        '''
+        return self.evaluate_offers(self.offers(payload, service), stats)
+
+    def evaluate_offers(self,
+                        offers: Iterable[Offer],
+                        stats: Optional['RollingStats'] = None
+                        ) -> list[Match]:
+        '''
+        Находит все срабатывания правил среди предложений; stats - для
+        правил с условиями по скользящей статистике.
+        '''
+        matches: list[Match] = []
+        index = self._index
+        for offer in offers:
+            countries = index.get(offer.service)
+            if countries:
+                matches.extend(self.match_offer(offer, countries, stats))
+        return matches
+
+
+def provider_label(provider: str) -> str:
+    '''
+    Пометка поставщика в тексте уведомления (у SMS Activate ее нет).
+    '''
+    return "" if provider == DEFAULT_PROVIDER else f" ({provider})"
+
+
+def format_matches(matches: list[Match]) -> str:
+    '''
+    Формирует текст уведомления со всеми срабатываниями. Для каждой пары
+    (сервис, страна) выводится самое дешевое предложение среди всех
+    поставщиков и аккаунтов; запись, на которой сработало несколько
+    правил, выводится один раз.
+    '''
+    best: dict[tuple[str, int], Match] = {}
+    for match in matches:
+        key = (match.service, match.country)
+        if key not in best or match.price < best[key].price:
+            best[key] = match
+    return "\n".join(
+        f"{match.service}, страна {match.country}: доступно "
+        f"{match.count} номеров по цене {match.price}"
+        f"{provider_label(match.provider)}"
+        for match in best.values()
+    )
+
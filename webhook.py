@@ -0,0 +1,70 @@
+import asyncio
+import secrets
+import ssl
+from typing import Optional
+from urllib.parse import urlsplit
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import FSInputFile
+from aiogram.webhook.aiohttp_server import (SimpleRequestHandler,
+                                            setup_application)
+from config import Settings
+
+
+def ssl_context(cert: Optional[str],
+                key: Optional[str]) -> Optional[ssl.SSLContext]:
+    '''
+    TLS-контекст веб-сервера, если заданы сертификат и ключ.
+    '''
+    if not cert or not key:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def start_webhook(dp: Dispatcher,
+                        bot: Bot,
+                        settings: Settings) -> web.AppRunner:
+    '''
+    Запускает веб-сервер, принимающий обновления Telegram по WEBHOOK_URL,
+    в текущем цикле событий, и регистрирует webhook при запуске
+    Dispatcher. Запросы без верного секретного токена (заголовок
+    X-Telegram-Bot-Api-Secret-Token) отклоняются. Обработчики запуска и
+    остановки Dispatcher (закрытие HTTP-клиента проверщика и очереди
+    сообщений) выполняются вместе с запуском и остановкой веб-сервера.
+    '''
+    secret = settings.webhook_secret or secrets.token_urlsafe(32)
+    path = urlsplit(settings.webhook_url).path or '/'
+
+    async def register_webhook(bot: Bot) -> None:
+        certificate = FSInputFile(settings.webhook_ssl_cert) \
+            if settings.webhook_ssl_cert else None
+        await bot.set_webhook(settings.webhook_url,
+                              certificate=certificate,
+                              secret_token=secret)
+
+    dp.startup.register(register_webhook)
+    app = web.Application()
+    SimpleRequestHandler(dp, bot, secret_token=secret).register(app, path)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner,
+                       settings.webhook_host,
+                       settings.webhook_port,
+                       ssl_context=ssl_context(settings.webhook_ssl_cert,
+                                               settings.webhook_ssl_key))
+    await site.start()
+    return runner
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, settings: Settings) -> None:
+    '''
+    Работает в режиме webhook до отмены задачи.
+    '''
+    runner = await start_webhook(dp, bot, settings)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()